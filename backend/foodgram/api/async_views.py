@@ -0,0 +1,206 @@
+"""Асинхронные представления только для чтения (ASGI).
+
+Аутентификация, права, фильтры, сортировка, ?fields=/?expand=,
+пагинация и сериализаторы - те же, что у RecipeViewSet, TagViewSet
+и IngredientViewSet: для запроса строится вьюсет, и его код выполняется
+в потоке. Основные запросы (строки страницы, счётчик) идут через
+асинхронный ORM и не занимают поток на время ожидания БД.
+"""
+from collections import OrderedDict
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.db.models import prefetch_related_objects
+from django.http import Http404, HttpResponseNotAllowed
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+from api.replicas import read_from_replica
+from api.views import IngredientViewSet, RecipeViewSet, TagViewSet
+
+
+def async_get(view):
+    # require_GET из Django 4.2 превращает корутину в синхронное
+    # представление; чтения, как у ReplicaReadMixin, идут на реплику
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return HttpResponseNotAllowed(['GET', 'HEAD'])
+        with read_from_replica():
+            return await view(request, *args, **kwargs)
+    return wrapper
+
+
+def finish(view, response):
+    return view.finalize_response(view.request, response).render()
+
+
+def error_response(view, exc):
+    """Ошибка в том же виде, что у синхронного API."""
+    return finish(view, view.handle_exception(exc))
+
+
+def prepare_view(viewset, request, action, **kwargs):
+    """Вьюсет после initial() (аутентификация, права, формат)
+    и отфильтрованный queryset действия.
+
+    Возвращает (вьюсет, queryset, keyset, ответ об ошибке); keyset -
+    queryset и сортировка keyset-страницы списка с ?cursor=.
+    """
+    view = viewset()
+    view.action_map = {'get': action, 'head': action}
+    view.args, view.kwargs = (), kwargs
+    view.request = view.initialize_request(request, **kwargs)
+    view.headers = view.default_response_headers
+    try:
+        view.initial(view.request, **kwargs)
+        queryset = view.filter_queryset(view.get_queryset())
+        keyset = None
+        if action == 'list' and view.paginator is not None:
+            keyset = view.paginator.keyset_page(queryset, view.request)
+    except Exception as exc:
+        return view, None, None, error_response(view, exc)
+    return view, queryset, keyset, None
+
+
+def without_prefetch(queryset):
+    # В Django 4.2 aiterator() и aget() не поддерживают prefetch_related:
+    # строки загружаются асинхронно, связи - в respond
+    return (queryset.prefetch_related(None),
+            queryset._prefetch_related_lookups)
+
+
+def respond(view, objects, lookups, wrap=Response, many=True):
+    """Связи, сериализатор и рендерер вьюсета для загруженных строк."""
+    try:
+        if not many:
+            view.check_object_permissions(view.request, objects)
+        prefetch_related_objects(objects if many else [objects], *lookups)
+        response = wrap(view.get_serializer(objects, many=many).data)
+    except Exception as exc:
+        response = view.handle_exception(exc)
+    return finish(view, response)
+
+
+def page_links(request, query_param, page, last_page):
+    url = request.build_absolute_uri()
+    previous = None
+    if page > 1:
+        previous = (remove_query_param(url, query_param) if page == 2
+                    else replace_query_param(url, query_param, page - 1))
+    next_link = None
+    if page < last_page:
+        next_link = replace_query_param(url, query_param, page + 1)
+    return next_link, previous
+
+
+def parse_page(paginator, value, last_page):
+    if value in paginator.last_page_strings:
+        return last_page
+    try:
+        page = int(value)
+    except (TypeError, ValueError):
+        return None
+    return page if 1 <= page <= last_page else None
+
+
+async def page_number_response(view, queryset):
+    """?page=&limit= как у PageNumberPagination, но с acount()."""
+    paginator, request = view.paginator, view.request
+    limit = paginator.get_page_size(request)
+    count = await queryset.acount()
+    last_page = max((count + limit - 1) // limit, 1)
+    page = parse_page(
+        paginator,
+        request.query_params.get(paginator.page_query_param, 1),
+        last_page
+    )
+    if page is None:
+        return await sync_to_async(error_response)(
+            view, NotFound(paginator.invalid_page_message)
+        )
+    queryset, lookups = without_prefetch(queryset)
+    offset = (page - 1) * limit
+    objects = [
+        item async for item in queryset[offset:offset + limit].aiterator()
+    ]
+    next_link, previous = page_links(
+        request, paginator.page_query_param, page, last_page
+    )
+
+    def wrap(data):
+        return Response(OrderedDict([
+            ('count', count),
+            ('next', next_link),
+            ('previous', previous),
+            ('results', data),
+        ]))
+
+    return await sync_to_async(respond)(view, objects, lookups, wrap)
+
+
+async def list_response(viewset, request):
+    view, queryset, keyset, error = await sync_to_async(prepare_view)(
+        viewset, request, 'list'
+    )
+    if error is not None:
+        return error
+    paginator = view.paginator
+    if paginator is None:
+        queryset, lookups = without_prefetch(queryset)
+        objects = [item async for item in queryset.aiterator()]
+        return await sync_to_async(respond)(view, objects, lookups)
+    if keyset is None:
+        return await page_number_response(view, queryset)
+    queryset, paginator.ordering = keyset
+    queryset, lookups = without_prefetch(queryset)
+    objects = paginator.paginate_keyset(
+        [item async for item in queryset.aiterator()], view.request
+    )
+    return await sync_to_async(respond)(
+        view, objects, lookups, paginator.get_paginated_response
+    )
+
+
+async def detail_response(viewset, request, pk):
+    view, queryset, _, error = await sync_to_async(prepare_view)(
+        viewset, request, 'retrieve', pk=pk
+    )
+    if error is not None:
+        return error
+    queryset, lookups = without_prefetch(queryset)
+    try:
+        instance = await queryset.aget(pk=pk)
+    except queryset.model.DoesNotExist:
+        return await sync_to_async(error_response)(view, Http404())
+    return await sync_to_async(respond)(view, instance, lookups, many=False)
+
+
+@async_get
+async def recipe_list(request):
+    return await list_response(RecipeViewSet, request)
+
+
+@async_get
+async def recipe_detail(request, pk):
+    return await detail_response(RecipeViewSet, request, pk)
+
+
+@async_get
+async def tag_list(request):
+    return await list_response(TagViewSet, request)
+
+
+@async_get
+async def tag_detail(request, pk):
+    return await detail_response(TagViewSet, request, pk)
+
+
+@async_get
+async def ingredient_list(request):
+    return await list_response(IngredientViewSet, request)
+
+
+@async_get
+async def ingredient_detail(request, pk):
+    return await detail_response(IngredientViewSet, request, pk)
@@ -0,0 +1,225 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Max
+from django.http import HttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils.cache import (get_conditional_response, patch_cache_control,
+                                patch_vary_headers)
+from django.utils.http import http_date
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from api.pagination import PageLimitPagination
+from api.utils import absolute_rendition_urls
+from recipes.cache import (CATALOGUE, RECIPE_DETAIL, get_version,
+                           get_versions, membership_version, recipe_version,
+                           record_lookup, user_version)
+from recipes.models import Recipe
+
+# Поля ответа, которые зависят от пользователя или адреса запроса
+# и подставляются в закэшированный рецепт при каждом ответе
+RECIPE_REQUEST_FIELDS = ('is_favorited', 'is_in_shopping_cart', 'image',
+                         'image_renditions')
+
+
+class ConditionalGetMixin:
+    """ETag, Last-Modified, Cache-Control и Vary для list и retrieve.
+
+    Валидаторы считаются без сериализации: одним агрегатом по
+    отфильтрованному queryset (число строк и последняя дата изменения
+    по last_modified_fields) и по версиям из recipes.cache. На
+    совпадающий If-None-Match или If-Modified-Since вьюсет отвечает 304
+    до основного запроса. Last-Modified есть только у retrieve: после
+    удаления строки максимум дат списка может уменьшиться, и проверка
+    If-Modified-Since ответила бы 304 на изменившийся список. Флаги
+    избранного, списка покупок и подписки учитываются версией наборов
+    пользователя, поэтому ответ зависит от Authorization и кэшируется
+    только в браузере.
+    """
+
+    # Поля дат изменения, можно через связи: 'author__updated_at'
+    last_modified_fields = ()
+    # Версии recipes.cache, которые меняются вместе с ответом
+    validator_versions = ()
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.get_validator_queryset()
+        # Для keyset-страницы - только её строки: COUNT по всей
+        # выборке keyset-пагинация как раз и убирает
+        if isinstance(self.paginator, PageLimitPagination):
+            keyset = self.paginator.keyset_page(queryset, request)
+            if keyset is not None:
+                queryset = keyset[0]
+        return self.conditional_response(
+            super().list, queryset, request, *args, **kwargs
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        lookup = self.lookup_url_kwarg or self.lookup_field
+        queryset = self.get_validator_queryset().filter(
+            **{self.lookup_field: kwargs[lookup]}
+        )
+        return self.conditional_response(
+            super().retrieve, queryset, request, *args, **kwargs
+        )
+
+    def get_validator_queryset(self):
+        # Фильтры запроса без select_related, prefetch и аннотаций
+        return self.filter_queryset(self.queryset.all())
+
+    def get_last_modified_fields(self):
+        return self.last_modified_fields
+
+    def get_validators(self, request, queryset):
+        """ETag и Last-Modified (timestamp или None); None вместо пары,
+        если retrieve не найдёт объект."""
+        parts = [request.get_full_path(),
+                 *get_versions(list(self.validator_versions))]
+        last_modified = None
+        fields = self.get_last_modified_fields()
+        if fields:
+            rows, dates = self.summarize(queryset, fields)
+            if not rows and self.action == 'retrieve':
+                return None
+            dates = [value for value in dates if value]
+            last_modified = max(dates).timestamp() if dates else None
+            parts += [rows, last_modified]
+        if self.action != 'retrieve':
+            last_modified = None
+        user = request.user
+        if user.is_authenticated:
+            parts += [user.pk, get_version(membership_version(user.pk))]
+            # Дата не учитывает флаги пользователя
+            last_modified = None
+        etag = hashlib.md5(repr(parts).encode()).hexdigest()
+        return f'"{etag}"', last_modified
+
+    @staticmethod
+    def summarize(queryset, fields):
+        """Состав строк и даты изменения из fields.
+
+        Для всей выборки - число строк и максимумы дат одним агрегатом,
+        для среза (keyset-страницы) - id и даты её строк: состав
+        страницы меняется и без изменения числа строк.
+        """
+        if queryset.query.is_sliced:
+            rows = list(queryset.values_list('pk', *fields))
+            return ([row[0] for row in rows],
+                    [date for row in rows for date in row[1:]])
+        values = queryset.aggregate(
+            count=Count('pk'),
+            **{f'modified_{i}': Max(f) for i, f in enumerate(fields)}
+        )
+        return values.pop('count'), values.values()
+
+    def conditional_response(self, view, queryset, request, *args, **kwargs):
+        validators = self.get_validators(request, queryset)
+        if validators is None:
+            return view(request, *args, **kwargs)
+        etag, last_modified = validators
+        response = get_conditional_response(
+            request, etag=etag,
+            last_modified=last_modified and int(last_modified)
+        )
+        if response is None:
+            response = view(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+        response['ETag'] = etag
+        if last_modified:
+            response['Last-Modified'] = http_date(last_modified)
+        if request.user.is_authenticated:
+            patch_cache_control(response, private=True, no_cache=True)
+        else:
+            patch_cache_control(response, public=True,
+                                max_age=settings.HTTP_CACHE_MAX_AGE)
+        patch_vary_headers(response, ('Authorization', ))
+        return response
+
+
+class CatalogueCacheMixin:
+    """Отдаёт справочники (теги, ингредиенты) готовыми байтами из кэша.
+
+    Ключ включает версию справочника, которую увеличивают сигналы
+    post_save/post_delete, поэтому инвалидация не требует обхода ключей.
+    """
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(
+            super().retrieve, request, *args, **kwargs
+        )
+
+    def cached_response(self, view, request, *args, **kwargs):
+        if request.accepted_renderer.format != 'json':
+            return view(request, *args, **kwargs)
+        path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+        key = f'{CATALOGUE}:{get_version(CATALOGUE)}:content:{path}'
+        content = cache.get(key)
+        record_lookup(CATALOGUE, content is not None)
+        if content is None:
+            response = view(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            content = JSONRenderer().render(response.data)
+            cache.set(key, content, settings.CATALOGUE_CACHE_TIMEOUT)
+        return HttpResponse(content, content_type='application/json')
+
+
+class RecipeDetailCacheMixin:
+    """Кэширует общую для всех пользователей часть ответа retrieve.
+
+    Ключ состоит из версий рецепта, его автора и справочников: их
+    увеличивают сигналы из recipes.signals. Флаги пользователя и
+    ссылки на изображения берутся одним лёгким запросом при каждом
+    ответе.
+    """
+
+    def retrieve(self, request, *args, **kwargs):
+        lookup = self.lookup_url_kwarg or self.lookup_field
+        recipe = get_object_or_404(
+            self.filter_queryset(
+                Recipe.objects.only('id', 'author_id', 'image',
+                                    'rendered_image')
+                .with_user_flags(request.user)
+            ),
+            pk=kwargs[lookup]
+        )
+        self.check_object_permissions(request, recipe)
+        versions = get_versions([
+            CATALOGUE, recipe_version(recipe.id),
+            user_version(recipe.author_id)
+        ])
+        key = f'{RECIPE_DETAIL}:{recipe.id}:' + ':'.join(map(str, versions))
+        data = cache.get(key)
+        record_lookup(RECIPE_DETAIL, data is not None)
+        headers = {'X-Cache': 'HIT' if data is not None else 'MISS'}
+        if data is None:
+            data = dict(super().retrieve(request, *args, **kwargs).data)
+            # Ключи остаются на своих местах, чтобы порядок полей
+            # в ответе не зависел от попадания в кэш
+            data.update(dict.fromkeys(RECIPE_REQUEST_FIELDS))
+            data['author'] = dict(data['author'], is_subscribed=None)
+            cache.set(key, data, settings.RECIPE_CACHE_TIMEOUT)
+        return Response(
+            self.merge_request_fields(data, recipe, request),
+            headers=headers
+        )
+
+    @staticmethod
+    def merge_request_fields(data, recipe, request):
+        data = dict(
+            data,
+            is_favorited=recipe.is_favorited,
+            is_in_shopping_cart=recipe.is_in_shopping_cart,
+            image=(request.build_absolute_uri(recipe.image.url)
+                   if recipe.image else None),
+            image_renditions=absolute_rendition_urls(recipe, request),
+        )
+        data['author'] = dict(
+            data['author'], is_subscribed=recipe.is_author_subscribed
+        )
+        return data
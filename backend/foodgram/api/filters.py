@@ -1,34 +1,113 @@
-from django_filters.rest_framework import filters, FilterSet
+from django.db.models import Case, IntegerField, Value, When
+from django.db.models.functions import Lower
+from django_filters import utils
+from django_filters.rest_framework import (DjangoFilterBackend, filters,
+                                           FilterSet)
 from recipes.models import Ingredient, Recipe
+from recipes.search import search_recipes
 from django_filters import rest_framework as django_filters
 
+# Не больше стольких ингредиентов в ответе на поисковый запрос
+INGREDIENT_SEARCH_LIMIT = 50
+# Триграммный индекс бесполезен для строк короче трёх символов
+TRIGRAM_MIN_LENGTH = 3
+# ?ordering= -> сортировка рецептов; рейтинги считает recipes.scores
+RECIPE_ORDERINGS = {
+    'popular': ('-score__popular', '-id'),
+    'trending': ('-score__trending', '-id'),
+    'cooking_time': ('cooking_time', 'id'),
+}
+SCORE_ORDERINGS = ('popular', 'trending')
+
+
+class ValidatedFilterBackend(DjangoFilterBackend):
+    """Фильтр строится и проверяется один раз за запрос.
+
+    Повторная фильтрация (валидаторы api.cache.ConditionalGetMixin,
+    затем сам список) применяет те же cleaned_data к другому queryset
+    без повторных запросов проверки author и tags.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        filterset = getattr(view, 'validated_filterset', None)
+        if filterset is None:
+            filterset = self.get_filterset(request, queryset, view)
+            if filterset is None:
+                return queryset
+            if not filterset.is_valid() and self.raise_exception:
+                raise utils.translate_validation(filterset.errors)
+            view.validated_filterset = filterset
+        return filterset.filter_queryset(queryset.all())
+
 
 class IngredientFilter(FilterSet):
-    name = filters.CharFilter(lookup_expr='istartswith')
+    name = filters.CharFilter(method='filter_name')
 
     class Meta:
         model = Ingredient
         fields = ('name', )
 
+    def filter_name(self, queryset, name, value):
+        """Сначала совпадения по началу названия, затем по подстроке.
+
+        lower(name) LIKE 'x%' обслуживает индекс text_pattern_ops,
+        lower(name) LIKE '%x%' - триграммный GIN-индекс
+        (см. миграцию 0006_ingredient_search_indexes).
+        """
+        value = value.strip().lower()
+        if not value:
+            return queryset
+        queryset = queryset.annotate(name_lower=Lower('name'))
+        if len(value) < TRIGRAM_MIN_LENGTH:
+            return queryset.filter(
+                name_lower__startswith=value
+            ).order_by('name_lower')
+        return queryset.filter(name_lower__contains=value).annotate(
+            search_rank=Case(
+                When(name_lower__startswith=value, then=Value(0)),
+                default=Value(1),
+                output_field=IntegerField()
+            )
+        ).order_by('search_rank', 'name_lower')
+
 
 class RecipeFilter(django_filters.FilterSet):
     is_favorited = django_filters.BooleanFilter(
         field_name='is_favorited', method='filter_is_favorited')
     is_in_shopping_cart = django_filters.BooleanFilter(
         field_name='is_in_shopping_cart', method='filter_is_in_shopping_cart')
+    search = django_filters.CharFilter(method='filter_search')
+    ordering = django_filters.ChoiceFilter(
+        choices=[(value, value) for value in RECIPE_ORDERINGS],
+        method='filter_ordering'
+    )
 
     class Meta:
         model = Recipe
-        fields = ['is_favorited', 'is_in_shopping_cart', 'author', 'tags']
+        fields = ['is_favorited', 'is_in_shopping_cart', 'author', 'tags',
+                  'search', 'ordering']
 
     def filter_is_favorited(self, queryset, name, value):
         user = self.request.user
         if value and user.is_authenticated:
-            return queryset.filter(favorites__who_favorited=user)
+            return queryset.filter(favorites__user=user)
         return queryset
 
     def filter_is_in_shopping_cart(self, queryset, name, value):
         user = self.request.user
         if value and user.is_authenticated:
-            return queryset.filter(shopping_carts__user=user)
+            return queryset.filter(shopping_lists__user=user)
         return queryset
+
+    def filter_search(self, queryset, name, value):
+        value = value.strip()
+        if not value:
+            return queryset
+        return search_recipes(queryset, value)
+
+    def filter_ordering(self, queryset, name, value):
+        if value in SCORE_ORDERINGS:
+            # INNER JOIN с таблицей рейтингов: страница читается
+            # по её индексу без агрегации избранного
+            queryset = queryset.filter(score__isnull=False)
+        return queryset.order_by(*RECIPE_ORDERINGS[value])
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from recipes.cache import CATALOGUE, RECIPE_DETAIL, get_stats, reset_stats
+
+CACHES = (CATALOGUE, RECIPE_DETAIL)
+
+
+class Command(BaseCommand):
+    help = 'Попадания и промахи кэша ответов API.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--reset',
+            action='store_true',
+            help='Обнулить счётчики после вывода'
+        )
+
+    def handle(self, *args, **options):
+        for name in CACHES:
+            stats = get_stats(name)
+            total = stats['hits'] + stats['misses']
+            ratio = stats['hits'] / total * 100 if total else 0
+            self.stdout.write(
+                f'{name}: попаданий {stats["hits"]}, '
+                f'промахов {stats["misses"]} ({ratio:.1f}% попаданий)'
+            )
+            if options['reset']:
+                reset_stats(name)
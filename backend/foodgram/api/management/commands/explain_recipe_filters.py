@@ -0,0 +1,175 @@
+from itertools import combinations
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.http import QueryDict
+from django.test import RequestFactory
+from api.filters import RecipeFilter
+from recipes.models import Favorite, Recipe, ShoppingList, Tag
+from users.models import Follow, User
+
+# Фильтр ленты рецептов -> индексы, один из которых должен появиться
+# в плане: имя или (модель, ведущие столбцы) для индексов внешних ключей
+# и уникальных ограничений, имена которых зависят от СУБД. Связи
+# is_favorited и is_in_shopping_cart планировщик обходит от пользователя
+# или, в сочетании с другими фильтрами, от рецепта.
+FILTER_INDEXES = {
+    'author': ['recipe_author_pub_idx'],
+    'search': ['recipes_recipe_search_vector'],
+    'tags': [(Recipe.tags.through, ['tag_id']),
+             (Recipe.tags.through, ['recipe_id', 'tag_id'])],
+    'is_favorited': [(Favorite, ['user_id', 'recipe_id']),
+                     'favorite_recipe_user_idx'],
+    'is_in_shopping_cart': [(ShoppingList, ['user_id', 'recipe_id']),
+                            'shoppinglist_recipe_user_idx'],
+}
+LIST_INDEX = 'recipe_pub_date_id_idx'
+# Запросы от рецепта, автора или ингредиента -> индекс
+RELATION_PATHS = {
+    'пользователи с рецептом в избранном': (
+        lambda: Favorite.objects.filter(
+            recipe_id__in=[1, 2]
+        ).values_list('user_id', flat=True),
+        'favorite_recipe_user_idx'
+    ),
+    'пользователи с рецептом в списке покупок': (
+        lambda: ShoppingList.objects.filter(
+            recipe_id__in=[1, 2]
+        ).values_list('user_id', flat=True).distinct(),
+        'shoppinglist_recipe_user_idx'
+    ),
+    'подписчики автора': (
+        lambda: Follow.objects.filter(
+            author_id=1
+        ).values_list('user_id', flat=True),
+        'follow_author_user_idx'
+    ),
+    'рецепты из ингредиентов': (
+        lambda: Recipe.objects.cookable_from([1, 2]),
+        'recipeingredient_ingr_idx'
+    ),
+    'рецепты с ингредиентом': (
+        lambda: Recipe.objects.filter(recipeingredients__ingredient_id=1),
+        'recipeingredient_ingr_idx'
+    ),
+}
+
+
+class Command(BaseCommand):
+    help = ('Проверка через EXPLAIN, что фильтры ленты рецептов '
+            'и обратные запросы к связям используют свои индексы.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verbose-plans',
+            action='store_true',
+            help='Печатать планы запросов'
+        )
+
+    def handle(self, *args, **options):
+        self.verbose_plans = options['verbose_plans']
+        failed = []
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                # На маленьких таблицах планировщик предпочтёт Seq Scan
+                cursor.execute('SET enable_seqscan = off')
+            try:
+                for title, queryset, indexes in self.checks():
+                    if not self.check_plan(title, queryset.explain(),
+                                           indexes):
+                        failed.append(title)
+            finally:
+                if connection.vendor == 'postgresql':
+                    cursor.execute('RESET enable_seqscan')
+        if failed:
+            raise CommandError(
+                f'Индексы не используются в {len(failed)} запросах: '
+                + '; '.join(failed)
+            )
+        self.stdout.write(
+            self.style.SUCCESS('Все запросы используют индексы')
+        )
+
+    def check_plan(self, title, plan, indexes):
+        """indexes - список множеств имён: из каждого множества
+        в плане должно быть хотя бы одно."""
+        missing = [names for names in indexes
+                   if not any(name in plan for name in names)]
+        if missing:
+            self.stdout.write(self.style.ERROR(
+                f'{title}: не использованы '
+                + ', '.join(' или '.join(sorted(names)) for names in missing)
+            ))
+        else:
+            self.stdout.write(f'{title}: OK')
+        if self.verbose_plans:
+            self.stdout.write(plan)
+        return not missing
+
+    @staticmethod
+    def index_names(options):
+        """Имена индексов из FILTER_INDEXES для текущей базы."""
+        names = set()
+        for option in options:
+            if isinstance(option, str):
+                names.add(option)
+                continue
+            model, columns = option
+            table = model._meta.db_table
+            with connection.cursor() as cursor:
+                constraints = connection.introspection.get_constraints(
+                    cursor, table
+                )
+            for name, info in constraints.items():
+                if not (info['index'] or info['unique']):
+                    continue
+                if info['columns'][:len(columns)] != columns:
+                    continue
+                if info['index']:
+                    names.add(name)
+                else:
+                    # UNIQUE из CREATE TABLE SQLite индексирует как
+                    # sqlite_autoindex_<таблица>_<номер>
+                    names.update((name, f'sqlite_autoindex_{table}_'))
+        return names
+
+    def checks(self):
+        # Пользователь нужен только для построения запроса
+        request = RequestFactory().get('/api/recipes/')
+        request.user = User(id=0)
+        # Без аннотаций флагов: их подзапросы EXISTS всегда идут
+        # по уникальным индексам и замаскировали бы проверку фильтров
+        queryset = Recipe.objects.all()
+        for params in self.combinations():
+            filterset = RecipeFilter(
+                params, queryset=queryset, request=request
+            )
+            if not filterset.is_valid():
+                raise CommandError(filterset.errors)
+            indexes = [self.index_names(FILTER_INDEXES[name])
+                       for name in params]
+            yield (', '.join(params) or 'без фильтров',
+                   filterset.qs[:6], indexes or [{LIST_INDEX}])
+        for title, (build, index) in RELATION_PATHS.items():
+            yield title, build(), [{index}]
+
+    @staticmethod
+    def combinations():
+        tag = Tag.objects.values_list('id', flat=True).first()
+        if tag is None:
+            raise CommandError('Для проверки фильтра tags нужен хотя бы '
+                               'один тег')
+        values = {
+            'author': '1',
+            'tags': str(tag),
+            'is_favorited': '1',
+            'is_in_shopping_cart': '1',
+        }
+        # На SQLite поиск идёт через icontains и индексом не обслуживается
+        if connection.vendor == 'postgresql':
+            values['search'] = 'суп'
+        for size in range(len(values) + 1):
+            for names in combinations(values, size):
+                params = QueryDict(mutable=True)
+                params.update({name: values[name] for name in names})
+                yield params
@@ -0,0 +1,72 @@
+from array import array
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import IntegerField, Value
+from recipes.cache import get_version, membership_version
+from recipes.models import Favorite, ShoppingList
+from users.models import Follow
+
+# Набор -> (модель, поле с id); порядок задаёт номер набора в UNION
+MEMBERSHIPS = {
+    'favorites': (Favorite, 'recipe_id'),
+    'shopping_cart': (ShoppingList, 'recipe_id'),
+    'follows': (Follow, 'author_id'),
+}
+
+
+class Memberships:
+    """id рецептов в избранном и списке покупок пользователя
+    и id авторов, на которых он подписан."""
+
+    def __init__(self, favorites=(), shopping_cart=(), follows=()):
+        self.favorites = frozenset(favorites)
+        self.shopping_cart = frozenset(shopping_cart)
+        self.follows = frozenset(follows)
+
+
+def fetch_memberships(user):
+    """Все три набора одним запросом UNION ALL.
+
+    Возвращает словарь массивов array('q'): в кэше они занимают
+    по 8 байт на id вместо pickle-представления множества.
+    """
+    names = list(MEMBERSHIPS)
+    queries = [
+        model.objects.filter(user=user).annotate(
+            kind=Value(number, output_field=IntegerField())
+        ).values_list('kind', field).order_by()
+        for number, (model, field) in enumerate(MEMBERSHIPS.values())
+    ]
+    result = {name: array('q') for name in names}
+    for kind, pk in queries[0].union(*queries[1:], all=True):
+        result[names[kind]].append(pk)
+    return result
+
+
+def load_memberships(user):
+    if not user.is_authenticated:
+        return Memberships()
+    timeout = settings.MEMBERSHIPS_CACHE_TIMEOUT
+    if not timeout:
+        return Memberships(**fetch_memberships(user))
+    # Версию увеличивают сигналы при изменении избранного,
+    # списка покупок и подписок (см. recipes.signals)
+    version = get_version(membership_version(user.pk))
+    key = f'memberships:{user.pk}:{version}'
+    sets = cache.get(key)
+    if sets is None:
+        sets = fetch_memberships(user)
+        cache.set(key, sets, timeout)
+    return Memberships(**sets)
+
+
+def get_memberships(request):
+    """Наборы текущего пользователя, загружаются раз за запрос."""
+    if request is None:
+        return Memberships()
+    memberships = getattr(request, '_memberships', None)
+    if memberships is None:
+        memberships = load_memberships(request.user)
+        request._memberships = memberships
+    return memberships
@@ -1,5 +1,134 @@
+import base64
+import json
+from collections import OrderedDict
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 
 
 class PageLimitPagination(PageNumberPagination):
+    """Постраничная пагинация ?page=&limit=.
+
+    С параметром ?cursor= (в том числе пустым для первой страницы)
+    включается keyset-пагинация: вместо COUNT(*) и OFFSET следующая
+    страница выбирается условием по полям сортировки, например
+    (pub_date, id) < (последний pub_date, последний id).
+    """
     page_size_query_param = 'limit'
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Некорректный курсор'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        keyset = self.keyset_page(queryset, request)
+        if keyset is None:
+            self.ordering = None
+            return super().paginate_queryset(queryset, request, view)
+        page_queryset, self.ordering = keyset
+        return self.paginate_keyset(page_queryset, request)
+
+    def get_paginated_response(self, data):
+        if self.ordering is None:
+            return super().get_paginated_response(data)
+        return Response(OrderedDict([
+            ('next', self.next_link),
+            ('previous', None),
+            ('results', data),
+        ]))
+
+    def get_keyset_ordering(self, queryset):
+        """Сортировка queryset с id в конце для однозначности.
+
+        Все поля должны сортироваться в одну сторону, иначе keyset
+        не построить и используется обычная пагинация.
+        """
+        model = queryset.model
+        ordering = list(queryset.query.order_by or model._meta.ordering)
+        if not ordering or not all(isinstance(f, str) for f in ordering):
+            return None
+        descending = ordering[0].startswith('-')
+        if any(f.startswith('-') != descending for f in ordering):
+            return None
+        fields = [f.lstrip('-') for f in ordering]
+        fields = ['id' if f == 'pk' else f for f in fields]
+        if 'id' not in fields:
+            fields.append('id')
+        try:
+            for field in fields:
+                model._meta.get_field(field)
+        except FieldDoesNotExist:
+            return None
+        return fields, descending
+
+    def keyset_page(self, queryset, request):
+        """Запрос строк keyset-страницы с одной лишней для ссылки next
+        и сортировка (поля, по убыванию).
+
+        None без ?cursor= и для сортировок, не подходящих для keyset.
+        """
+        if self.cursor_query_param not in request.query_params:
+            return None
+        ordering = self.get_keyset_ordering(queryset)
+        if ordering is None:
+            return None
+        fields, descending = ordering
+        prefix = '-' if descending else ''
+        queryset = queryset.order_by(*(prefix + f for f in fields))
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded:
+            position = self.decode_cursor(encoded, queryset.model, fields)
+            queryset = queryset.filter(
+                self.keyset_filter(fields, position, descending)
+            )
+        return queryset[:self.get_page_size(request) + 1], ordering
+
+    def paginate_keyset(self, queryset, request):
+        fields, _ = self.ordering
+        page_size = self.get_page_size(request)
+        page = list(queryset)
+        self.next_link = None
+        if len(page) > page_size:
+            page = page[:page_size]
+            self.next_link = replace_query_param(
+                request.build_absolute_uri(), self.cursor_query_param,
+                self.encode_cursor(page[-1], fields)
+            )
+        return page
+
+    @staticmethod
+    def keyset_filter(fields, position, descending):
+        # (a, b) < (x, y)  <=>  a < x OR (a = x AND b < y)
+        lookup = 'lt' if descending else 'gt'
+        condition = Q()
+        for index, field in enumerate(fields):
+            step = Q(**{f'{field}__{lookup}': position[index]})
+            for previous in range(index):
+                step &= Q(**{fields[previous]: position[previous]})
+            condition |= step
+        return condition
+
+    @staticmethod
+    def encode_cursor(instance, fields):
+        values = []
+        for field in fields:
+            value = getattr(instance, field)
+            if hasattr(value, 'isoformat'):
+                value = value.isoformat()
+            values.append(value)
+        data = json.dumps(values).encode()
+        return base64.urlsafe_b64encode(data).decode()
+
+    def decode_cursor(self, encoded, model, fields):
+        try:
+            values = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            if len(values) != len(fields):
+                raise ValueError
+            return [
+                model._meta.get_field(field).to_python(value)
+                for field, value in zip(fields, values)
+            ]
+        except (TypeError, ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
@@ -0,0 +1,217 @@
+import json
+import logging
+import random
+import re
+import sys
+from collections import Counter
+from contextlib import ExitStack
+from contextvars import ContextVar
+from functools import lru_cache
+from pathlib import Path
+from time import perf_counter
+
+from asgiref.sync import (iscoroutinefunction, markcoroutinefunction,
+                          sync_to_async)
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger('foodgram.profiling')
+
+_current_profile = ContextVar('request_profile', default=None)
+
+PROJECT_ROOT = str(Path(settings.BASE_DIR))
+THIS_FILE = str(Path(__file__))
+IN_LIST = re.compile(r'IN \((?:%s, )*%s\)')
+LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+
+
+def fingerprint(sql):
+    """SQL без значений: запросы, отличающиеся только параметрами,
+    получают одинаковый отпечаток."""
+    return LITERALS.sub('?', IN_LIST.sub('IN (...)', sql))
+
+
+def query_source():
+    """Ближайшая к запросу строка кода проекта, например
+    api/serializers.py:31 get_is_subscribed."""
+    frame = sys._getframe(2)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(PROJECT_ROOT) and filename != THIS_FILE:
+            return (f'{Path(filename).relative_to(PROJECT_ROOT)}:'
+                    f'{frame.f_lineno} {frame.f_code.co_name}')
+        frame = frame.f_back
+    return None
+
+
+class RequestProfile:
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.serializer_time = 0.0
+        self.fingerprints = Counter()
+        self.sources = {}
+        self.slow_queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        # Обёртка для connection.execute_wrapper
+        started = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = perf_counter() - started
+            self.queries += 1
+            self.db_time += duration
+            key = fingerprint(sql)
+            self.fingerprints[key] += 1
+            if key not in self.sources:
+                self.sources[key] = query_source()
+            if duration * 1000 >= settings.PROFILING_SLOW_QUERY_MS:
+                self.slow_queries.append({
+                    'sql': key,
+                    'ms': round(duration * 1000, 2),
+                    'source': self.sources[key],
+                })
+
+    def duplicates(self):
+        threshold = settings.PROFILING_DUPLICATE_QUERIES
+        return [
+            {'sql': key, 'count': count, 'source': self.sources[key]}
+            for key, count in self.fingerprints.most_common()
+            if count >= threshold
+        ]
+
+
+@lru_cache(maxsize=None)
+def timed_serializer_class(serializer_class):
+    """Подкласс сериализатора, который замеряет свойство data."""
+
+    def data(self):
+        started = perf_counter()
+        try:
+            return super(timed, self).data
+        finally:
+            profile = _current_profile.get()
+            if profile is not None:
+                profile.serializer_time += perf_counter() - started
+
+    timed = type(serializer_class.__name__, (serializer_class, ), {
+        '__module__': serializer_class.__module__,
+        'data': property(data),
+    })
+    return timed
+
+
+class ProfilingMixin:
+    """Время сериализации для ProfilingMiddleware.
+
+    Только в профилируемых запросах сериализатор из get_serializer
+    получает подкласс с замером data; вложенные сериализаторы учтены
+    во внешнем.
+    """
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+        if _current_profile.get() is not None:
+            serializer.__class__ = timed_serializer_class(type(serializer))
+        return serializer
+
+
+def view_name(request):
+    if request.resolver_match is None:
+        return request.path
+    view = request.resolver_match.func
+    cls = getattr(view, 'cls', None)
+    if cls is None:
+        return f'{view.__module__}.{view.__name__}'
+    action = (getattr(view, 'actions', None) or {}).get(
+        request.method.lower(), request.method.lower()
+    )
+    return f'{cls.__name__}.{action}'
+
+
+class ProfilingMiddleware:
+    """Замеряет SQL и сериализацию для выборки запросов.
+
+    Доля профилируемых запросов - PROFILING_SAMPLE_RATE, результат
+    отдаётся в заголовке Server-Timing, медленные запросы и
+    повторяющиеся SQL (признак N+1) пишутся в лог foodgram.profiling.
+    Сериализация замеряется во вьюсетах с ProfilingMixin. Запросы к БД
+    при отдаче StreamingHttpResponse не учитываются. Под ASGI
+    учитывается SQL асинхронного ORM, который идёт через sync_to_async.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if random.random() >= settings.PROFILING_SAMPLE_RATE:
+            return self.get_response(request)
+        profile = RequestProfile()
+        token = _current_profile.set(profile)
+        started = perf_counter()
+        try:
+            with self.wrap_connections(profile):
+                response = self.get_response(request)
+        finally:
+            _current_profile.reset(token)
+        self.finish(request, response, profile, perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        if random.random() >= settings.PROFILING_SAMPLE_RATE:
+            return await self.get_response(request)
+        profile = RequestProfile()
+        token = _current_profile.set(profile)
+        started = perf_counter()
+        # Соединения привязаны к потоку: обёртки ставятся в том потоке
+        # sync_to_async запроса, где асинхронный ORM выполняет SQL
+        wrappers = await sync_to_async(self.wrap_connections)(profile)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(wrappers.close)()
+            _current_profile.reset(token)
+        self.finish(request, response, profile, perf_counter() - started)
+        return response
+
+    @staticmethod
+    def wrap_connections(profile):
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(profile))
+        return stack
+
+    def finish(self, request, response, profile, total):
+        response['Server-Timing'] = ', '.join((
+            f'db;dur={profile.db_time * 1000:.2f};'
+            f'desc="{profile.queries} queries"',
+            f'serializer;dur={profile.serializer_time * 1000:.2f}',
+            f'total;dur={total * 1000:.2f}',
+        ))
+        self.log(request, response, profile, total)
+
+    def log(self, request, response, profile, total):
+        duplicates = profile.duplicates()
+        slow = total * 1000 >= settings.PROFILING_SLOW_REQUEST_MS
+        if not (slow or duplicates or profile.slow_queries):
+            return
+        logger.warning(json.dumps({
+            'view': view_name(request),
+            'method': request.method,
+            'path': request.get_full_path(),
+            'status': response.status_code,
+            'total_ms': round(total * 1000, 2),
+            'db_ms': round(profile.db_time * 1000, 2),
+            'serializer_ms': round(profile.serializer_time * 1000, 2),
+            'queries': profile.queries,
+            'duplicates': duplicates,
+            'slow_queries': profile.slow_queries,
+        }, ensure_ascii=False))
@@ -0,0 +1,23 @@
+import json
+
+from rest_framework import renderers
+
+
+class PlainTextRenderer(renderers.BaseRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        # Сюда попадают только ответы с ошибками, сами файлы
+        # отдаются через StreamingHttpResponse
+        if data is None:
+            return b''
+        if not isinstance(data, str):
+            data = json.dumps(data, ensure_ascii=False)
+        return data.encode(self.charset)
+
+
+class CSVRenderer(PlainTextRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
@@ -0,0 +1,90 @@
+"""Чтение с реплик базы данных.
+
+ReplicaReadMixin на время безопасного запроса (GET, HEAD, OPTIONS)
+к вьюсету выбирает одну из реплик DB_REPLICAS, и ReplicaRouter
+направляет на неё чтения. Запись, чтения внутри транзакции и модели
+из settings.REPLICA_EXCLUDED_MODELS остаются на основной базе.
+Без реплик в настройках роутер ничего не меняет.
+
+Роутер выбирает базу по модели всего запроса, поэтому подзапросы
+и JOIN к исключённым моделям (флаги is_favorited и is_in_shopping_cart
+в запросе рецептов) читались бы с реплики. Действия из user_actions
+для авторизованного пользователя целиком идут на основную базу.
+
+Кэши ответов (api.cache) версионируются сигналами при записи, поэтому
+отставание реплики может попасть в кэш: оно должно быть заметно
+меньше времени жизни записей.
+"""
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from rest_framework.permissions import SAFE_METHODS
+
+_replica = ContextVar('replica', default=None)
+
+
+def replica_aliases():
+    return [alias for alias in connections
+            if alias.startswith('replica_')]
+
+
+@contextmanager
+def read_from_replica():
+    """Все чтения в блоке идут на одну случайную реплику."""
+    aliases = replica_aliases()
+    token = _replica.set(random.choice(aliases) if aliases else None)
+    try:
+        yield
+    finally:
+        _replica.reset(token)
+
+
+def read_from_primary():
+    """Остальные чтения блока read_from_replica идут на основную базу."""
+    _replica.set(None)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        replica = _replica.get()
+        if replica is None:
+            return None
+        # Внутри транзакции читаем то, что в ней записано
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+        if model._meta.label_lower in settings.REPLICA_EXCLUDED_MODELS:
+            return None
+        return replica
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплики - копии основной базы
+        return True
+
+
+class ReplicaReadMixin:
+    # Действия, которые читают только с основной базы
+    primary_actions = ()
+    # Действия, ответ которых для авторизованного пользователя зависит
+    # от его избранного, списка покупок и подписок
+    user_actions = ()
+
+    def initial(self, request, *args, **kwargs):
+        # request.user - аутентификация до запросов остальных миксинов
+        if (self.action in self.user_actions
+                and request.user.is_authenticated):
+            read_from_primary()
+        super().initial(request, *args, **kwargs)
+
+    def dispatch(self, request, *args, **kwargs):
+        action = self.action_map.get(request.method.lower())
+        if (request.method not in SAFE_METHODS
+                or action in self.primary_actions):
+            return super().dispatch(request, *args, **kwargs)
+        with read_from_replica():
+            return super().dispatch(request, *args, **kwargs)
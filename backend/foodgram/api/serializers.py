@@ -1,12 +1,22 @@
+from functools import partial
+
+from django.db.models import Prefetch
 from rest_framework import serializers
 from recipes.models import (Tag, Ingredient, Recipe, RecipeIngredient,
-                            Favorite, ShoppingList)
-from users.models import User, Follow
+                            ShoppingCartTotal)
+from users.models import User
 from djoser.serializers import UserCreateSerializer, UserSerializer
-from rest_framework.validators import UniqueTogetherValidator
-from api.utils import Base64ImageField, create_ingredients
+from api.memberships import get_memberships
+from api.utils import (Base64ImageField, ImageRenditionsField,
+                       absolute_rendition_urls, create_ingredients,
+                       parse_recipes_limit, update_ingredients)
 from django.db import transaction
 
+# Ограничения запроса «что приготовить»
+COOKABLE_MAX_INGREDIENTS = 100
+COOKABLE_MAX_MISSING = 10
+BATCH_MAX_RECIPES = 100
+
 
 class TagSerializer(serializers.ModelSerializer):
     class Meta:
@@ -23,11 +33,12 @@ class UserGetSerializer(UserSerializer):
                   'last_name', 'is_subscribed')
 
     def get_is_subscribed(self, obj):
-        request = self.context.get('request')
-        return (request.user.is_authenticated
-                and Follow.objects.filter(
-                    user=request.user, author=obj
-                ).exists())
+        # Значение может быть заранее посчитано в queryset
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
+        return obj.id in get_memberships(
+            self.context.get('request')
+        ).follows
 
 
 class UserSignUpSerializer(UserCreateSerializer):
@@ -63,15 +74,22 @@ class RecipeSerializer(serializers.ModelSerializer):
 
 
 class RecipeSmallSerializer(serializers.ModelSerializer):
+    thumbnail = serializers.SerializerMethodField()
+
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'thumbnail', 'cooking_time')
+
+    def get_thumbnail(self, obj):
+        # Миниатюра для коротких карточек, image остаётся оригиналом
+        renditions = absolute_rendition_urls(obj, self.context.get('request'))
+        return renditions['list'] if renditions else None
 
 
 class UserSubscribeRepresentSerializer(UserGetSerializer):
     is_subscribed = serializers.SerializerMethodField()
     recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.SerializerMethodField()
+    recipes_count = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = User
@@ -82,51 +100,18 @@ class UserSubscribeRepresentSerializer(UserGetSerializer):
 
     def get_recipes(self, obj):
         request = self.context.get('request')
-        recipes_limit = None
-        if request:
-            recipes_limit = request.query_params.get('recipes_limit')
-        recipes = obj.recipes.all()
-
-        if recipes_limit:
-            try:
-                recipes_limit = int(recipes_limit)
-            except ValueError:
-                recipes_limit = None
-
-        if recipes_limit is not None:
-            recipes = recipes[:recipes_limit]
-
+        # Рецепты уже загружены в api.utils.get_subscriptions
+        if hasattr(obj, 'feed_recipes'):
+            recipes = obj.feed_recipes
+        else:
+            recipes = obj.recipes.all()
+            recipes_limit = parse_recipes_limit(request) if request else None
+            if recipes_limit is not None:
+                recipes = recipes[:recipes_limit]
         return RecipeSmallSerializer(recipes, many=True,
                                      context={'request': request}).data
 
 
-class UserSubscribeSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = Follow
-        fields = '__all__'
-        validators = [
-            UniqueTogetherValidator(
-                queryset=Follow.objects.all(),
-                fields=('user', 'author'),
-                message='Вы уже подписаны на этого пользователя'
-            )
-        ]
-
-    def validate(self, data):
-        request = self.context.get('request')
-        if request.user == data['author']:
-            raise serializers.ValidationError(
-                'Нельзя подписываться на самого себя!'
-            )
-        return data
-
-    def to_representation(self, instance):
-        request = self.context.get('request')
-        return UserSubscribeRepresentSerializer(
-            instance.author, context={'request': request}
-        ).data
-
-
 class TagSerialiser(serializers.ModelSerializer):
     class Meta:
         model = Tag
@@ -152,6 +137,11 @@ class IngredientGetSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'measurement_unit', 'amount')
 
 
+class ShoppingCartTotalSerializer(IngredientGetSerializer):
+    class Meta(IngredientGetSerializer.Meta):
+        model = ShoppingCartTotal
+
+
 class IngredientPostSerializer(serializers.ModelSerializer):
     id = serializers.IntegerField()
     amount = serializers.IntegerField()
@@ -169,26 +159,166 @@ class RecipeGetSerializer(serializers.ModelSerializer):
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
     image = Base64ImageField(required=False)
+    image_renditions = ImageRenditionsField(source='*')
 
     class Meta:
         model = Recipe
         fields = ('id', 'tags', 'author', 'ingredients',
                   'is_favorited', 'is_in_shopping_cart', 'name',
-                  'image', 'text', 'cooking_time')
+                  'image', 'image_renditions', 'text', 'cooking_time')
+
+    def to_representation(self, instance):
+        # Подписка на автора посчитана в RecipeQuerySet.with_user_flags,
+        # передаём её в сериализатор автора
+        if (hasattr(instance, 'is_author_subscribed')
+                and isinstance(self.fields.get('author'), UserGetSerializer)):
+            instance.author.is_subscribed = instance.is_author_subscribed
+        return super().to_representation(instance)
 
     def get_is_favorited(self, obj):
-        request = self.context.get('request')
-        return (request and request.user.is_authenticated
-                and Favorite.objects.filter(
-                    user=request.user, recipe=obj
-                ).exists())
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
+        return obj.id in get_memberships(
+            self.context.get('request')
+        ).favorites
 
     def get_is_in_shopping_cart(self, obj):
-        request = self.context.get('request')
-        return (request and request.user.is_authenticated
-                and ShoppingList.objects.filter(
-                    user=request.user, recipe=obj
-                ).exists())
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
+        return obj.id in get_memberships(
+            self.context.get('request')
+        ).shopping_cart
+
+
+# Связанные объекты, которые в компактном списке выводятся id,
+# если их нет в ?expand=
+COLLAPSED_RECIPE_FIELDS = {
+    'author': partial(serializers.PrimaryKeyRelatedField, read_only=True),
+    'tags': partial(serializers.PrimaryKeyRelatedField, many=True,
+                    read_only=True),
+    'ingredients': partial(serializers.SlugRelatedField, many=True,
+                           read_only=True, slug_field='ingredient_id',
+                           source='recipeingredients'),
+}
+# Поле ответа -> столбцы рецепта, которые для него нужны
+RECIPE_FIELD_COLUMNS = {
+    'author': ('author',),
+    'name': ('name',),
+    'image': ('image',),
+    'image_renditions': ('image', 'rendered_image'),
+    'text': ('text',),
+    'cooking_time': ('cooking_time',),
+}
+
+
+class RecipeListSerializer(RecipeGetSerializer):
+    """Компактный рецепт для лент: ?fields= и ?expand=.
+
+    Без fields выводятся поля карточки. Автор, теги и ингредиенты
+    выводятся целиком, только если перечислены в expand.
+    """
+    CARD_FIELDS = ('id', 'tags', 'author', 'is_favorited',
+                   'is_in_shopping_cart', 'name', 'image',
+                   'image_renditions', 'cooking_time')
+
+    def get_fields(self):
+        fields = super().get_fields()
+        requested = self.context['fields'] or self.CARD_FIELDS
+        for name, field in COLLAPSED_RECIPE_FIELDS.items():
+            if name not in self.context['expand']:
+                fields[name] = field()
+        return {name: field for name, field in fields.items()
+                if name in requested}
+
+    @staticmethod
+    def prepare_queryset(queryset, fields, expand, user):
+        """Загружает только то, что попадёт в ответ."""
+        fields = fields or RecipeListSerializer.CARD_FIELDS
+        # Поля сортировок нужны keyset-пагинации
+        columns = {'id', 'pub_date', 'cooking_time'} | {
+            column for name in fields if name in RECIPE_FIELD_COLUMNS
+            for column in RECIPE_FIELD_COLUMNS[name]
+        }
+        author = 'author' in fields and 'author' in expand
+        if author:
+            queryset = queryset.select_related('author')
+            columns.update(f'author__{name}' for name in
+                           UserGetSerializer.Meta.fields
+                           if name != 'is_subscribed')
+        if 'tags' in fields:
+            queryset = queryset.prefetch_related(Prefetch(
+                'tags', queryset=Tag.objects.all() if 'tags' in expand
+                else Tag.objects.only('id')
+            ))
+        if 'ingredients' in fields:
+            queryset = queryset.prefetch_related(Prefetch(
+                'recipeingredients',
+                queryset=RecipeIngredient.objects.select_related('ingredient')
+                if 'ingredients' in expand
+                else RecipeIngredient.objects.only('recipe', 'ingredient')
+            ))
+        if author or {'is_favorited', 'is_in_shopping_cart'} & set(fields):
+            queryset = queryset.with_user_flags(user)
+        return queryset.only(*columns)
+
+
+class RecipeFieldsQuerySerializer(serializers.Serializer):
+    """Параметры ?fields=id,name,author&expand=author."""
+    fields = serializers.CharField(required=False, default='')
+    expand = serializers.CharField(required=False, default='')
+
+    @staticmethod
+    def split(value, allowed):
+        names = tuple(dict.fromkeys(
+            name.strip() for name in value.split(',') if name.strip()
+        ))
+        unknown = [name for name in names if name not in allowed]
+        if unknown:
+            raise serializers.ValidationError(
+                f'Неизвестные поля: {", ".join(unknown)}'
+            )
+        return names
+
+    def validate_fields(self, value):
+        return self.split(value, RecipeGetSerializer.Meta.fields)
+
+    def validate_expand(self, value):
+        return self.split(value, COLLAPSED_RECIPE_FIELDS)
+
+
+class RecipeCookableSerializer(RecipeGetSerializer):
+    matched_ingredients = serializers.IntegerField(read_only=True)
+    missing_ingredients = serializers.IntegerField(read_only=True)
+
+    class Meta(RecipeGetSerializer.Meta):
+        fields = RecipeGetSerializer.Meta.fields + (
+            'matched_ingredients', 'missing_ingredients'
+        )
+
+
+class CookableQuerySerializer(serializers.Serializer):
+    """Параметры ?ingredients=1&ingredients=2&missing=1."""
+    ingredients = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        min_length=1,
+        max_length=COOKABLE_MAX_INGREDIENTS
+    )
+    missing = serializers.IntegerField(
+        min_value=0, max_value=COOKABLE_MAX_MISSING, default=0
+    )
+
+
+class RecipeBatchSerializer(serializers.Serializer):
+    """Тело пакетных запросов: {"recipes": [1, 2, 3]}."""
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        min_length=1,
+        max_length=BATCH_MAX_RECIPES
+    )
+
+    def validate_recipes(self, value):
+        # Повторы убираем, сохраняя порядок для ответа
+        return list(dict.fromkeys(value))
 
 
 class RecipeCreateSerializer(serializers.ModelSerializer):
@@ -208,7 +338,7 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
 
     def validate(self, data):
         ingredients_list = []
-        for ingredient in data.get('recipeingredients'):
+        for ingredient in data.get('recipeingredients', []):
             if ingredient.get('amount') <= 0:
                 raise serializers.ValidationError(
                     'Количество не может быть меньше 1'
@@ -218,6 +348,14 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError(
                 'Вы пытаетесь добавить в рецепт два одинаковых ингредиента'
             )
+        # Все ингредиенты проверяются одним запросом
+        found = Ingredient.objects.in_bulk(ingredients_list)
+        missing = [str(pk) for pk in ingredients_list if pk not in found]
+        if missing:
+            raise serializers.ValidationError({
+                'ingredients': 'Ингредиенты не найдены: '
+                               + ', '.join(missing)
+            })
         return data
 
     @transaction.atomic
@@ -232,59 +370,23 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
 
     @transaction.atomic
     def update(self, instance, validated_data):
-        ingredients = validated_data.pop('recipeingredients')
-        tags = validated_data.pop('tags')
-        instance.tags.clear()
-        instance.tags.set(tags)
-        RecipeIngredient.objects.filter(recipe=instance).delete()
-        super().update(instance, validated_data)
-        create_ingredients(ingredients, instance)
-        instance.save()
-        return instance
+        ingredients = validated_data.pop('recipeingredients', None)
+        tags = validated_data.pop('tags', None)
+        # set() сам вычисляет разницу с текущими тегами
+        if tags is not None:
+            instance.tags.set(tags)
+        if ingredients is not None:
+            update_ingredients(ingredients, instance)
+        return super().update(instance, validated_data)
 
     def to_representation(self, instance):
         request = self.context.get('request')
+        # Перечитываем рецепт с prefetch, чтобы ответ не делал
+        # отдельный запрос на каждый ингредиент
+        instance = Recipe.objects.with_related().with_user_flags(
+            request.user
+        ).get(pk=instance.pk)
         return RecipeGetSerializer(
             instance,
             context={'request': request}
         ).data
-
-
-class FavoriteSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = Favorite
-        fields = '__all__'
-        validators = [
-            UniqueTogetherValidator(
-                queryset=Favorite.objects.all(),
-                fields=('user', 'recipe'),
-                message='Рецепт уже добавлен в избранное'
-            )
-        ]
-
-    def to_representation(self, instance):
-        request = self.context.get('request')
-        return RecipeSmallSerializer(
-            instance.recipe,
-            context={'request': request}
-        ).data
-
-
-class ShoppingListSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = ShoppingList
-        fields = '__all__'
-        validators = [
-            UniqueTogetherValidator(
-                queryset=ShoppingList.objects.all(),
-                fields=('user', 'recipe'),
-                message='Рецепт уже добавлен в список покупок'
-            )
-        ]
-
-    def to_representation(self, instance):
-        request = self.context.get('request')
-        return RecipeSmallSerializer(
-            instance.recipe,
-            context={'request': request}
-        ).data
@@ -0,0 +1,801 @@
+import os
+import re
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
+from unittest import mock, skipIf, skipUnless
+
+from django.apps import apps
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.management import CommandError, call_command
+from django.db import (IntegrityError, connection, connections,
+                       transaction)
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils.http import http_date
+from rest_framework.authtoken.models import Token
+from rest_framework.serializers import Serializer
+from rest_framework.test import APIClient
+from api.management.commands.explain_recipe_filters import FILTER_INDEXES
+from api.replicas import replica_aliases
+from api.serializers import RecipeGetSerializer
+from api.utils import add_relations
+from recipes.cache import get_version, membership_version
+from recipes.carts import mismatched_cart_users
+from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                            ShoppingCartTotal, ShoppingList, Tag)
+from recipes.search import search_enabled, search_recipes
+from recipes.signals import ingredients_changed
+from users.models import Follow, User
+
+
+def create_recipes(count, authors, tags, ingredients):
+    recipes = []
+    for number in range(count):
+        recipe = Recipe.objects.create(
+            author=authors[number % len(authors)],
+            name=f'Рецепт {number}',
+            text='Описание',
+            cooking_time=10,
+            image='recipes/test.png'
+        )
+        recipe.tags.set(tags)
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe=recipe, ingredient=ingredient,
+                             amount=10)
+            for ingredient in ingredients
+        )
+        recipes.append(recipe)
+    return recipes
+
+
+class APITestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.authors = [
+            User.objects.create_user(
+                email=f'author{number}@example.com',
+                username=f'author{number}',
+                first_name='Имя',
+                last_name='Фамилия',
+                password='password123'
+            )
+            for number in range(3)
+        ]
+        cls.user = cls.authors[0]
+        cls.tags = [
+            Tag.objects.create(name=f'Тег {number}', color='#FF0000',
+                               slug=f'tag{number}')
+            for number in range(2)
+        ]
+        cls.ingredients = [
+            Ingredient.objects.create(name=f'Ингредиент {number}',
+                                      measurement_unit='г')
+            for number in range(3)
+        ]
+        cls.recipes = create_recipes(12, cls.authors, cls.tags,
+                                     cls.ingredients)
+
+    def setUp(self):
+        # Наборы избранного и карточки рецептов кэшируются между запросами
+        cache.clear()
+        self.client = APIClient()
+        self.user_client = APIClient()
+        self.user_client.force_authenticate(self.user)
+
+
+class RecipeListQueriesTest(APITestCase):
+    """Число запросов списка рецептов не зависит от размера страницы."""
+    # Валидаторы ETag, COUNT пагинации, рецепты, теги, ингредиенты
+    LIST_QUERIES = 5
+
+    def assert_list_queries(self, client):
+        for limit in (2, 10):
+            cache.clear()
+            with self.subTest(limit=limit):
+                with self.assertNumQueries(self.LIST_QUERIES):
+                    response = client.get(f'/api/recipes/?limit={limit}')
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.data['results']), limit)
+
+    def test_anonymous(self):
+        self.assert_list_queries(self.client)
+
+    def test_authenticated(self):
+        self.assert_list_queries(self.user_client)
+
+
+class ShoppingCartTotalsTest(APITestCase):
+    def cart_amounts(self):
+        response = self.user_client.get('/api/recipes/shopping_cart/')
+        self.assertEqual(response.status_code, 200)
+        return {item['id']: item['amount'] for item in response.data}
+
+    def test_amount_change_updates_totals(self):
+        recipe = self.recipes[0]
+        self.user_client.post(f'/api/recipes/{recipe.id}/shopping_cart/')
+        ingredients = [
+            {'id': ingredient.id, 'amount': 10}
+            for ingredient in self.ingredients
+        ]
+        ingredients[0]['amount'] = 100
+        response = self.user_client.patch(
+            f'/api/recipes/{recipe.id}/', {'ingredients': ingredients},
+            format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.cart_amounts(), {
+            ingredient['id']: ingredient['amount']
+            for ingredient in ingredients
+        })
+        response = self.user_client.get(
+            '/api/recipes/download_shopping_cart/?format=txt'
+        )
+        self.assertIn('100', b''.join(response.streaming_content).decode())
+
+    def test_composition_change_applied_to_all_carts(self):
+        recipe = self.recipes[0]
+        for author in self.authors:
+            ShoppingList.objects.create(user=author, recipe=recipe)
+        ShoppingList.objects.create(user=self.user, recipe=self.recipes[3])
+        extra = Ingredient.objects.create(name='Новый', measurement_unit='г')
+        # Первый изменён, второй остался, третий удалён, добавлен новый
+        ingredients = [
+            {'id': self.ingredients[0].id, 'amount': 100},
+            {'id': self.ingredients[1].id, 'amount': 10},
+            {'id': extra.id, 'amount': 5},
+        ]
+        with mock.patch('recipes.signals.refresh_cart_totals') as rebuild:
+            response = self.user_client.patch(
+                f'/api/recipes/{recipe.id}/', {'ingredients': ingredients},
+                format='json'
+            )
+        self.assertEqual(response.status_code, 200)
+        rebuild.assert_not_called()
+        self.assertEqual(mismatched_cart_users(), [])
+        self.assertEqual(self.cart_amounts(), {
+            self.ingredients[0].id: 110,
+            self.ingredients[1].id: 20,
+            self.ingredients[2].id: 10,
+            extra.id: 5,
+        })
+        self.assertFalse(ShoppingCartTotal.objects.filter(
+            user=self.authors[1], ingredient=self.ingredients[2]
+        ).exists())
+
+
+class MembershipVersionTest(APITestCase):
+    def test_version_bumped_on_commit(self):
+        name = membership_version(self.user.pk)
+        version = get_version(name)
+        with self.captureOnCommitCallbacks(execute=True):
+            add_relations(Favorite, self.user, 'recipe',
+                          [self.recipes[1].pk])
+            self.assertEqual(get_version(name), version)
+        self.assertNotEqual(get_version(name), version)
+
+
+class FilterIndexesTest(APITestCase):
+    def test_indexes_used(self):
+        # CommandError, если в плане нет ожидаемого индекса
+        call_command('explain_recipe_filters', stdout=StringIO())
+
+    def test_missing_index_fails(self):
+        with mock.patch.dict(FILTER_INDEXES, tags=['unknown_idx']):
+            with self.assertRaisesMessage(CommandError, 'tags'):
+                call_command('explain_recipe_filters', stdout=StringIO())
+
+
+class ConditionalGetTest(APITestCase):
+    def test_filters_validated_once(self):
+        # author, tags, валидаторы, COUNT, рецепты, теги, ингредиенты
+        with self.assertNumQueries(7):
+            response = self.client.get(
+                f'/api/recipes/?author={self.user.id}&tags={self.tags[0].id}'
+            )
+        self.assertEqual(response.status_code, 200)
+
+    def test_cursor_page_without_count(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/recipes/?limit=3&cursor=')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(any('COUNT(' in query['sql']
+                             for query in queries.captured_queries))
+
+    def test_cursor_page_etag(self):
+        url = '/api/recipes/?limit=3&cursor='
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(
+            self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304
+        )
+        self.recipes[-1].delete()
+        self.assertEqual(
+            self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200
+        )
+
+    def test_list_not_modified_after_delete(self):
+        self.assertNotIn('Last-Modified', self.client.get('/api/recipes/'))
+        self.recipes[-1].delete()
+        response = self.client.get('/api/recipes/',
+                                   HTTP_IF_MODIFIED_SINCE=http_date())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], len(self.recipes) - 1)
+
+    def test_user_routes(self):
+        url = f'/api/users/{self.authors[1].id}/'
+        etag = self.user_client.get(url)['ETag']
+        self.assertEqual(
+            self.user_client.get(url, HTTP_IF_NONE_MATCH=etag).status_code,
+            304
+        )
+        self.assertIn('ETag', self.user_client.get('/api/users/'))
+        response = self.user_client.get('/api/users/me/')
+        self.assertEqual(response.data['id'], self.user.id)
+        self.authors[1].first_name = 'Другое'
+        self.authors[1].save()
+        response = self.user_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['first_name'], 'Другое')
+
+
+class AsyncViewsTest(APITestCase):
+    """Асинхронные эндпоинты отвечают так же, как синхронные."""
+    URLS = (
+        'recipes/',
+        'recipes/?limit=2&page=2',
+        'recipes/?page=last&limit=5',
+        'recipes/?page=99',
+        'recipes/?limit=2&cursor=',
+        'recipes/?limit=3&cursor=&ordering=cooking_time',
+        'recipes/?cursor=bad',
+        'recipes/?ordering=popular',
+        'recipes/?ordering=unknown',
+        'recipes/?is_favorited=true&is_in_shopping_cart=0',
+        'recipes/?tags=tag0&tags=tag1',
+        'recipes/?tags=missing',
+        'recipes/?author=999',
+        'recipes/?fields=id,name,ingredients&expand=ingredients',
+        'recipes/?expand=author',
+        'recipes/?fields=unknown',
+        'recipes/{recipe}/',
+        'recipes/999/',
+        'tags/',
+        'tags/{tag}/',
+        'ingredients/',
+        'ingredients/?name=Ингр',
+        'ingredients/{ingredient}/',
+    )
+
+    def assert_same(self, client):
+        client.post(f'/api/recipes/{self.recipes[0].id}/favorite/')
+        for url in self.URLS:
+            url = url.format(recipe=self.recipes[0].id, tag=self.tags[0].id,
+                             ingredient=self.ingredients[0].id)
+            with self.subTest(url=url):
+                expected = client.get(f'/api/{url}')
+                response = client.get(f'/api/async/{url}')
+                self.assertEqual(response.status_code, expected.status_code)
+                self.assertEqual(
+                    response.content.decode().replace('/api/async/', '/api/'),
+                    expected.content.decode()
+                )
+
+    def test_anonymous(self):
+        self.assert_same(self.client)
+
+    def test_authenticated(self):
+        self.assert_same(self.user_client)
+
+
+class ReplicaReadTest(TransactionTestCase):
+    """Чтения списка идут на реплику, флаги пользователя - с основной базы.
+
+    В TestCase основная база всегда внутри транзакции, и роутер
+    не выбирает реплику, поэтому здесь TransactionTestCase.
+    """
+    REPLICA = 'replica_test'
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            email='user@example.com', username='user', first_name='Имя',
+            last_name='Фамилия', password='password123'
+        )
+        tags = [Tag.objects.create(name='Тег', color='#FF0000', slug='tag')]
+        ingredients = [Ingredient.objects.create(name='Ингредиент',
+                                                 measurement_unit='г')]
+        self.recipes = create_recipes(3, [self.user], tags, ingredients)
+        self.new_recipe = lambda: create_recipes(1, [self.user], tags,
+                                                 ingredients)
+        # Реплика - копия основной базы до изменений в тесте
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        connections.settings[self.REPLICA] = dict(
+            connections.settings['default'],
+            NAME=os.path.join(directory.name, 'replica.sqlite3')
+        )
+        self.addCleanup(self.remove_replica)
+        call_command('migrate', database=self.REPLICA, verbosity=0)
+        # Внешние ключи SQLite проверяются при фиксации транзакции
+        with transaction.atomic(using=self.REPLICA):
+            for app_label in ('users', 'recipes'):
+                for model in apps.get_app_config(app_label).get_models(
+                    include_auto_created=True
+                ):
+                    model.objects.using(self.REPLICA).bulk_create(
+                        model.objects.all()
+                    )
+        self.client = APIClient()
+        self.user_client = APIClient()
+        self.user_client.force_authenticate(self.user)
+
+    def remove_replica(self):
+        connections[self.REPLICA].close()
+        del connections[self.REPLICA]
+        del connections.settings[self.REPLICA]
+
+    def test_anonymous_reads_replica(self):
+        self.assertEqual(replica_aliases(), [self.REPLICA])
+        self.new_recipe()
+        response = self.client.get('/api/recipes/')
+        self.assertEqual(response.data['count'], len(self.recipes))
+
+    def test_user_flags_read_primary(self):
+        recipe = self.recipes[-1]
+        self.user_client.post(f'/api/recipes/{recipe.id}/favorite/')
+        self.user_client.post(f'/api/recipes/{recipe.id}/shopping_cart/')
+        for url in ('/api/recipes/', '/api/recipes/?is_favorited=1',
+                    f'/api/recipes/{recipe.id}/'):
+            with self.subTest(url=url):
+                response = self.user_client.get(url)
+                data = response.data.get('results', [response.data])[0]
+                self.assertEqual(data['id'], recipe.id)
+                self.assertTrue(data['is_favorited'])
+                self.assertTrue(data['is_in_shopping_cart'])
+
+
+class CookableTest(APITestCase):
+    def cookable(self, ingredients, **params):
+        params['ingredients'] = [ingredient.id for ingredient in ingredients]
+        response = self.client.get('/api/recipes/cookable/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_all_ingredients(self):
+        # Рецепты созданы bulk_create, без сигналов моделей
+        data = self.cookable(self.ingredients)
+        self.assertEqual(data['count'], len(self.recipes))
+        for recipe in data['results']:
+            self.assertEqual(recipe['matched_ingredients'], 3)
+            self.assertEqual(recipe['missing_ingredients'], 0)
+
+    def test_missing(self):
+        self.assertEqual(self.cookable(self.ingredients[:2])['count'], 0)
+        data = self.cookable(self.ingredients[:2], missing=1)
+        self.assertEqual(data['count'], len(self.recipes))
+        self.assertEqual(
+            {(recipe['matched_ingredients'], recipe['missing_ingredients'])
+             for recipe in data['results']},
+            {(2, 1)}
+        )
+
+    def test_fully_cookable_first(self):
+        recipe = self.recipes[0]
+        RecipeIngredient.objects.filter(
+            recipe=recipe, ingredient=self.ingredients[2]
+        ).delete()
+        data = self.cookable(self.ingredients[:2], missing=1)
+        self.assertEqual(data['results'][0]['id'], recipe.id)
+        self.assertEqual(data['results'][0]['missing_ingredients'], 0)
+
+    def test_search(self):
+        recipe = self.recipes[0]
+        recipe.name = 'Борщ'
+        recipe.save()
+        data = self.cookable(self.ingredients, search='Борщ')
+        self.assertEqual([item['id'] for item in data['results']],
+                         [recipe.id])
+
+
+@override_settings(PROFILING_SAMPLE_RATE=1)
+class ProfilingTest(APITestCase):
+    def assert_timing(self, response):
+        self.assertEqual(response.status_code, 200)
+        timing = dict(
+            re.match(r'(\w+);dur=([\d.]+)', part.strip()).groups()
+            for part in response['Server-Timing'].split(',')
+        )
+        self.assertEqual(set(timing), {'db', 'serializer', 'total'})
+        self.assertGreater(float(timing['serializer']), 0)
+        queries = re.search(r'"(\d+) queries"', response['Server-Timing'])
+        self.assertGreater(int(queries.group(1)), 0)
+
+    def test_sync(self):
+        self.assert_timing(self.client.get('/api/recipes/'))
+
+    async def test_async(self):
+        self.assert_timing(await self.async_client.get('/api/async/recipes/'))
+
+    def test_serializers_not_patched(self):
+        serializer = RecipeGetSerializer()
+        self.assertIs(type(serializer).data, Serializer.data)
+
+
+class CatalogueQueriesTest(APITestCase):
+    """Справочники из кэша отдаются без запросов к БД, даже с токеном."""
+
+    def test_cached_without_queries(self):
+        token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        for url in ('/api/tags/', f'/api/tags/{self.tags[0].id}/',
+                    '/api/ingredients/', '/api/ingredients/?name=Ингр'):
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url).status_code, 200)
+                with self.assertNumQueries(0):
+                    response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+
+
+class RenditionUrlsTest(APITestCase):
+    def get_recipe(self):
+        return self.client.get(f'/api/recipes/{self.recipes[0].pk}/').json()
+
+    def test_urls_without_storage(self):
+        with mock.patch.object(default_storage, 'exists') as exists:
+            pending = self.get_recipe()
+            Recipe.objects.filter(pk=self.recipes[0].pk).update(
+                rendered_image='recipes/test.png'
+            )
+            rendered = self.get_recipe()
+            self.client.get('/api/recipes/')
+        exists.assert_not_called()
+        self.assertEqual(set(pending['image_renditions'].values()),
+                         {pending['image']})
+        self.assertTrue(rendered['image_renditions']['list'].endswith(
+            '/media/recipes/renditions/test_list.webp'
+        ))
+
+    def test_small_card_keeps_original(self):
+        response = self.user_client.post(
+            f'/api/recipes/{self.recipes[1].pk}/favorite/'
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(
+            response.data['image'].endswith('/media/recipes/test.png')
+        )
+        self.assertEqual(response.data['thumbnail'], response.data['image'])
+
+
+class CountersTest(APITestCase):
+    def assert_counters(self, recipe, favorites, author, followers):
+        recipe.refresh_from_db()
+        author.refresh_from_db()
+        self.assertEqual(recipe.favorites_count, favorites)
+        self.assertEqual(author.followers_count, followers)
+
+    def test_counters_follow_relations(self):
+        recipe, author = self.recipes[1], self.authors[1]
+        self.user_client.post(f'/api/recipes/{recipe.pk}/favorite/')
+        self.user_client.post(f'/api/users/{author.pk}/subscribe/')
+        add_relations(Favorite, self.authors[2], 'recipe', [recipe.pk])
+        self.assert_counters(recipe, 2, author, 1)
+        self.user_client.delete(f'/api/recipes/{recipe.pk}/favorite/')
+        self.user_client.delete(f'/api/users/{author.pk}/subscribe/')
+        self.assert_counters(recipe, 1, author, 0)
+
+    def test_stale_save_keeps_counters(self):
+        recipe = Recipe.objects.get(pk=self.recipes[1].pk)
+        Favorite.objects.create(user=self.user, recipe=recipe)
+        recipe.name = 'Новое название'
+        recipe.save()
+        self.assert_counters(recipe, 1, self.authors[1], 0)
+
+    def test_recount_fixes_drift(self):
+        Favorite.objects.create(user=self.user, recipe=self.recipes[1])
+        Recipe.objects.update(favorites_count=5)
+        output = StringIO()
+        call_command('recount_counters', stdout=output)
+        self.assertIn(
+            f'Recipe.favorites_count: исправлено строк {len(self.recipes)}',
+            output.getvalue()
+        )
+        self.assert_counters(self.recipes[1], 1, self.authors[1], 0)
+        self.assertEqual(
+            Recipe.objects.exclude(pk=self.recipes[1].pk).filter(
+                favorites_count=0
+            ).count(),
+            len(self.recipes) - 1
+        )
+
+
+class SubscriptionsFeedTest(APITestCase):
+    def get_feed(self, query=''):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.user_client.get(
+                f'/api/users/subscriptions/{query}'
+            )
+        self.assertEqual(response.status_code, 200)
+        return response.data['results'], len(queries)
+
+    def test_queries_do_not_grow(self):
+        for author in self.authors[1:]:
+            Follow.objects.create(user=self.user, author=author)
+        _, expected = self.get_feed()
+        authors = [
+            User.objects.create_user(
+                email=f'new{number}@example.com', username=f'new{number}',
+                first_name='Имя', last_name='Фамилия', password='password123'
+            )
+            for number in range(3)
+        ]
+        create_recipes(6, authors, self.tags, self.ingredients)
+        Follow.objects.bulk_create(
+            Follow(user=self.user, author=author) for author in authors
+        )
+        results, queries = self.get_feed()
+        self.assertEqual(len(results), 5)
+        self.assertEqual(queries, expected)
+
+    def test_recipes_limit(self):
+        author = self.authors[1]
+        Follow.objects.create(user=self.user, author=author)
+        (result, ), _ = self.get_feed('?recipes_limit=2')
+        newest = Recipe.objects.filter(author=author).order_by(
+            '-pub_date', '-id'
+        ).values_list('id', flat=True)[:2]
+        self.assertEqual([recipe['id'] for recipe in result['recipes']],
+                         list(newest))
+        self.assertEqual(result['recipes_count'], 4)
+        self.assertTrue(result['is_subscribed'])
+        (result, ), _ = self.get_feed('?recipes_limit=0')
+        self.assertEqual(result['recipes'], [])
+
+
+class RecipeUpdateStatementsTest(APITestCase):
+    def patch_ingredients(self, recipe, amounts):
+        table = RecipeIngredient._meta.db_table
+        with CaptureQueriesContext(connection) as queries:
+            response = self.user_client.patch(
+                f'/api/recipes/{recipe.pk}/',
+                {'ingredients': [{'id': pk, 'amount': amount}
+                                 for pk, amount in amounts.items()]},
+                format='json'
+            )
+        self.assertEqual(response.status_code, 200)
+        statements = [query['sql'].split(maxsplit=1)[0]
+                      for query in queries.captured_queries
+                      if table in query['sql']]
+        return {verb: statements.count(verb)
+                for verb in ('INSERT', 'UPDATE', 'DELETE')}, len(queries)
+
+    def test_only_differences_written(self):
+        recipe = self.recipes[0]
+        extra = Ingredient.objects.create(name='Новый', measurement_unit='г')
+        first, second, _ = self.ingredients
+        statements, _ = self.patch_ingredients(
+            recipe, {first.pk: 50, second.pk: 10, extra.pk: 5}
+        )
+        self.assertEqual(statements, {'INSERT': 1, 'UPDATE': 1, 'DELETE': 1})
+        self.assertEqual(
+            dict(recipe.recipeingredients.values_list('ingredient',
+                                                      'amount')),
+            {first.pk: 50, second.pk: 10, extra.pk: 5}
+        )
+        statements, _ = self.patch_ingredients(
+            recipe, {first.pk: 50, second.pk: 10, extra.pk: 5}
+        )
+        self.assertEqual(statements, {'INSERT': 0, 'UPDATE': 0, 'DELETE': 0})
+
+    def test_queries_do_not_grow_with_ingredients(self):
+        more = Ingredient.objects.bulk_create(
+            Ingredient(name=f'Ещё {number}', measurement_unit='г')
+            for number in range(20)
+        )
+        small = {ingredient.pk: 20 for ingredient in self.ingredients}
+        large = {ingredient.pk: 20 for ingredient in more}
+        self.patch_ingredients(self.recipes[3], large)
+        _, expected = self.patch_ingredients(
+            self.recipes[0], {pk: 30 for pk in small}
+        )
+        _, queries = self.patch_ingredients(
+            self.recipes[3], {pk: 30 for pk in large}
+        )
+        self.assertEqual(queries, expected)
+
+    def test_unknown_ingredients_reported_together(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.user_client.patch(
+                f'/api/recipes/{self.recipes[0].pk}/',
+                {'ingredients': [{'id': 9001, 'amount': 1},
+                                 {'id': self.ingredients[0].pk, 'amount': 1},
+                                 {'id': 9002, 'amount': 1}]},
+                format='json'
+            )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('9001, 9002', str(response.data['ingredients']))
+        self.assertEqual(sum(
+            Ingredient._meta.db_table in query['sql']
+            for query in queries.captured_queries
+        ), 1)
+
+
+class RecipeSearchTest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.by_name, cls.by_text, cls.by_ingredient = create_recipes(
+            3, cls.authors, cls.tags, cls.ingredients
+        )
+        cls.by_name.name = 'Суп из щавеля'
+        cls.by_name.save()
+        cls.by_text.text = 'Подавать как суп из щавеля'
+        cls.by_text.save()
+        sorrel = Ingredient.objects.create(name='щавель',
+                                           measurement_unit='г')
+        RecipeIngredient.objects.create(recipe=cls.by_ingredient,
+                                        ingredient=sorrel, amount=100)
+        ingredients_changed.send(sender=RecipeIngredient,
+                                 recipe_ids=[cls.by_ingredient.pk])
+
+    def search(self, value):
+        response = self.client.get('/api/recipes/',
+                                   {'search': value, 'limit': 50})
+        self.assertEqual(response.status_code, 200)
+        return [recipe['id'] for recipe in response.data['results']]
+
+    @skipIf(search_enabled(), 'Запасной поиск только без PostgreSQL')
+    def test_fallback_matches_name_text_and_ingredients(self):
+        self.assertCountEqual(self.search('щавел'), [
+            self.by_name.pk, self.by_text.pk, self.by_ingredient.pk
+        ])
+        self.assertEqual(self.search('суп'),
+                         [self.by_text.pk, self.by_name.pk])
+        # Рецепт с несколькими подходящими ингредиентами - один раз
+        self.assertEqual(len(self.search('Ингредиент')),
+                         len(self.recipes) + 3)
+
+    @skipUnless(search_enabled(), 'Нужен PostgreSQL')
+    def test_rank_follows_field_weights(self):
+        found = list(search_recipes(Recipe.objects.all(), 'щавель'))
+        self.assertEqual(found, [self.by_name, self.by_ingredient,
+                                 self.by_text])
+        self.assertEqual(self.search('суп из щавеля'),
+                         [self.by_name.pk, self.by_text.pk])
+
+
+class ToggleRelationsTest(APITestCase):
+    def test_duplicate_add(self):
+        recipe = self.recipes[1]
+        url = f'/api/recipes/{recipe.pk}/favorite/'
+        self.assertEqual(self.user_client.post(url).status_code, 201)
+        response = self.user_client.post(url)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('non_field_errors', response.data)
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.favorites_count, 1)
+        self.assertEqual(Favorite.objects.filter(recipe=recipe).count(), 1)
+
+    def test_remove_missing_relation(self):
+        for url in (f'/api/recipes/{self.recipes[1].pk}/shopping_cart/',
+                    f'/api/users/{self.authors[1].pk}/subscribe/'):
+            with self.subTest(url=url):
+                response = self.user_client.delete(url)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('errors', response.data)
+
+    def test_missing_target(self):
+        for url in ('/api/recipes/9999/favorite/',
+                    '/api/recipes/9999/shopping_cart/',
+                    '/api/users/9999/subscribe/'):
+            for method in ('post', 'delete'):
+                with self.subTest(url=url, method=method):
+                    response = getattr(self.user_client, method)(url)
+                    self.assertEqual(response.status_code, 404)
+
+    def test_target_deleted_during_insert(self):
+        recipe = self.recipes[1]
+
+        def delete_recipe(*args):
+            Recipe.objects.filter(pk=recipe.pk).delete()
+            raise IntegrityError
+
+        with mock.patch('api.utils.execute_relation_sql',
+                        side_effect=delete_recipe):
+            response = self.user_client.post(
+                f'/api/recipes/{recipe.pk}/favorite/'
+            )
+        self.assertEqual(response.status_code, 404)
+
+
+@skipUnless(connection.vendor == 'postgresql',
+            'Одновременные запросы проверяются на PostgreSQL')
+class ConcurrentToggleTest(TransactionTestCase):
+    def test_concurrent_adds(self):
+        user, author = (
+            User.objects.create_user(
+                email=f'{name}@example.com', username=name,
+                first_name='Имя', last_name='Фамилия', password='password123'
+            )
+            for name in ('user', 'author')
+        )
+        recipe, = create_recipes(1, [author], [], [])
+        barrier = threading.Barrier(8)
+
+        def add(_):
+            client = APIClient()
+            client.force_authenticate(user)
+            barrier.wait()
+            try:
+                return client.post(
+                    f'/api/recipes/{recipe.pk}/favorite/'
+                ).status_code
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            statuses = sorted(executor.map(add, range(8)))
+        self.assertEqual(statuses, [201] + [400] * 7)
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.favorites_count, 1)
+
+
+class BatchRelationsTest(APITestCase):
+    def batch(self, method, url, recipe_ids):
+        response = getattr(self.user_client, method)(
+            url, {'recipes': recipe_ids}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        return [(result['id'], result['status'])
+                for result in response.data['results']]
+
+    def test_statuses(self):
+        first, second = self.recipes[1].pk, self.recipes[2].pk
+        for url, model in (('/api/recipes/favorite/batch/', Favorite),
+                           ('/api/recipes/shopping_cart/batch/',
+                            ShoppingList)):
+            with self.subTest(url=url):
+                model.objects.create(user=self.user, recipe_id=first)
+                self.assertEqual(
+                    self.batch('post', url, [second, first, 9999, second]),
+                    [(second, 'added'), (first, 'exists'),
+                     (9999, 'not_found')]
+                )
+                self.assertEqual(
+                    self.batch('delete', url, [first, 9999]),
+                    [(first, 'removed'), (9999, 'not_found')]
+                )
+                self.assertEqual(
+                    self.batch('delete', url, [first, second]),
+                    [(first, 'missing'), (second, 'removed')]
+                )
+                self.assertFalse(model.objects.filter(user=self.user).exists())
+
+    def test_counters_and_memberships(self):
+        recipe_ids = [recipe.pk for recipe in self.recipes[:3]]
+        version = get_version(membership_version(self.user.pk))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.batch('post', '/api/recipes/favorite/batch/', recipe_ids)
+        self.assertNotEqual(
+            get_version(membership_version(self.user.pk)), version
+        )
+        self.assertEqual(
+            list(Recipe.objects.filter(pk__in=recipe_ids).values_list(
+                'favorites_count', flat=True
+            )),
+            [1, 1, 1]
+        )
+        response = self.user_client.get(
+            f'/api/recipes/{recipe_ids[0]}/'
+        )
+        self.assertTrue(response.data['is_favorited'])
+
+    def test_invalid_body(self):
+        for body in ({}, {'recipes': []}, {'recipes': [0]},
+                     {'recipes': list(range(1, 1000))}):
+            with self.subTest(body=body):
+                response = self.user_client.post(
+                    '/api/recipes/favorite/batch/', body, format='json'
+                )
+                self.assertEqual(response.status_code, 400)
@@ -1,8 +1,9 @@
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
-from api.views import (TagViewSet, UserViewSet, IngredientViewSet,
-                       RecipeViewSet, UserSubscriptionsViewSet,
-                       UserSubscribeView)
+from api import async_views
+from api.views import (TagViewSet, UserAccountViewSet, UserViewSet,
+                       IngredientViewSet, RecipeViewSet,
+                       UserSubscriptionsViewSet, UserSubscribeView)
 
 
 router = DefaultRouter()
@@ -13,8 +14,28 @@ router.register(r'users', UserViewSet)
 router.register(r'subscriptions', UserSubscriptionsViewSet,
                 basename='subscriptions')
 
+# Те же маршруты, что в djoser.urls, с условными GET
+djoser_router = DefaultRouter()
+djoser_router.register('users', UserAccountViewSet)
+
+# Асинхронные копии эндпоинтов чтения для запуска под ASGI
+async_urlpatterns = [
+    path('recipes/', async_views.recipe_list),
+    path('recipes/<int:pk>/', async_views.recipe_detail),
+    path('tags/', async_views.tag_list),
+    path('tags/<int:pk>/', async_views.tag_detail),
+    path('ingredients/', async_views.ingredient_list),
+    path('ingredients/<int:pk>/', async_views.ingredient_detail),
+]
+
 urlpatterns = [
-    path('', include('djoser.urls')),
+    path('async/', include(async_urlpatterns)),
+    # Должен идти раньше djoser, иначе users/subscriptions/
+    # перехватит маршрут users/<id>/
+    path('users/subscriptions/',
+         UserViewSet.as_view({'get': 'subscriptions'}),
+         name='users-subscriptions'),
+    path('', include(djoser_router.urls)),
     path('auth/', include('djoser.urls.authtoken')),
     path('', include(router.urls)),
     path('users/<int:user_id>/subscribe/', UserSubscribeView.as_view())
@@ -1,53 +1,332 @@
-import base64
-from django.shortcuts import get_object_or_404
-from django.core.files.base import ContentFile
+import csv
+import json
+from django.conf import settings
+from django.db import IntegrityError, connections, router, transaction
+from django.db.models import BooleanField, F, Prefetch, Value
+from django.http import Http404, StreamingHttpResponse
+from django.utils import timezone
 from rest_framework import serializers, status
 from rest_framework.response import Response
-from recipes.models import Ingredient, RecipeIngredient
+from recipes.carts import amount_deltas
+from recipes.images import (ImageError, decode_base64, normalize_image,
+                            rendition_urls)
+from recipes.models import Recipe, RecipeIngredient, ShoppingCartTotal
+from recipes.signals import ingredients_changed, relations_changed
+from users.models import User
+
+SHOPPING_CART_CHUNK_SIZE = 2000
 
 
 class Base64ImageField(serializers.ImageField):
     def to_internal_value(self, data):
         if isinstance(data, str) and data.startswith('data:image'):
-            format, imgstr = data.split(';base64,')
-            ext = format.split('/')[-1]
-            # Используем ContentFile для создания объекта файла
-            # из данных Base64
-            data = ContentFile(base64.b64decode(imgstr), name='temp.' + ext)
+            _, _, imgstr = data.partition(';base64,')
+            try:
+                # Декодируем с ограничением размера, проверяем формат
+                # и сохраняем без метаданных под именем-хэшем
+                data = normalize_image(decode_base64(
+                    imgstr, settings.IMAGE_MAX_UPLOAD_SIZE
+                ))
+            except ImageError as error:
+                raise serializers.ValidationError(str(error))
 
         return super().to_internal_value(data)
 
 
+def absolute_rendition_urls(recipe, request):
+    urls = rendition_urls(recipe.image, recipe.rendered_image)
+    if urls and request is not None:
+        urls = {
+            name: request.build_absolute_uri(url)
+            for name, url in urls.items()
+        }
+    return urls
+
+
+class ImageRenditionsField(serializers.ReadOnlyField):
+    """Ссылки на WebP-миниатюры изображения рецепта: list, card, detail.
+
+    Используется с source='*': нужны и image, и rendered_image.
+    """
+
+    def to_representation(self, value):
+        return absolute_rendition_urls(value, self.context.get('request'))
+
+
+def bulk_create_ingredients(ingredients, recipe):
+    RecipeIngredient.objects.bulk_create(
+        RecipeIngredient(
+            recipe=recipe,
+            ingredient_id=ingredient['id'],
+            amount=ingredient['amount']
+        )
+        for ingredient in ingredients
+    )
+
+
 def create_ingredients(ingredients, recipe):
-    ingredient_list = []
-    for ingredient in ingredients:
-        current_ingredient = get_object_or_404(Ingredient,
-                                               id=ingredient.get('id'))
-        amount = ingredient.get('amount')
-        ingredient_list.append(
-            RecipeIngredient(
-                recipe=recipe,
-                ingredient=current_ingredient,
-                amount=amount
-            )
+    bulk_create_ingredients(ingredients, recipe)
+    # Нового рецепта ещё нет ни в одном списке покупок
+    ingredients_changed.send(sender=RecipeIngredient, recipe_ids=[recipe.pk],
+                             amount_deltas={})
+
+
+def update_ingredients(ingredients, recipe):
+    """Синхронизирует ингредиенты рецепта: удаляет, изменяет и добавляет
+    только отличающиеся строки, не больше четырёх запросов."""
+    amounts = {
+        ingredient['id']: ingredient['amount'] for ingredient in ingredients
+    }
+    existing = {
+        recipe_ingredient.ingredient_id: recipe_ingredient
+        for recipe_ingredient in RecipeIngredient.objects.filter(
+            recipe=recipe
         )
-    RecipeIngredient.objects.bulk_create(ingredient_list)
+    }
+    removed = [
+        recipe_ingredient.id
+        for ingredient_id, recipe_ingredient in existing.items()
+        if ingredient_id not in amounts
+    ]
+    if removed:
+        RecipeIngredient.objects.filter(id__in=removed).delete()
+    # Разница количеств для сумм в списках покупок (recipes.carts)
+    deltas = amount_deltas(
+        {(recipe.pk, ingredient_id): recipe_ingredient.amount
+         for ingredient_id, recipe_ingredient in existing.items()},
+        {(recipe.pk, ingredient_id): amount
+         for ingredient_id, amount in amounts.items()}
+    )
+    changed = []
+    for ingredient_id, amount in amounts.items():
+        recipe_ingredient = existing.get(ingredient_id)
+        if recipe_ingredient and recipe_ingredient.amount != amount:
+            recipe_ingredient.amount = amount
+            changed.append(recipe_ingredient)
+    if changed:
+        RecipeIngredient.objects.bulk_update(changed, ['amount'])
+    added = [
+        {'id': ingredient_id, 'amount': amount}
+        for ingredient_id, amount in amounts.items()
+        if ingredient_id not in existing
+    ]
+    if added:
+        bulk_create_ingredients(added, recipe)
+    # Суммы в списках покупок зависят и от количеств
+    if removed or changed or added:
+        ingredients_changed.send(sender=RecipeIngredient,
+                                 recipe_ids=[recipe.pk],
+                                 amount_deltas=deltas)
+
+
+def parse_recipes_limit(request):
+    try:
+        recipes_limit = int(request.query_params.get('recipes_limit'))
+    except (TypeError, ValueError):
+        return None
+    return max(recipes_limit, 0)
+
+
+def get_subscriptions(user, recipes_limit=None):
+    """Авторы, на которых подписан user, с их рецептами.
+
+    Рецепты всех авторов страницы загружаются одним prefetch-запросом,
+    recipes_limit применяется оконной функцией в БД.
+    """
+    recipes = Recipe.objects.only('id', 'name', 'image', 'rendered_image',
+                                  'cooking_time', 'author_id', 'pub_date')
+    if recipes_limit is not None:
+        recipes = recipes.first_per_author(recipes_limit)
+    return User.objects.filter(following__user=user).annotate(
+        is_subscribed=Value(True, output_field=BooleanField())
+    ).prefetch_related(
+        Prefetch('recipes', queryset=recipes, to_attr='feed_recipes')
+    )
+
+
+def relation_sql(model, field_name, connection, count):
+    opts = model._meta
+    field = opts.get_field(field_name)
+    target = field.related_model._meta
+    qn = connection.ops.quote_name
+    table = qn(opts.db_table)
+    user, column = qn(opts.get_field('user').column), qn(field.column)
+    target_pk = qn(target.pk.column)
+    ids = ', '.join(['%s'] * count)
+    # Даты добавления (auto_now_add) передаются параметрами после user
+    dated = [qn(f.column) for f in opts.concrete_fields
+             if getattr(f, 'auto_now_add', False)]
+    columns = ', '.join([user, column, *dated])
+    values = ', '.join(['%s', target_pk, *['%s'] * len(dated)])
+    insert = (
+        f'INSERT INTO {table} ({columns}) '
+        f'SELECT {values} FROM {qn(target.db_table)} '
+        f'WHERE {target_pk} IN ({ids}) '
+        f'ON CONFLICT DO NOTHING RETURNING {column}'
+    )
+    delete = (
+        f'DELETE FROM {table} WHERE {user} = %s AND {column} IN ({ids}) '
+        f'RETURNING {column}'
+    )
+    return insert, delete, len(dated)
+
+
+def execute_relation_sql(model, user, field_name, target_ids, created):
+    using = router.db_for_write(model)
+    connection = connections[using]
+    insert, delete, dated = relation_sql(model, field_name, connection,
+                                         len(target_ids))
+    if created:
+        now = connection.ops.adapt_datetimefield_value(timezone.now())
+        sql, params = insert, [user.pk, *[now] * dated, *target_ids]
+    else:
+        sql, params = delete, [user.pk, *target_ids]
+    with transaction.atomic(using=using):
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            changed = [target_id for (target_id, ) in cursor.fetchall()]
+        if changed:
+            # Сырой запрос не отправляет сигналы моделей, а на них
+            # держатся счётчики и версии кэша (см. recipes.signals)
+            relations_changed.send(sender=model, user_id=user.pk,
+                                   target_ids=changed, created=created)
+    return changed
+
+
+def add_relations(model, user, field_name, target_ids):
+    """Связывает пользователя с объектами (рецептами, авторами) одним
+    INSERT ... SELECT ... ON CONFLICT DO NOTHING RETURNING.
+
+    Строки вставляются только для существующих объектов, а повторное
+    добавление, в том числе одновременное, гасится уникальным
+    ограничением без IntegrityError. Возвращает id объектов,
+    для которых связь создана.
+    """
+    try:
+        return execute_relation_sql(model, user, field_name,
+                                    target_ids, True)
+    except IntegrityError:
+        # Объект удалили между SELECT и проверкой внешнего ключа
+        return []
+
 
+def remove_relations(model, user, field_name, target_ids):
+    """Удаляет связи одним DELETE ... RETURNING.
 
-def create_model_instance(request, instance, serializer_name):
-    serializer = serializer_name(
-        data={'user': request.user.id, 'recipe': instance.id, },
-        context={'request': request}
+    Возвращает id объектов, связь с которыми была и удалена.
+    """
+    return execute_relation_sql(model, user, field_name, target_ids, False)
+
+
+def add_relation(model, user, field_name, target_id):
+    return bool(add_relations(model, user, field_name, [target_id]))
+
+
+def remove_relation(model, user, field_name, target_id):
+    return bool(remove_relations(model, user, field_name, [target_id]))
+
+
+def relation_results(model, target_ids, changed, status_changed,
+                     status_unchanged):
+    """Результат по каждому id пакетной операции.
+
+    Существование проверяется одним запросом и только для id,
+    которые не изменились.
+    """
+    changed = set(changed)
+    unchanged = [pk for pk in target_ids if pk not in changed]
+    existing = set(
+        model.objects.filter(pk__in=unchanged).values_list('pk', flat=True)
+    ) if unchanged else set()
+    return [
+        {
+            'id': pk,
+            'status': (
+                status_changed if pk in changed
+                else status_unchanged if pk in existing
+                else 'not_found'
+            )
+        }
+        for pk in target_ids
+    ]
+
+
+def relation_error(model, pk, data):
+    """400 с описанием ошибки, если объект есть, иначе 404.
+
+    Проверка существования нужна только на пути ошибки.
+    """
+    if not model.objects.filter(pk=pk).exists():
+        raise Http404
+    return Response(data, status=status.HTTP_400_BAD_REQUEST)
+
+
+def get_shopping_cart_ingredients(user):
+    """Суммы ингредиентов из списка покупок, отсортированные в БД.
+
+    Читаются готовыми из ShoppingCartTotal (см. recipes.carts).
+    """
+    return ShoppingCartTotal.objects.filter(user=user).values(
+        'ingredient__name', 'ingredient__measurement_unit',
+        total_amount=F('amount')
+    ).order_by(
+        'ingredient__name', 'ingredient__measurement_unit'
+    ).iterator(chunk_size=SHOPPING_CART_CHUNK_SIZE)
+
+
+class Echo:
+    """Буфер для csv.writer, который просто возвращает записанную строку."""
+
+    def write(self, value):
+        return value
+
+
+def shopping_cart_txt(ingredients):
+    yield 'Список покупок:\n'
+    for ingredient in ingredients:
+        yield (f'\n{ingredient["ingredient__name"]} - '
+               f'{ingredient["total_amount"]}, '
+               f'{ingredient["ingredient__measurement_unit"]}')
+
+
+def shopping_cart_csv(ingredients):
+    writer = csv.writer(Echo())
+    yield writer.writerow(('name', 'measurement_unit', 'amount'))
+    for ingredient in ingredients:
+        yield writer.writerow((
+            ingredient['ingredient__name'],
+            ingredient['ingredient__measurement_unit'],
+            ingredient['total_amount'],
+        ))
+
+
+def shopping_cart_json(ingredients):
+    yield '['
+    separator = ''
+    for ingredient in ingredients:
+        yield separator + json.dumps({
+            'name': ingredient['ingredient__name'],
+            'measurement_unit': ingredient['ingredient__measurement_unit'],
+            'amount': ingredient['total_amount'],
+        }, ensure_ascii=False)
+        separator = ','
+    yield ']'
+
+
+SHOPPING_CART_FORMATS = {
+    'txt': (shopping_cart_txt, 'text/plain'),
+    'csv': (shopping_cart_csv, 'text/csv'),
+    'json': (shopping_cart_json, 'application/json'),
+}
+
+
+def download_shopping_cart_response(user, file_format):
+    generator, content_type = SHOPPING_CART_FORMATS[file_format]
+    response = StreamingHttpResponse(
+        generator(get_shopping_cart_ingredients(user)),
+        content_type=f'{content_type}; charset=utf-8'
+    )
+    response['Content-Disposition'] = (
+        f'attachment; filename="shopping_cart.{file_format}"'
     )
-    serializer.is_valid(raise_exception=True)
-    serializer.save()
-    return Response(serializer.data, status=status.HTTP_201_CREATED)
-
-
-def delete_model_instance(request, model_name, instance, error_message):
-    if not model_name.objects.filter(user=request.user,
-                                     recipe=instance).exists():
-        return Response({'errors': error_message},
-                        status=status.HTTP_400_BAD_REQUEST)
-    model_name.objects.filter(user=request.user, recipe=instance).delete()
-    return Response(status=status.HTTP_204_NO_CONTENT)
+    return response
@@ -1,40 +1,87 @@
+from django.utils.functional import cached_property
+from djoser import views as djoser_views
 from rest_framework import viewsets, mixins, status
 from recipes.models import (Tag, Ingredient, Recipe, Favorite,
-                            ShoppingList, RecipeIngredient)
+                            ShoppingList)
 from api.serializers import (TagSerializer, UserGetSerializer,
                              UserSignUpSerializer, IngredientSerializer,
                              RecipeGetSerializer, RecipeCreateSerializer,
-                             FavoriteSerializer, ShoppingListSerializer,
-                             UserSubscribeRepresentSerializer,
-                             UserSubscribeSerializer)
-from django.db.models import Sum
+                             RecipeCookableSerializer,
+                             RecipeListSerializer,
+                             RecipeFieldsQuerySerializer,
+                             CookableQuerySerializer, RecipeBatchSerializer,
+                             RecipeSmallSerializer,
+                             ShoppingCartTotalSerializer,
+                             UserSubscribeRepresentSerializer)
 from users.models import User, Follow
 from api.pagination import PageLimitPagination
 from rest_framework.response import Response
-from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.permissions import AllowAny, IsAuthenticated
-from api.filters import IngredientFilter, RecipeFilter
+from api.filters import (IngredientFilter, RecipeFilter,
+                         ValidatedFilterBackend, INGREDIENT_SEARCH_LIMIT,
+                         SCORE_ORDERINGS)
 from api.permissions import IsAdminAuthorOrReadOnly
 from rest_framework.decorators import action
-from django.shortcuts import HttpResponse, get_object_or_404
-from api.utils import create_model_instance, delete_model_instance
+from django.shortcuts import get_object_or_404
+from api.utils import (add_relation, add_relations,
+                       download_shopping_cart_response, get_subscriptions,
+                       parse_recipes_limit, relation_error, relation_results,
+                       remove_relation, remove_relations)
+from api.renderers import CSVRenderer, PlainTextRenderer
+from rest_framework.renderers import JSONRenderer
 from rest_framework.views import APIView
+from api.cache import (CatalogueCacheMixin, ConditionalGetMixin,
+                       RecipeDetailCacheMixin)
+from api.profiling import ProfilingMixin
+from api.replicas import ReplicaReadMixin
+from recipes.cache import CATALOGUE
 
 
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+class TagViewSet(ProfilingMixin, ReplicaReadMixin, ConditionalGetMixin,
+                 CatalogueCacheMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
+    # ETag по версии справочников, без запросов к БД
+    validator_versions = (CATALOGUE, )
+    permission_classes = (AllowAny, )
+    # Справочник одинаков для всех, токен проверять незачем
+    authentication_classes = ()
     # Не использовать пагинацию
     pagination_class = None
 
 
-class UserViewSet(viewsets.ReadOnlyModelViewSet):
+class UserAccountViewSet(ProfilingMixin, ConditionalGetMixin,
+                         djoser_views.UserViewSet):
+    """Маршруты djoser /users/ с условными GET для списка и профиля."""
+    last_modified_fields = ('updated_at', )
+
+    def retrieve(self, request, *args, **kwargs):
+        # djoser отдаёт /users/me/ через retrieve без id в адресе
+        if self.action == 'me':
+            kwargs[self.lookup_field] = request.user.pk
+        return super().retrieve(request, *args, **kwargs)
+
+
+class UserViewSet(ProfilingMixin, viewsets.ReadOnlyModelViewSet):
     queryset = User.objects.all()
     pagination_class = PageLimitPagination
 
+    @action(
+        detail=False,
+        methods=['get'],
+        permission_classes=[IsAuthenticated, ]
+    )
+    def subscriptions(self, request):
+        queryset = get_subscriptions(
+            request.user, parse_recipes_limit(request)
+        )
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
     def get_serializer_class(self):
-        if self.action == 'list':
-            return UserGetSerializer
+        if self.action == 'subscriptions':
+            return UserSubscribeRepresentSerializer
         return UserGetSerializer
 
     def create(self, request, *args, **kwargs):
@@ -45,41 +92,111 @@ class UserViewSet(viewsets.ReadOnlyModelViewSet):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientViewSet(ProfilingMixin, ReplicaReadMixin, ConditionalGetMixin,
+                        CatalogueCacheMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Ingredient.objects.all()
+    validator_versions = (CATALOGUE, )
     serializer_class = IngredientSerializer
     permission_classes = (AllowAny, )
-    filter_backends = (DjangoFilterBackend, )
+    # Справочник одинаков для всех, токен проверять незачем
+    authentication_classes = ()
+    filter_backends = (ValidatedFilterBackend, )
     filterset_class = IngredientFilter
     pagination_class = None
 
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if self.action == 'list' and self.request.query_params.get('name'):
+            return queryset[:INGREDIENT_SEARCH_LIMIT]
+        return queryset
+
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(ProfilingMixin, ReplicaReadMixin, ConditionalGetMixin,
+                    RecipeDetailCacheMixin, viewsets.ModelViewSet):
     queryset = Recipe.objects.all()
+    # Теги и ингредиенты в ответе меняются вместе с версией справочников
+    last_modified_fields = ('updated_at', 'author__updated_at')
+    validator_versions = (CATALOGUE, )
     permission_classes = (IsAdminAuthorOrReadOnly, )
-    filter_backends = (DjangoFilterBackend,)
+    # Список покупок сразу после добавления рецепта должен быть полным
+    primary_actions = ('shopping_cart_totals', 'download_shopping_cart')
+    # Флаги is_favorited и is_in_shopping_cart считаются подзапросами
+    user_actions = ('list', 'retrieve', 'cookable')
+    filter_backends = (ValidatedFilterBackend,)
     filterset_class = RecipeFilter
+    lookup_value_regex = r'\d+'
     http_method_names = ['get', 'post', 'patch', 'delete']
 
+    @cached_property
+    def sparse_fields(self):
+        """(fields, expand) компактного списка или None без параметров."""
+        params = self.request.query_params
+        if self.action != 'list' or not ({'fields', 'expand'} & set(params)):
+            return None
+        serializer = RecipeFieldsQuerySerializer(data=params)
+        serializer.is_valid(raise_exception=True)
+        return (serializer.validated_data['fields'],
+                serializer.validated_data['expand'])
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.sparse_fields is not None:
+            return RecipeListSerializer.prepare_queryset(
+                queryset, *self.sparse_fields, self.request.user
+            )
+        if self.action in ('list', 'retrieve', 'cookable'):
+            return queryset.with_related().with_user_flags(
+                self.request.user
+            )
+        return queryset
+
+    def get_last_modified_fields(self):
+        fields = super().get_last_modified_fields()
+        # Порядок по рейтингам меняется после их пересчёта
+        if self.request.query_params.get('ordering') in SCORE_ORDERINGS:
+            fields += ('score__computed_at', )
+        return fields
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if self.sparse_fields is not None:
+            context['fields'], context['expand'] = self.sparse_fields
+        return context
+
     def get_serializer_class(self):
+        if self.sparse_fields is not None:
+            return RecipeListSerializer
         if self.action in ('list', 'retrieve'):
             return RecipeGetSerializer
+        if self.action == 'cookable':
+            return RecipeCookableSerializer
         return RecipeCreateSerializer
 
+    @action(detail=False, methods=['get'])
+    def cookable(self, request):
+        """Что приготовить из переданных ингредиентов."""
+        params = CookableQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        # Фильтры ленты применяются до подсчёта, сортировка - по покрытию
+        queryset = self.filter_queryset(self.get_queryset()).cookable_from(
+            params.validated_data['ingredients'],
+            params.validated_data['missing']
+        )
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
     @action(
         detail=True,
         methods=['post', 'delete'],
         permission_classes=[IsAuthenticated, ]
     )
     def favorite(self, request, pk):
-        recipe = get_object_or_404(Recipe, id=pk)
-        if request.method == 'POST':
-            return create_model_instance(request, recipe, FavoriteSerializer)
-
-        if request.method == 'DELETE':
-            error_message = 'У вас нет этого рецепта в избранном'
-            return delete_model_instance(request, Favorite,
-                                         recipe, error_message)
+        return self.toggle_recipe(
+            request, Favorite, pk,
+            'Рецепт уже добавлен в избранное',
+            'У вас нет этого рецепта в избранном'
+        )
 
     @action(
         detail=True,
@@ -87,71 +204,140 @@ class RecipeViewSet(viewsets.ModelViewSet):
         permission_classes=[IsAuthenticated, ]
     )
     def shopping_cart(self, request, pk):
-        recipe = get_object_or_404(Recipe, id=pk)
+        return self.toggle_recipe(
+            request, ShoppingList, pk,
+            'Рецепт уже добавлен в список покупок',
+            'У вас нет этого рецепта в списке покупок'
+        )
+
+    @action(
+        detail=False,
+        methods=['post', 'delete'],
+        url_path='favorite/batch',
+        permission_classes=[IsAuthenticated, ]
+    )
+    def favorite_batch(self, request):
+        return self.toggle_recipes(request, Favorite)
+
+    @action(
+        detail=False,
+        methods=['post', 'delete'],
+        url_path='shopping_cart/batch',
+        permission_classes=[IsAuthenticated, ]
+    )
+    def shopping_cart_batch(self, request):
+        return self.toggle_recipes(request, ShoppingList)
+
+    def toggle_recipes(self, request, model):
+        """Пакетное добавление и удаление: один INSERT или DELETE на все
+        рецепты и один запрос проверки существования для остальных.
+
+        Статусы в ответе: added/exists или removed/missing, а для
+        несуществующих рецептов - not_found.
+        """
+        serializer = RecipeBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        recipe_ids = serializer.validated_data['recipes']
         if request.method == 'POST':
-            return create_model_instance(request, recipe,
-                                         ShoppingListSerializer)
+            changed = add_relations(model, request.user, 'recipe',
+                                    recipe_ids)
+            results = relation_results(Recipe, recipe_ids, changed,
+                                       'added', 'exists')
+        else:
+            changed = remove_relations(model, request.user, 'recipe',
+                                       recipe_ids)
+            results = relation_results(Recipe, recipe_ids, changed,
+                                       'removed', 'missing')
+        return Response({'results': results})
 
-        if request.method == 'DELETE':
-            error_message = 'У вас нет этого рецепта в списке покупок'
-            return delete_model_instance(request, ShoppingList,
-                                         recipe, error_message)
+    def toggle_recipe(self, request, model, pk, exists_error,
+                      missing_error):
+        """Добавление и удаление одним запросом к БД, существование
+        рецепта проверяется только при ошибке."""
+        pk = int(pk)
+        if request.method == 'POST':
+            if not add_relation(model, request.user, 'recipe', pk):
+                return relation_error(
+                    Recipe, pk, {'non_field_errors': [exists_error]}
+                )
+            recipe = get_object_or_404(
+                Recipe.objects.only('id', 'name', 'image', 'rendered_image',
+                                    'cooking_time'),
+                pk=pk
+            )
+            return Response(
+                RecipeSmallSerializer(
+                    recipe, context={'request': request}
+                ).data,
+                status=status.HTTP_201_CREATED
+            )
+        if not remove_relation(model, request.user, 'recipe', pk):
+            return relation_error(Recipe, pk, {'errors': missing_error})
+        return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(
         detail=False,
         methods=['get'],
+        url_path='shopping_cart',
+        url_name='shopping-cart-totals',
         permission_classes=[IsAuthenticated, ]
     )
+    def shopping_cart_totals(self, request):
+        """Суммы ингредиентов списка покупок."""
+        totals = request.user.cart_totals.select_related(
+            'ingredient'
+        ).order_by('ingredient__name', 'ingredient__measurement_unit')
+        return Response(ShoppingCartTotalSerializer(totals, many=True).data)
+
+    @action(
+        detail=False,
+        methods=['get'],
+        permission_classes=[IsAuthenticated, ],
+        # Формат выбирается через ?format=txt|csv|json или Accept
+        renderer_classes=[PlainTextRenderer, CSVRenderer, JSONRenderer]
+    )
     def download_shopping_cart(self, request):
-        ingredients = RecipeIngredient.objects.filter(
-            recipe__carts__user=request.user
-        ).values(
-            'ingredient__name', 'ingredient__measurement_unit'
-        ).annotate(ingredient_amount=Sum('amount'))
-        shopping_list = ['Список покупок:\n']
-        for ingredient in ingredients:
-            name = ingredient['ingredient__name']
-            unit = ingredient['ingredient__measurement_unit']
-            amount = ingredient['ingredient_amount']
-            shopping_list.append(f'\n{name} - {amount}, {unit}')
-        response = HttpResponse(shopping_list, content_type='text/plain')
-        response['Content-Disposition'] = \
-            'attachment; filename="shopping_cart.txt"'
-        return response
+        return download_shopping_cart_response(
+            request.user, request.accepted_renderer.format
+        )
 
 
 class UserSubscribeView(APIView):
     def post(self, request, user_id):
-        author = get_object_or_404(User, id=user_id)
-        serializer = UserSubscribeSerializer(
-            data={'user': request.user.id, 'author': author.id},
-            context={'request': request}
-        )
-        serializer.is_valid(raise_exception=True)
-        serializer.save()
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
-
-    def delete(self, request, user_id):
-        author = get_object_or_404(User, id=user_id)
-        if not Follow.objects.filter(user=request.user,
-                                     author=author).exists():
+        if user_id == request.user.id:
             return Response(
-                {'errors': 'Вы не подписаны на этого пользователя'},
+                {'non_field_errors': ['Нельзя подписываться на самого себя!']},
                 status=status.HTTP_400_BAD_REQUEST
             )
-        Follow.objects.get(user=request.user.id,
-                           author=user_id).delete()
+        if not add_relation(Follow, request.user, 'author', user_id):
+            return relation_error(User, user_id, {
+                'non_field_errors': ['Вы уже подписаны на этого пользователя']
+            })
+        author = get_object_or_404(
+            get_subscriptions(request.user, parse_recipes_limit(request)),
+            pk=user_id
+        )
+        return Response(
+            UserSubscribeRepresentSerializer(
+                author, context={'request': request}
+            ).data,
+            status=status.HTTP_201_CREATED
+        )
+
+    def delete(self, request, user_id):
+        if not remove_relation(Follow, request.user, 'author', user_id):
+            return relation_error(User, user_id, {
+                'errors': 'Вы не подписаны на этого пользователя'
+            })
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class UserSubscriptionsViewSet(mixins.ListModelMixin,
+class UserSubscriptionsViewSet(ProfilingMixin, mixins.ListModelMixin,
                                viewsets.GenericViewSet):
     serializer_class = UserSubscribeRepresentSerializer
     pagination_class = PageLimitPagination
 
-    def subscriptions(self, request):
-        user = request.user
-        queryset = User.objects.filter(following__user=user)
-        page = self.paginate_queryset(queryset)
-        serializer = self.get_serializer(page, many=True)
-        return self.get_paginated_response(serializer.data)
+    def get_queryset(self):
+        return get_subscriptions(
+            self.request.user, parse_recipes_limit(self.request)
+        )
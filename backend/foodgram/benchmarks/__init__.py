@@ -0,0 +1,10 @@
+"""Нагрузочные замеры горячих путей API.
+
+Запуск из каталога backend/foodgram:
+
+    python -m benchmarks --output baseline.json
+    python -m benchmarks --compare baseline.json
+
+По умолчанию используется SQLite в памяти, с --database env - база из
+переменных окружения DB_* (тестовая копия, как у manage.py test).
+"""
@@ -0,0 +1,92 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks',
+        description='Замеры латентности, числа запросов и аллокаций API.'
+    )
+    parser.add_argument('--database', choices=('sqlite', 'env'),
+                        default='sqlite',
+                        help='sqlite - база в памяти, env - из DB_*')
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--recipes', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--only', help='Подстрока имени сценария')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Файл для сохранения JSON')
+    parser.add_argument('--compare', help='JSON предыдущего запуска')
+    return parser.parse_args()
+
+
+def setup_django(database):
+    if database == 'sqlite':
+        os.environ['DB_ENGINE'] = 'django.db.backends.sqlite3'
+        os.environ['DB_NAME'] = ':memory:'
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'foodgram.settings')
+    import django
+    django.setup()
+
+
+def main():
+    args = parse_args()
+    setup_django(args.database)
+
+    from django.conf import settings
+    from django.db import connection
+    from django.test.utils import (setup_test_environment,
+                                   teardown_test_environment)
+    from benchmarks.datagen import generate
+    from benchmarks.runner import compare, measure
+    from benchmarks.scenarios import build_scenarios
+    from rest_framework.authtoken.models import Token
+
+    setup_test_environment()
+    # Замеры идут на отдельной тестовой базе, как у manage.py test
+    old_name = connection.creation.create_test_db(verbosity=0)
+    media_root = tempfile.TemporaryDirectory()
+    settings.MEDIA_ROOT = media_root.name
+    try:
+        token = generate(users=args.users, recipes=args.recipes,
+                         seed=args.seed)
+        user = Token.objects.get(key=token).user
+        results = {}
+        for scenario in build_scenarios(user):
+            if args.only and args.only not in scenario.name:
+                continue
+            results[scenario.name] = measure(token, scenario, args.repeat)
+            print(f'{scenario.name}: {results[scenario.name]}',
+                  file=sys.stderr)
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+        media_root.cleanup()
+
+    report = {
+        'meta': {
+            'database': connection.vendor,
+            'python': platform.python_version(),
+            'users': args.users,
+            'recipes': args.recipes,
+            'repeat': args.repeat,
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output:
+            json.dump(report, output, ensure_ascii=False, indent=2)
+    else:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as baseline:
+            for line in compare(json.load(baseline), report):
+                print(line, file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
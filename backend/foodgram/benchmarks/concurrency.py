@@ -0,0 +1,200 @@
+"""Сравнение пропускной способности WSGI и ASGI под конкурентной нагрузкой.
+
+Запуск из каталога backend/foodgram (нужны gunicorn и uvicorn):
+
+    python -m benchmarks.concurrency --concurrency 50 --requests 2000
+
+Поднимает gunicorn с синхронным /api/recipes/ и uvicorn с асинхронным
+/api/async/recipes/ на одной и той же базе и одинаковом числе
+воркеров, затем обстреливает оба сервера запросами с заданной
+конкурентностью и печатает req/s и перцентили латентности.
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+SERVERS = {
+    'wsgi': ('/api/recipes/', [
+        'gunicorn', 'foodgram.wsgi:application',
+        '--bind', '127.0.0.1:{port}', '--workers', '{workers}',
+    ]),
+    'asgi': ('/api/async/recipes/', [
+        'uvicorn', 'foodgram.asgi:application',
+        '--host', '127.0.0.1', '--port', '{port}', '--workers', '{workers}',
+        '--no-access-log',
+    ]),
+}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks.concurrency',
+        description='Пропускная способность WSGI и ASGI чтения рецептов.'
+    )
+    parser.add_argument('--database', choices=('sqlite', 'env'),
+                        default='sqlite',
+                        help='sqlite - временный файл, env - из DB_*')
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--recipes', type=int, default=500)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--query', default='?limit=6',
+                        help='Параметры запроса списка рецептов')
+    parser.add_argument('--only', choices=tuple(SERVERS))
+    return parser.parse_args()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def prepare_database(args, tmp_dir):
+    """Создаёт отдельную базу с данными и возвращает токен замеров."""
+    if args.database == 'sqlite':
+        os.environ['DB_ENGINE'] = 'django.db.backends.sqlite3'
+        os.environ['DB_NAME'] = str(Path(tmp_dir) / 'benchmark.sqlite3')
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'foodgram.settings')
+    import django
+    django.setup()
+
+    from django.core.management import call_command
+    from django.db import connection
+    from benchmarks.datagen import generate
+
+    if args.database == 'sqlite':
+        call_command('migrate', verbosity=0)
+        old_name = None
+    else:
+        old_name = connection.creation.create_test_db(verbosity=0)
+    token = generate(users=args.users, recipes=args.recipes)
+    # Серверы в дочерних процессах подключаются к той же базе
+    os.environ['DB_NAME'] = connection.settings_dict['NAME']
+    connection.close()
+    return token, old_name
+
+
+async def fetch(host, port, path, token):
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write((
+        f'GET {path} HTTP/1.1\r\n'
+        f'Host: {host}:{port}\r\n'
+        f'Authorization: Token {token}\r\n'
+        'Connection: close\r\n\r\n'
+    ).encode())
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    await writer.wait_closed()
+    return int(response.split(b' ', 2)[1])
+
+
+async def load(port, path, token, concurrency, total):
+    latencies = []
+    errors = 0
+    queue = asyncio.Queue()
+    for _ in range(total):
+        queue.put_nowait(None)
+
+    async def worker():
+        nonlocal errors
+        while not queue.empty():
+            queue.get_nowait()
+            started = time.perf_counter()
+            try:
+                status = await fetch('127.0.0.1', port, path, token)
+            except OSError:
+                status = None
+            latencies.append(time.perf_counter() - started)
+            if status != 200:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        'rps': round(total / elapsed, 1),
+        'p50_ms': round(statistics.median(latencies) * 1000, 2),
+        'p95_ms': round(
+            latencies[int(len(latencies) * 0.95) - 1] * 1000, 2
+        ),
+        'errors': errors,
+    }
+
+
+def wait_for_port(port, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('Сервер завершился при запуске')
+        try:
+            socket.create_connection(('127.0.0.1', port), 0.5).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f'Сервер не открыл порт {port}')
+
+
+def run_server(name, args, token):
+    path, command = SERVERS[name]
+    port = free_port()
+    command = [part.format(port=port, workers=args.workers)
+               for part in command]
+    # Профилирование не должно влиять на замер
+    env = dict(os.environ, PROFILING_SAMPLE_RATE='0')
+    process = subprocess.Popen(command, cwd=BASE_DIR, env=env,
+                               stdout=subprocess.DEVNULL)
+    try:
+        wait_for_port(port, process)
+        url = path + args.query
+        # Прогрев: импорт модулей и открытие соединений с БД в воркерах
+        asyncio.run(load(port, url, token, args.workers * 2,
+                         args.workers * 10))
+        return asyncio.run(load(port, url, token, args.concurrency,
+                                args.requests))
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    args = parse_args()
+    tmp_dir = tempfile.TemporaryDirectory()
+    token, old_name = prepare_database(args, tmp_dir.name)
+    results = {}
+    try:
+        for name in SERVERS:
+            if args.only and args.only != name:
+                continue
+            results[name] = run_server(name, args, token)
+            print(f'{name}: {results[name]}', file=sys.stderr)
+    finally:
+        if old_name is not None:
+            from django.db import connection
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+        tmp_dir.cleanup()
+    print(json.dumps({
+        'meta': {
+            'database': args.database,
+            'workers': args.workers,
+            'concurrency': args.concurrency,
+            'requests': args.requests,
+        },
+        'results': results,
+    }, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
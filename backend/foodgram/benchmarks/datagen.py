@@ -0,0 +1,84 @@
+import random
+
+from django.contrib.auth.hashers import make_password
+from rest_framework.authtoken.models import Token
+from recipes.carts import refresh_cart_totals
+from recipes.counters import recount_counters
+from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                            ShoppingList, Tag)
+from recipes.scores import update_recipe_scores
+from recipes.search import update_search_vector
+from users.models import Follow, User
+
+BATCH_SIZE = 1000
+PASSWORD = 'benchmark-password'
+
+
+def generate(users=50, recipes=500, tags=6, ingredients=300,
+             ingredients_per_recipe=8, favorites_per_user=20,
+             carts_per_user=10, follows_per_user=10, seed=0):
+    """Заполняет базу bulk-запросами и возвращает токен пользователя,
+    от имени которого выполняются замеры."""
+    rnd = random.Random(seed)
+    password = make_password(PASSWORD)
+    User.objects.bulk_create([
+        User(email=f'user{i}@example.com', username=f'user{i}',
+             first_name='Имя', last_name='Фамилия', password=password)
+        for i in range(users)
+    ], batch_size=BATCH_SIZE)
+    user_ids = list(User.objects.values_list('id', flat=True))
+    Tag.objects.bulk_create([
+        Tag(name=f'Тег {i}', color=f'#{i:06x}', slug=f'tag{i}')
+        for i in range(tags)
+    ])
+    tag_ids = list(Tag.objects.values_list('id', flat=True))
+    Ingredient.objects.bulk_create([
+        Ingredient(name=f'ингредиент {i}', measurement_unit='г')
+        for i in range(ingredients)
+    ], batch_size=BATCH_SIZE)
+    ingredient_ids = list(Ingredient.objects.values_list('id', flat=True))
+    Recipe.objects.bulk_create([
+        Recipe(author_id=rnd.choice(user_ids), name=f'Рецепт {i}',
+               text='Описание рецепта. ' * 20, image='recipes/bench.png',
+               cooking_time=rnd.randint(5, 120))
+        for i in range(recipes)
+    ], batch_size=BATCH_SIZE)
+    recipe_ids = list(Recipe.objects.values_list('id', flat=True))
+
+    RecipeTag = Recipe.tags.through
+    RecipeTag.objects.bulk_create([
+        RecipeTag(recipe_id=recipe_id, tag_id=tag_id)
+        for recipe_id in recipe_ids
+        for tag_id in rnd.sample(tag_ids, min(2, len(tag_ids)))
+    ], batch_size=BATCH_SIZE)
+    RecipeIngredient.objects.bulk_create([
+        RecipeIngredient(recipe_id=recipe_id, ingredient_id=ingredient_id,
+                         amount=rnd.randint(1, 500))
+        for recipe_id in recipe_ids
+        for ingredient_id in rnd.sample(
+            ingredient_ids, min(ingredients_per_recipe, len(ingredient_ids))
+        )
+    ], batch_size=BATCH_SIZE)
+    for model, per_user in ((Favorite, favorites_per_user),
+                            (ShoppingList, carts_per_user)):
+        model.objects.bulk_create([
+            model(user_id=user_id, recipe_id=recipe_id)
+            for user_id in user_ids
+            for recipe_id in rnd.sample(recipe_ids,
+                                        min(per_user, len(recipe_ids)))
+        ], batch_size=BATCH_SIZE)
+    Follow.objects.bulk_create([
+        Follow(user_id=user_id, author_id=author_id)
+        for user_id in user_ids
+        for author_id in rnd.sample(user_ids,
+                                    min(follows_per_user, len(user_ids)))
+        if author_id != user_id
+    ], batch_size=BATCH_SIZE)
+    # bulk_create не отправляет сигналы, счётчики, поисковый вектор,
+    # рейтинги и суммы списков покупок считаем отдельно
+    recount_counters()
+    update_search_vector(Recipe.objects.all())
+    update_recipe_scores(full=True)
+    refresh_cart_totals(user_ids)
+    token, _ = Token.objects.get_or_create(user_id=user_ids[0])
+    return token.key
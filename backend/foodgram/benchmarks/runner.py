@@ -0,0 +1,81 @@
+import statistics
+import time
+import tracemalloc
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    index = round(percent / 100 * (len(values) - 1))
+    return values[index]
+
+
+def request(client, scenario):
+    response = getattr(client, scenario.method)(
+        scenario.url, scenario.data, format='json'
+    )
+    # Потоковые ответы нужно дочитать, иначе запрос к БД не выполнится
+    content = response.getvalue()
+    if response.status_code >= 400:
+        raise RuntimeError(
+            f'{scenario.name}: {response.status_code} {content!r}'
+        )
+    return content
+
+
+def measure(token, scenario, repeat=20, warmup=2):
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION=f'Token {token}')
+    for _ in range(warmup):
+        request(client, scenario)
+
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        request(client, scenario)
+        timings.append((time.perf_counter() - started) * 1000)
+
+    with CaptureQueriesContext(connection) as queries:
+        content = request(client, scenario)
+    # captured_queries читает connection.queries лениво, а следующий
+    # запрос очистит журнал, поэтому число запоминается сразу
+    query_count = len(queries.captured_queries)
+    response_bytes = len(content)
+
+    # Отдельный проход: tracemalloc заметно замедляет выполнение
+    tracemalloc.start()
+    request(client, scenario)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'p50_ms': round(percentile(timings, 50), 3),
+        'p95_ms': round(percentile(timings, 95), 3),
+        'mean_ms': round(statistics.mean(timings), 3),
+        'queries': query_count,
+        'peak_alloc_kb': round(peak / 1024, 1),
+        'response_bytes': response_bytes,
+    }
+
+
+def compare(baseline, current):
+    """Строки отчёта об изменениях относительно сохранённого baseline."""
+    lines = []
+    for name, result in current['results'].items():
+        old = baseline.get('results', {}).get(name)
+        if old is None:
+            lines.append(f'{name}: новый сценарий')
+            continue
+        changes = []
+        for key in ('p50_ms', 'p95_ms', 'queries', 'peak_alloc_kb'):
+            before, after = old.get(key), result[key]
+            if before in (None, 0) or before == after:
+                continue
+            changes.append(
+                f'{key} {before} -> {after} ({(after - before) / before:+.0%})'
+            )
+        lines.append(f'{name}: ' + ('; '.join(changes) or 'без изменений'))
+    return lines
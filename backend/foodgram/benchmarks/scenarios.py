@@ -0,0 +1,90 @@
+import base64
+from itertools import combinations
+
+from recipes.models import Ingredient, Recipe, Tag
+from users.models import User
+
+# Картинка 1x1 PNG для создания и обновления рецептов
+IMAGE = 'data:image/png;base64,' + base64.b64encode(
+    bytes.fromhex(
+        '89504e470d0a1a0a0000000d4948445200000001000000010806000000'
+        '1f15c4890000000d49444154789c6360606060000000050001a5f64540'
+        '0000000049454e44ae426082'
+    )
+).decode()
+
+
+class Scenario:
+    def __init__(self, name, method, url, data=None):
+        self.name = name
+        self.method = method
+        self.url = url
+        self.data = data
+
+
+def recipe_payload(ingredient_ids, tag_ids, name):
+    return {
+        'name': name,
+        'text': 'Описание рецепта для замеров',
+        'cooking_time': 30,
+        'image': IMAGE,
+        'tags': tag_ids[:2],
+        'ingredients': [
+            {'id': ingredient_id, 'amount': 100}
+            for ingredient_id in ingredient_ids
+        ],
+    }
+
+
+def build_scenarios(user):
+    recipe = Recipe.objects.filter(author=user).first()
+    if recipe is None:
+        recipe = Recipe.objects.first()
+        recipe.author = user
+        recipe.save()
+    author = User.objects.exclude(id=user.id).first()
+    tag_ids = list(Tag.objects.values_list('id', flat=True))
+    ingredient_ids = list(
+        Ingredient.objects.values_list('id', flat=True)[:10]
+    )
+    pantry = '&'.join(
+        f'ingredients={ingredient_id}' for ingredient_id in
+        Ingredient.objects.values_list('id', flat=True)[:30]
+    )
+    filters = {
+        'author': f'author={author.id}',
+        'tags': f'tags={tag_ids[0]}',
+        'is_favorited': 'is_favorited=1',
+        'is_in_shopping_cart': 'is_in_shopping_cart=1',
+    }
+    scenarios = []
+    for size in range(len(filters) + 1):
+        for names in combinations(filters, size):
+            query = '&'.join(filters[name] for name in names)
+            scenarios.append(Scenario(
+                'recipes:list' + ''.join(f'+{name}' for name in names),
+                'get', f'/api/recipes/?{query}'
+            ))
+    scenarios += [
+        Scenario('recipes:list:cursor', 'get', '/api/recipes/?cursor='),
+        Scenario('recipes:detail', 'get', f'/api/recipes/{recipe.id}/'),
+        Scenario('recipes:cookable', 'get',
+                 f'/api/recipes/cookable/?{pantry}'),
+        Scenario('recipes:cookable:missing', 'get',
+                 f'/api/recipes/cookable/?{pantry}&missing=3'),
+        Scenario('recipes:create', 'post', '/api/recipes/',
+                 recipe_payload(ingredient_ids, tag_ids, 'Новый рецепт')),
+        Scenario('recipes:update', 'patch', f'/api/recipes/{recipe.id}/',
+                 recipe_payload(ingredient_ids[::-1], tag_ids,
+                                'Изменённый рецепт')),
+        Scenario('users:subscriptions', 'get',
+                 '/api/users/subscriptions/?recipes_limit=3'),
+        Scenario('ingredients:search:prefix', 'get',
+                 '/api/ingredients/?name=ин'),
+        Scenario('ingredients:search:contains', 'get',
+                 '/api/ingredients/?name=ент 1'),
+        Scenario('tags:list', 'get', '/api/tags/'),
+        Scenario('shopping_cart:download', 'get',
+                 '/api/recipes/download_shopping_cart/'),
+    ]
+    return scenarios
@@ -12,4 +12,7 @@ from django.core.asgi import get_asgi_application
 
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'foodgram.settings')
+# Под ASGI каждый запрос может идти в своём потоке, постоянные
+# соединения там не закрываются: Django требует CONN_MAX_AGE = 0
+os.environ['DB_CONN_MAX_AGE'] = '0'
 application = get_asgi_application()
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 import os
 from pathlib import Path
+from django.core.exceptions import ImproperlyConfigured
 from dotenv import load_dotenv
 
 
@@ -50,6 +51,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.profiling.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -90,10 +92,46 @@ DATABASES = {
         'USER': os.getenv('POSTGRES_USER', 'postgres'),
         'PASSWORD': os.getenv('POSTGRES_PASSWORD', 'password'),
         'HOST': os.getenv('DB_HOST', 'db'),
-        'PORT': os.getenv('DB_PORT', '5432')
+        'PORT': os.getenv('DB_PORT', '5432'),
+        # Соединение живёт между запросами воркера, перед повторным
+        # использованием проверяется; 0 - новое соединение на запрос.
+        # foodgram.asgi всегда ставит 0
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': (
+            os.getenv('DB_CONN_HEALTH_CHECKS', 'True') == 'True'
+        ),
     }
 }
 
+# Реплики для чтения через запятую: хосты PostgreSQL или, на SQLite,
+# пути к файлам баз. Получают алиасы replica_1, replica_2, ...
+# и используются api.replicas.ReplicaRouter.
+for number, replica in enumerate(
+    filter(None, os.getenv('DB_REPLICAS', '').split(',')), start=1
+):
+    replica_key = (
+        'NAME' if DATABASES['default']['ENGINE'].endswith('sqlite3')
+        else 'HOST'
+    )
+    DATABASES[f'replica_{number}'] = {
+        **DATABASES['default'],
+        replica_key: replica.strip(),
+        # В тестах реплика - то же соединение, что и основная база
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['api.replicas.ReplicaRouter']
+
+# Модели, которые всегда читаются с основной базы: пользователь должен
+# сразу видеть свои изменения, а от токена зависит вход. Подзапросы
+# к ним из запросов других моделей - см. ReplicaReadMixin.user_actions
+REPLICA_EXCLUDED_MODELS = {
+    'authtoken.token',
+    'recipes.favorite',
+    'recipes.shoppinglist',
+    'users.follow',
+}
+
 # DATABASES = {
 #     'default': {
 #         'ENGINE': os.getenv('DB_ENGINE', 'django.db.backends.postgresql'),
@@ -148,6 +186,22 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+STORAGES = {
+    'default': {
+        'BACKEND': 'recipes.storage.DeduplicatingStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+}
+
+# Максимальный размер загружаемого изображения, в байтах
+IMAGE_MAX_UPLOAD_SIZE = int(
+    os.getenv('IMAGE_MAX_UPLOAD_SIZE', 5 * 1024 * 1024)
+)
+# Потоков для создания миниатюр изображений
+IMAGE_RENDITION_WORKERS = int(os.getenv('IMAGE_RENDITION_WORKERS', 2))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
@@ -168,6 +222,83 @@ REST_FRAMEWORK = {
 
 EMPTY_VALUE = 'ПУСТО'
 
+# По умолчанию кэш в памяти процесса - для разработки с одним
+# процессом. В продакшене - общий Redis-совместимый кэш:
+# CACHE_BACKEND=django.core.cache.backends.redis.RedisCache
+# CACHE_LOCATION=redis://redis:6379/1
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'foodgram'),
+    }
+}
+
+# В кэше процесса версии (recipes.cache) меняются только в том
+# воркере, где произошла запись, остальные отдают устаревшие ответы.
+# gunicorn и uvicorn берут число воркеров из WEB_CONCURRENCY.
+LOCAL_CACHE = CACHES['default']['BACKEND'].endswith('.LocMemCache')
+if LOCAL_CACHE and int(os.getenv('WEB_CONCURRENCY', 1)) > 1:
+    raise ImproperlyConfigured(
+        'Кэш в памяти процесса нельзя использовать с несколькими '
+        'воркерами: задайте общий кэш в CACHE_BACKEND и CACHE_LOCATION'
+    )
+# Без общего кэша записи и версии живут секунды: так ограничено
+# отставание воркеров, запущенных с --workers в обход WEB_CONCURRENCY
+LOCAL_CACHE_TIMEOUT = 10
+
+# Время жизни версий recipes.cache, в секундах; None - бессрочно
+CACHE_VERSION_TIMEOUT = LOCAL_CACHE_TIMEOUT if LOCAL_CACHE else None
+# Время жизни закэшированных ответов справочников, в секундах
+CATALOGUE_CACHE_TIMEOUT = int(os.getenv(
+    'CATALOGUE_CACHE_TIMEOUT', LOCAL_CACHE_TIMEOUT if LOCAL_CACHE else 300
+))
+# Время жизни закэшированных карточек рецептов, в секундах
+RECIPE_CACHE_TIMEOUT = int(os.getenv(
+    'RECIPE_CACHE_TIMEOUT', LOCAL_CACHE_TIMEOUT if LOCAL_CACHE else 3600
+))
+# Время жизни наборов избранного, покупок и подписок пользователя
+# (api.memberships), 0 - загружать в каждом запросе
+MEMBERSHIPS_CACHE_TIMEOUT = int(os.getenv(
+    'MEMBERSHIPS_CACHE_TIMEOUT', LOCAL_CACHE_TIMEOUT if LOCAL_CACHE else 300
+))
+
+# max-age ответов API анонимным пользователям (api.cache.ConditionalGetMixin),
+# в секундах; в пределах этого времени их отдаёт кэш nginx
+HTTP_CACHE_MAX_AGE = int(os.getenv('HTTP_CACHE_MAX_AGE', 60))
+
+# Конфигурация полнотекстового поиска PostgreSQL (recipes.search)
+SEARCH_CONFIG = os.getenv('SEARCH_CONFIG', 'russian')
+
+# Профилирование запросов (api.profiling.ProfilingMiddleware):
+# доля профилируемых запросов от 0 до 1
+PROFILING_SAMPLE_RATE = float(os.getenv('PROFILING_SAMPLE_RATE', 0.01))
+# порог медленного запроса к API и к БД, в миллисекундах
+PROFILING_SLOW_REQUEST_MS = int(os.getenv('PROFILING_SLOW_REQUEST_MS', 500))
+PROFILING_SLOW_QUERY_MS = int(os.getenv('PROFILING_SLOW_QUERY_MS', 100))
+# столько одинаковых SQL за запрос считаются признаком N+1
+PROFILING_DUPLICATE_QUERIES = int(
+    os.getenv('PROFILING_DUPLICATE_QUERIES', 5)
+)
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'foodgram.profiling': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
+    },
+}
+
 DJOSER = {
     'LOGIN_FIELD': 'email',
     'HIDE_USERS': False,
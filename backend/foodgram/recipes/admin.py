@@ -1,7 +1,9 @@
 from django.contrib import admin
 from django.conf import settings
+from recipes.carts import amount_deltas, recipe_amounts
 from recipes.models import (Ingredient, Tag, Recipe,
                             RecipeIngredient, Favorite, ShoppingList)
+from recipes.signals import ingredients_changed
 
 
 @admin.register(Ingredient)
@@ -28,7 +30,8 @@ class TagAdmin(admin.ModelAdmin):
 
 @admin.register(Recipe)
 class RecipeAdmin(admin.ModelAdmin):
-    list_display = ('pk', 'name', 'author', 'favorites_count')
+    list_display = ('pk', 'name', 'author', 'favorites_count',
+                    'in_carts_count')
     search_fields = ('name', 'author')
     list_filter = ('name', 'author', 'tags')
     empty_value_display = settings.EMPTY_VALUE
@@ -36,8 +39,15 @@ class RecipeAdmin(admin.ModelAdmin):
         RecipeIngredientInline,
     ]
 
-    def favorites_count(self, obj):
-        return obj.favorites.count()
+    def save_related(self, request, form, formsets, change):
+        recipe_ids = [form.instance.pk]
+        before = recipe_amounts(recipe_ids)
+        super().save_related(request, form, formsets, change)
+        # Инлайн сохраняет ингредиенты по одному, пересчёт - один раз
+        ingredients_changed.send(
+            sender=RecipeIngredient, recipe_ids=recipe_ids,
+            amount_deltas=amount_deltas(before, recipe_amounts(recipe_ids))
+        )
 
 
 @admin.register(RecipeIngredient)
@@ -45,6 +55,37 @@ class RecipeIngredientAdmin(admin.ModelAdmin):
     list_display = ('pk', 'recipe', 'ingredient', 'amount')
     empty_value_display = settings.EMPTY_VALUE
 
+    def save_model(self, request, obj, form, change):
+        # Строку могли перенести в другой рецепт
+        recipe_ids = list({obj.recipe_id, form.initial.get('recipe')} - {None})
+        before = recipe_amounts(recipe_ids)
+        super().save_model(request, obj, form, change)
+        ingredients_changed.send(
+            sender=RecipeIngredient, recipe_ids=recipe_ids,
+            amount_deltas=amount_deltas(before, recipe_amounts(recipe_ids))
+        )
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        ingredients_changed.send(
+            sender=RecipeIngredient, recipe_ids=[obj.recipe_id],
+            amount_deltas={(obj.recipe_id, obj.ingredient_id): -obj.amount}
+        )
+
+    def delete_queryset(self, request, queryset):
+        deltas = {
+            (recipe_id, ingredient_id): -amount
+            for recipe_id, ingredient_id, amount in queryset.values_list(
+                'recipe_id', 'ingredient_id', 'amount'
+            )
+        }
+        super().delete_queryset(request, queryset)
+        ingredients_changed.send(
+            sender=RecipeIngredient,
+            recipe_ids=list({recipe_id for recipe_id, _ in deltas}),
+            amount_deltas=deltas
+        )
+
 
 @admin.register(Favorite)
 class FavoriteAdmin(admin.ModelAdmin):
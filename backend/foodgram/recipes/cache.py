@@ -0,0 +1,91 @@
+import time
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+CATALOGUE = 'catalogue'
+RECIPE_DETAIL = 'recipe_detail'
+
+
+def _version_key(name):
+    return f'version:{name}'
+
+
+def get_version(name):
+    """Текущая версия набора данных, входит в ключи кэша."""
+    return get_versions([name])[0]
+
+
+def get_versions(names):
+    """Версии нескольких наборов данных одним обращением к кэшу."""
+    keys = [_version_key(name) for name in names]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # Версия из времени не совпадёт с ранее выданными,
+            # даже если счётчик вытеснили из кэша
+            cache.add(key, time.time_ns(),
+                      timeout=settings.CACHE_VERSION_TIMEOUT)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def bump_version(name):
+    """Делает недействительными все записи кэша для набора данных."""
+    key = _version_key(name)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        version = time.time_ns()
+        cache.set(key, version, timeout=settings.CACHE_VERSION_TIMEOUT)
+        return version
+
+
+def bump_version_on_commit(name):
+    """bump_version после фиксации текущей транзакции.
+
+    До фиксации читатели видят старые строки и закэшировали бы их
+    под уже новой версией.
+    """
+    transaction.on_commit(partial(bump_version, name))
+
+
+def recipe_version(recipe_id):
+    return f'recipe:{recipe_id}'
+
+
+def user_version(user_id):
+    return f'user:{user_id}'
+
+
+def membership_version(user_id):
+    return f'memberships:{user_id}'
+
+
+def _stats_key(name, outcome):
+    return f'stats:{name}:{outcome}'
+
+
+def record_lookup(name, hit):
+    """Счётчик попаданий и промахов кэша, общий для всех воркеров
+    при кэше в Redis."""
+    key = _stats_key(name, 'hits' if hit else 'misses')
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, timeout=None):
+            cache.incr(key)
+
+
+def get_stats(name):
+    hits, misses = (_stats_key(name, outcome)
+                    for outcome in ('hits', 'misses'))
+    values = cache.get_many([hits, misses])
+    return {'hits': values.get(hits, 0), 'misses': values.get(misses, 0)}
+
+
+def reset_stats(name):
+    cache.delete_many([_stats_key(name, 'hits'),
+                       _stats_key(name, 'misses')])
@@ -0,0 +1,188 @@
+"""Суммы ингредиентов в списках покупок (ShoppingCartTotal).
+
+При добавлении или удалении рецепта его ингредиенты в списке одного
+пользователя пересчитываются по текущему содержимому списка, поэтому
+результат не зависит от порядка сигналов при каскадном удалении.
+При изменении состава рецепта к суммам всех списков, где он лежит,
+прибавляется разница количеств (apply_cart_deltas); списки
+пересчитываются целиком, только если разница неизвестна
+(см. recipes.signals).
+"""
+from collections import defaultdict
+from itertools import groupby
+from operator import itemgetter
+
+from django.db import connections, router, transaction
+from django.db.models import Case, F, Sum, Value, When
+from django.db.models.functions import Greatest
+from recipes.models import (Ingredient, RecipeIngredient, ShoppingCartTotal,
+                            ShoppingList)
+
+
+def recipes_ingredients(recipe_ids):
+    return RecipeIngredient.objects.filter(
+        recipe_id__in=recipe_ids
+    ).values('ingredient_id')
+
+
+def cart_totals(user_ids=None):
+    """Суммы, посчитанные по спискам покупок:
+    (пользователь, ингредиент, сумма)."""
+    # Одно условие на один JOIN со списками покупок
+    if user_ids is None:
+        lookup = {'recipe__shopping_lists__isnull': False}
+    else:
+        lookup = {'recipe__shopping_lists__user_id__in': user_ids}
+    return RecipeIngredient.objects.filter(**lookup).values_list(
+        'recipe__shopping_lists__user_id', 'ingredient_id'
+    ).annotate(total=Sum('amount')).order_by()
+
+
+def refresh_cart_totals(user_ids, recipe_ids=None):
+    """Пересчитывает суммы в списках покупок пользователей.
+
+    С recipe_ids - только по ингредиентам этих рецептов.
+    """
+    user_ids = list(user_ids)
+    if not user_ids:
+        return
+    stale = ShoppingCartTotal.objects.filter(user_id__in=user_ids)
+    sources = cart_totals(user_ids)
+    if recipe_ids is not None:
+        ingredients = recipes_ingredients(recipe_ids)
+        stale = stale.filter(ingredient_id__in=ingredients)
+        sources = sources.filter(ingredient_id__in=ingredients)
+    totals = [
+        ShoppingCartTotal(user_id=user_id, ingredient_id=ingredient_id,
+                          amount=amount)
+        for user_id, ingredient_id, amount in sources
+    ]
+    with transaction.atomic():
+        stale.delete()
+        # Параллельный пересчёт того же списка мог успеть вставить
+        # строки: побеждает последний
+        ShoppingCartTotal.objects.bulk_create(
+            totals,
+            update_conflicts=True,
+            unique_fields=['user', 'ingredient'],
+            update_fields=['amount']
+        )
+
+
+def recipe_amounts(recipe_ids):
+    """Состав рецептов: {(рецепт, ингредиент): количество}."""
+    return {
+        (recipe_id, ingredient_id): amount
+        for recipe_id, ingredient_id, amount in
+        RecipeIngredient.objects.filter(recipe_id__in=recipe_ids).values_list(
+            'recipe_id', 'ingredient_id', 'amount'
+        )
+    }
+
+
+def amount_deltas(before, after):
+    """Разница двух снимков recipe_amounts для apply_cart_deltas."""
+    return {
+        key: after.get(key, 0) - before.get(key, 0)
+        for key in before.keys() | after.keys()
+        if after.get(key, 0) != before.get(key, 0)
+    }
+
+
+def insert_missing_totals(recipe_id, ingredient_ids):
+    """Нулевые суммы ингредиентов в списках покупок с рецептом,
+    где их ещё нет: один INSERT ... SELECT ... ON CONFLICT DO NOTHING."""
+    connection = connections[router.db_for_write(ShoppingCartTotal)]
+    qn = connection.ops.quote_name
+    totals, lists = ShoppingCartTotal._meta, ShoppingList._meta
+    ingredients = Ingredient._meta
+    columns = ', '.join(qn(totals.get_field(name).column)
+                        for name in ('user', 'ingredient', 'amount'))
+    lists_table, ingredients_table = (qn(lists.db_table),
+                                      qn(ingredients.db_table))
+    user = f'{lists_table}.{qn(lists.get_field("user").column)}'
+    recipe = f'{lists_table}.{qn(lists.get_field("recipe").column)}'
+    ingredient = f'{ingredients_table}.{qn(ingredients.pk.column)}'
+    ids = ', '.join(['%s'] * len(ingredient_ids))
+    sql = (
+        f'INSERT INTO {qn(totals.db_table)} ({columns}) '
+        f'SELECT {user}, {ingredient}, 0 '
+        f'FROM {lists_table}, {ingredients_table} '
+        f'WHERE {recipe} = %s AND {ingredient} IN ({ids}) '
+        f'ON CONFLICT DO NOTHING'
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [recipe_id, *ingredient_ids])
+
+
+def apply_recipe_deltas(recipe_id, deltas):
+    totals = ShoppingCartTotal.objects.filter(
+        user_id__in=ShoppingList.objects.filter(
+            recipe_id=recipe_id
+        ).values('user_id'),
+        ingredient_id__in=deltas
+    )
+    added = [pk for pk, delta in deltas.items() if delta > 0]
+    if added:
+        insert_missing_totals(recipe_id, added)
+    totals.update(amount=Greatest(
+        F('amount') + Case(
+            *(When(ingredient_id=pk, then=Value(delta))
+              for pk, delta in deltas.items()),
+            default=Value(0)
+        ),
+        Value(0)
+    ))
+    if len(added) < len(deltas):
+        totals.filter(amount=0).delete()
+
+
+def apply_cart_deltas(deltas):
+    """Прибавляет изменения количеств в рецептах к суммам списков
+    покупок, в которых лежат эти рецепты.
+
+    deltas - {(рецепт, ингредиент): изменение количества}. На рецепт
+    уходит не больше трёх запросов при любом числе пользователей:
+    вставка недостающих строк, UPDATE с CASE по ингредиентам
+    и удаление обнулившихся сумм.
+    """
+    by_recipe = defaultdict(dict)
+    for (recipe_id, ingredient_id), delta in deltas.items():
+        if delta:
+            by_recipe[recipe_id][ingredient_id] = delta
+    with transaction.atomic():
+        for recipe_id, recipe_deltas in by_recipe.items():
+            apply_recipe_deltas(recipe_id, recipe_deltas)
+
+
+def by_user(rows):
+    for user_id, items in groupby(rows, key=itemgetter(0)):
+        yield user_id, {ingredient: amount for _, ingredient, amount in items}
+
+
+def mismatched_cart_users():
+    """id пользователей, у которых сохранённые суммы расходятся
+    с посчитанными по спискам покупок.
+
+    Обе выборки идут потоком, отсортированными по пользователю.
+    """
+    expected = by_user(cart_totals().order_by(
+        'recipe__shopping_lists__user_id', 'ingredient_id'
+    ).iterator())
+    actual = by_user(ShoppingCartTotal.objects.values_list(
+        'user_id', 'ingredient_id', 'amount'
+    ).order_by('user_id', 'ingredient_id').iterator())
+    mismatched = []
+    want, have = next(expected, None), next(actual, None)
+    while want is not None or have is not None:
+        if have is None or (want is not None and want[0] < have[0]):
+            mismatched.append(want[0])
+            want = next(expected, None)
+        elif want is None or have[0] < want[0]:
+            mismatched.append(have[0])
+            have = next(actual, None)
+        else:
+            if want[1] != have[1]:
+                mismatched.append(want[0])
+            want, have = next(expected, None), next(actual, None)
+    return mismatched
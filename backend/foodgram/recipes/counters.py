@@ -0,0 +1,53 @@
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+from recipes.models import Favorite, Recipe, ShoppingList
+from users.models import Follow, User
+
+
+def change_counter(model, pk, field, delta):
+    """Атомарно меняет счётчик одним UPDATE без чтения строки."""
+    change_counters(model, [pk], field, delta)
+
+
+def change_counters(model, pks, field, delta):
+    """То же для нескольких строк: UPDATE ... WHERE pk IN (...)."""
+    value = F(field) + delta
+    if delta < 0:
+        value = Greatest(value, Value(0))
+    model.objects.filter(pk__in=pks).update(**{field: value})
+
+
+def count_subquery(model, fk):
+    return Coalesce(
+        Subquery(
+            model.objects.filter(
+                **{fk: OuterRef('pk')}
+            ).order_by().values(fk).annotate(
+                total=Count('pk')
+            ).values('total')
+        ),
+        Value(0)
+    )
+
+
+# (модель со счётчиком, поле счётчика, модель-источник, FK на владельца)
+COUNTERS = (
+    (Recipe, 'favorites_count', Favorite, 'recipe'),
+    (Recipe, 'in_carts_count', ShoppingList, 'recipe'),
+    (User, 'recipes_count', Recipe, 'author'),
+    (User, 'followers_count', Follow, 'author'),
+)
+
+
+def recount_counters():
+    """Пересчитывает все счётчики, обновляя только расходящиеся строки.
+
+    Возвращает словарь {'Модель.поле': число исправленных строк}.
+    """
+    fixed = {}
+    for model, field, source, fk in COUNTERS:
+        actual = count_subquery(source, fk)
+        fixed[f'{model.__name__}.{field}'] = model.objects.exclude(
+            **{field: actual}
+        ).update(**{field: actual})
+    return fixed
@@ -0,0 +1,171 @@
+import base64
+import binascii
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from pathlib import PurePosixPath
+from tempfile import SpooledTemporaryFile
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.utils import timezone
+from PIL import Image, ImageOps, UnidentifiedImageError
+from recipes.models import Recipe
+
+logger = logging.getLogger(__name__)
+
+# Формат Pillow -> расширение сохраняемого файла
+ALLOWED_FORMATS = {
+    'JPEG': 'jpg',
+    'PNG': 'png',
+    'WEBP': 'webp',
+}
+# Название рендеринга -> максимальная сторона в пикселях
+RENDITIONS = {
+    'list': 240,
+    'card': 480,
+    'detail': 960,
+}
+RENDITIONS_DIR = 'recipes/renditions'
+# Качество пересохранения загруженных JPEG и WebP, PNG сжимается без потерь
+ORIGINAL_QUALITY = 90
+# Кратно 4, чтобы каждый кусок base64 декодировался независимо
+DECODE_CHUNK = 64 * 1024
+SPOOL_SIZE = 1024 * 1024
+
+_executor = None
+
+
+class ImageError(ValueError):
+    pass
+
+
+def decode_base64(data, max_size):
+    """Декодирует base64 кусками, не держа в памяти вторую копию.
+
+    Превышение лимита видно по длине строки ещё до декодирования.
+    """
+    if any(char in data[:DECODE_CHUNK] for char in ' \r\n'):
+        data = ''.join(data.split())
+    if len(data) * 3 // 4 > max_size + 2:
+        raise ImageError(
+            f'Размер изображения больше {max_size // 1024} КБ'
+        )
+    output = SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    try:
+        for start in range(0, len(data), DECODE_CHUNK):
+            output.write(base64.b64decode(
+                data[start:start + DECODE_CHUNK], validate=True
+            ))
+    except (binascii.Error, ValueError):
+        output.close()
+        raise ImageError('Некорректные данные base64')
+    output.seek(0)
+    return output
+
+
+def normalize_image(source):
+    """Проверяет формат и пересохраняет изображение без метаданных.
+
+    Возвращает ContentFile с именем из хэша содержимого.
+    """
+    try:
+        with Image.open(source) as image:
+            image.verify()
+        source.seek(0)
+        with Image.open(source) as image:
+            image_format = image.format
+            if image_format not in ALLOWED_FORMATS:
+                raise ImageError('Допустимы изображения JPEG, PNG и WebP')
+            # Поворот из EXIF применяем до того, как EXIF будет удалён
+            image = ImageOps.exif_transpose(image)
+            buffer = BytesIO()
+            # Без явных exif и icc_profile Pillow переносит их из
+            # исходного файла
+            image.save(buffer, format=image_format, exif=b'',
+                       icc_profile=None, quality=ORIGINAL_QUALITY)
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError):
+        raise ImageError('Файл не является изображением')
+    finally:
+        source.close()
+    content = buffer.getvalue()
+    name = hashlib.sha256(content).hexdigest()[:32]
+    return ContentFile(content, name=f'{name}.{ALLOWED_FORMATS[image_format]}')
+
+
+def rendition_name(image_name, rendition):
+    stem = PurePosixPath(image_name).stem
+    return f'{RENDITIONS_DIR}/{stem}_{rendition}.webp'
+
+
+def generate_renditions(image_name):
+    """Создаёт недостающие WebP-миниатюры для сохранённого изображения."""
+    missing = {
+        rendition: size for rendition, size in RENDITIONS.items()
+        if not default_storage.exists(rendition_name(image_name, rendition))
+    }
+    if not missing:
+        return
+    with default_storage.open(image_name) as source:
+        with Image.open(source) as original:
+            original.load()
+    if original.mode not in ('RGB', 'RGBA'):
+        original = original.convert('RGBA')
+    for rendition, size in missing.items():
+        image = original.copy()
+        image.thumbnail((size, size))
+        buffer = BytesIO()
+        image.save(buffer, format='WEBP', quality=80, method=4)
+        default_storage.save(
+            rendition_name(image_name, rendition),
+            ContentFile(buffer.getvalue())
+        )
+
+
+def create_recipe_renditions(image_name):
+    """Создаёт миниатюры и отмечает их у рецептов с этим изображением.
+
+    Дата изменения сдвигается вместе с отметкой: ссылки в ответе
+    поменялись, и ETag рецепта должен смениться тоже.
+    """
+    generate_renditions(image_name)
+    return Recipe.objects.filter(image=image_name).exclude(
+        rendered_image=image_name
+    ).update(rendered_image=image_name, updated_at=timezone.now())
+
+
+def _generate_logged(image_name):
+    try:
+        create_recipe_renditions(image_name)
+    except Exception:
+        logger.exception('Не удалось создать миниатюры для %s', image_name)
+
+
+def schedule_renditions(image_name):
+    """Отправляет создание миниатюр в пул потоков, не занимая воркер."""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.IMAGE_RENDITION_WORKERS,
+            thread_name_prefix='renditions'
+        )
+    return _executor.submit(_generate_logged, image_name)
+
+
+def rendition_urls(image, rendered_image):
+    """URL миниатюр без обращений к хранилищу.
+
+    rendered_image - имя изображения, для которого миниатюры уже
+    созданы (Recipe.rendered_image). Если это не текущее изображение,
+    все ссылки ведут на оригинал.
+    """
+    if not image:
+        return None
+    if image.name != rendered_image:
+        return dict.fromkeys(RENDITIONS, image.url)
+    return {
+        rendition: default_storage.url(rendition_name(image.name, rendition))
+        for rendition in RENDITIONS
+    }
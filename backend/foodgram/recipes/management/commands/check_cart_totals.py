@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+from recipes.carts import mismatched_cart_users, refresh_cart_totals
+
+
+class Command(BaseCommand):
+    help = ('Проверка сумм списков покупок (ShoppingCartTotal) '
+            'по содержимому списков.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--fix',
+            action='store_true',
+            help='Пересчитать списки с расхождениями'
+        )
+
+    def handle(self, *args, **options):
+        user_ids = mismatched_cart_users()
+        if not user_ids:
+            self.stdout.write(self.style.SUCCESS('Расхождений нет'))
+            return
+        self.stdout.write(
+            f'Расхождения в списках покупок пользователей: {len(user_ids)}'
+        )
+        if not options['fix']:
+            raise CommandError('Запустите с --fix, чтобы пересчитать их')
+        refresh_cart_totals(user_ids)
+        self.stdout.write(self.style.SUCCESS('Списки пересчитаны'))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from recipes.images import create_recipe_renditions
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = ('Создание недостающих миниатюр для изображений рецептов '
+            'и отметка о них в рецептах.')
+
+    def handle(self, *args, **options):
+        names = Recipe.objects.exclude(image='').values_list(
+            'image', flat=True
+        ).distinct()
+        failed = 0
+        for name in names.iterator():
+            try:
+                create_recipe_renditions(name)
+            except OSError as error:
+                failed += 1
+                self.stderr.write(f'{name}: {error}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Миниатюры созданы, ошибок: {failed}'
+        ))
@@ -1,33 +1,197 @@
 import csv
-from django.core.management.base import BaseCommand
-from django.apps import apps
-from django.shortcuts import get_object_or_404
+import io
+import json
+import re
+import time
+from pathlib import Path
 
-MODELS_FIELDS = {}
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from recipes.cache import CATALOGUE, bump_version
+from recipes.models import Ingredient
+
+DEFAULT_PATH = settings.BASE_DIR.parent.parent / 'data' / 'ingredients.csv'
+BATCH_SIZE = 1000
+# Размер куска, которым читается JSON
+JSON_CHUNK_SIZE = 64 * 1024
+# Пробелы и разделители массива между элементами JSON
+JSON_SEPARATORS = re.compile(r'[\s\[,\]]*')
+
+
+def read_csv(path):
+    with open(path, 'rt', encoding='utf-8', newline='') as csv_file:
+        for row in csv.DictReader(csv_file, delimiter=','):
+            yield row['name'], row['measurement_unit']
+
+
+def iter_json_array(json_file, chunk_size=JSON_CHUNK_SIZE):
+    """Элементы JSON-массива объектов по одному, файл читается кусками."""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    eof = False
+    while not eof:
+        chunk = json_file.read(chunk_size)
+        eof = not chunk
+        buffer += chunk
+        position = 0
+        while True:
+            position = JSON_SEPARATORS.match(buffer, position).end()
+            if position == len(buffer):
+                break
+            try:
+                item, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                # Элемент обрезан границей куска
+                if eof:
+                    raise
+                break
+            yield item
+        buffer = buffer[position:]
+
+
+def read_json(path):
+    with open(path, 'rt', encoding='utf-8') as json_file:
+        for row in iter_json_array(json_file):
+            yield row['name'], row['measurement_unit']
+
+
+READERS = {
+    '.csv': read_csv,
+    '.json': read_json,
+}
+
+
+def unique_rows(rows):
+    """Убирает дубли по паре (name, measurement_unit) ещё до записи в БД."""
+    seen = set()
+    for name, measurement_unit in rows:
+        key = (name.strip(), measurement_unit.strip())
+        if key in seen:
+            continue
+        seen.add(key)
+        yield key
+
+
+class CsvStream:
+    """Файловый объект для COPY: строки CSV формируются по мере чтения,
+    а не собираются в памяти целиком."""
+
+    def __init__(self, rows):
+        self.rows = iter(rows)
+        self.buffer = io.StringIO()
+        self.writer = csv.writer(self.buffer)
+        self.total = 0
+
+    def read(self, size=-1):
+        while size < 0 or self.buffer.tell() < size:
+            row = next(self.rows, None)
+            if row is None:
+                break
+            self.writer.writerow(row)
+            self.total += 1
+        data = self.buffer.getvalue()
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        return data
 
 
 class Command(BaseCommand):
-    help = 'Загрузка данных из CSV.'
+    help = 'Загрузка ингредиентов из CSV или JSON.'
 
     def add_arguments(self, parser):
-        parser.add_argument('--path', type=str, help="file path")
-        parser.add_argument('--model_name', type=str, help="model name")
         parser.add_argument(
-            '--app_name',
+            '--path',
             type=str,
-            help="Django app name that the model is connected to"
+            default=str(DEFAULT_PATH),
+            help='Путь к файлу ingredients.csv или ingredients.json'
         )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=BATCH_SIZE,
+            help='Размер пачки для bulk_create'
+        )
+        parser.add_argument(
+            '--copy',
+            action='store_true',
+            help='Загрузка через COPY (только PostgreSQL)'
+        )
+
+    def handle(self, *args, **options):
+        path = Path(options['path'])
+        if not path.is_file():
+            raise CommandError(f'Файл {path} не найден')
+        reader = READERS.get(path.suffix.lower())
+        if reader is None:
+            raise CommandError('Поддерживаются только файлы .csv и .json')
+        rows = unique_rows(reader(path))
+        self.started = time.monotonic()
+        with transaction.atomic():
+            # Повторяющиеся строки пропускаются ON CONFLICT DO NOTHING,
+            # поэтому добавленные считаются по числу строк в таблице
+            existing = Ingredient.objects.count()
+            if options['copy'] and connection.vendor == 'postgresql':
+                total = self.copy_rows(rows)
+            else:
+                if options['copy']:
+                    self.stdout.write(self.style.WARNING(
+                        'COPY доступен только для PostgreSQL, '
+                        'используется bulk_create'
+                    ))
+                total = self.bulk_create_rows(rows, options['batch_size'])
+            inserted = Ingredient.objects.count() - existing
+        # bulk_create и COPY не отправляют сигналы post_save
+        bump_version(CATALOGUE)
+        self.stdout.write(self.style.SUCCESS(
+            f'Данные загружены: добавлено {inserted}, '
+            f'обработано {self.progress(total)}'
+        ))
+
+    def progress(self, total):
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        return (f'{total} строк за {elapsed:.2f} с '
+                f'({total / elapsed:.0f} строк/с)')
+
+    def bulk_create_rows(self, rows, batch_size):
+        total = 0
+        batch = []
+        for name, measurement_unit in rows:
+            batch.append(
+                Ingredient(name=name, measurement_unit=measurement_unit)
+            )
+            if len(batch) >= batch_size:
+                total = self.flush(batch, total)
+                batch = []
+        if batch:
+            total = self.flush(batch, total)
+        return total
+
+    def flush(self, batch, total):
+        Ingredient.objects.bulk_create(batch, ignore_conflicts=True)
+        total += len(batch)
+        self.stdout.write(f'... {self.progress(total)}')
+        return total
 
-    def process(self, *args, **options):
-        file_path = options['path']
-        model = apps.get_model(options['app_name'], options['model_name'])
-        with open(file_path, 'rt', encoding='utf-8') as csv_file:
-            reader = csv.DictReader(csv_file, delimiter=',')
-            for row in reader:
-                for field, value in row.items():
-                    if field in MODELS_FIELDS.keys():
-                        row[field] = get_object_or_404(
-                            MODELS_FIELDS[field], pk=value
-                        )
-                model.objects.create(**row)
-        self.stdout.write(self.style.SUCCESS('Data imported successfully'))
+    def copy_rows(self, rows):
+        # COPY во временную таблицу, затем один INSERT ... ON CONFLICT,
+        # чтобы повторный импорт не падал на уже загруженных строках
+        stream = CsvStream(rows)
+        table = Ingredient._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'CREATE TEMP TABLE ingredients_import '
+                '(name varchar(100), measurement_unit varchar(100)) '
+                'ON COMMIT DROP'
+            )
+            cursor.copy_expert(
+                'COPY ingredients_import (name, measurement_unit) '
+                'FROM STDIN WITH (FORMAT csv)',
+                stream
+            )
+            cursor.execute(
+                f'INSERT INTO {table} (name, measurement_unit) '
+                'SELECT name, measurement_unit FROM ingredients_import '
+                'ON CONFLICT DO NOTHING'
+            )
+        return stream.total
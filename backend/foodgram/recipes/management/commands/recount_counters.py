@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from recipes.counters import recount_counters
+
+
+class Command(BaseCommand):
+    help = 'Пересчёт денормализованных счётчиков рецептов и пользователей.'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            fixed = recount_counters()
+        for counter, rows in fixed.items():
+            self.stdout.write(f'{counter}: исправлено строк {rows}')
+        self.stdout.write(self.style.SUCCESS('Счётчики пересчитаны'))
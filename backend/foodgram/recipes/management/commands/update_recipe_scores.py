@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from recipes.scores import update_recipe_scores
+
+
+class Command(BaseCommand):
+    help = ('Пересчёт рейтингов популярности рецептов. Запускается '
+            'периодически (например, cron раз в 10 минут) и пересчитывает '
+            'только рецепты, затронутые с прошлого запуска.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help='Пересчитать рейтинги всех рецептов'
+        )
+
+    def handle(self, *args, **options):
+        updated = update_recipe_scores(full=options['full'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Пересчитано рейтингов: {updated}'
+        ))
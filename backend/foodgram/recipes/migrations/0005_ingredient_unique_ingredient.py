@@ -0,0 +1,60 @@
+# Generated by Django 4.2.3 on 2026-10-18 17:34
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def merge_ingredient(recipe_ingredients, kept, duplicate_ids):
+    for duplicate in recipe_ingredients.filter(
+        ingredient_id__in=duplicate_ids
+    ):
+        existing = recipe_ingredients.filter(
+            recipe_id=duplicate.recipe_id, ingredient_id=kept
+        ).first()
+        if existing is None:
+            duplicate.ingredient_id = kept
+            duplicate.save(update_fields=['ingredient'])
+        else:
+            # Единица измерения та же, количества складываются
+            existing.amount += duplicate.amount
+            existing.save(update_fields=['amount'])
+            duplicate.delete()
+
+
+def merge_duplicate_ingredients(apps, schema_editor):
+    # Дубликаты (name, measurement_unit) сливаются в ингредиент
+    # с наименьшим id, иначе ограничение не создастся
+    Ingredient = apps.get_model('recipes', 'Ingredient')
+    RecipeIngredient = apps.get_model('recipes', 'RecipeIngredient')
+    db_alias = schema_editor.connection.alias
+    ingredients = Ingredient.objects.using(db_alias)
+    groups = ingredients.values('name', 'measurement_unit').annotate(
+        kept=Min('id'), total=Count('id')
+    ).filter(total__gt=1).order_by()
+    for group in groups:
+        duplicate_ids = list(ingredients.filter(
+            name=group['name'], measurement_unit=group['measurement_unit']
+        ).exclude(pk=group['kept']).values_list('pk', flat=True))
+        merge_ingredient(RecipeIngredient.objects.using(db_alias),
+                         group['kept'], duplicate_ids)
+        ingredients.filter(pk__in=duplicate_ids).delete()
+    if schema_editor.connection.vendor == 'postgresql':
+        # Отложенные проверки внешних ключей не дают изменить таблицу
+        # в той же транзакции
+        schema_editor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0004_alter_recipe_cooking_time'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_ingredients,
+                             migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='ingredient',
+            constraint=models.UniqueConstraint(fields=('name', 'measurement_unit'), name='unique_ingredient'),
+        ),
+    ]
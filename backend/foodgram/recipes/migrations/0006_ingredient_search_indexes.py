@@ -0,0 +1,38 @@
+from django.db import migrations
+
+# Индексы нужны только PostgreSQL: на SQLite (локальные тесты)
+# поиск работает тем же запросом, но без индексов.
+CREATE_INDEXES = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    'CREATE INDEX IF NOT EXISTS recipes_ingredient_name_prefix '
+    'ON recipes_ingredient (lower(name) text_pattern_ops)',
+    'CREATE INDEX IF NOT EXISTS recipes_ingredient_name_trgm '
+    'ON recipes_ingredient USING gin (lower(name) gin_trgm_ops)',
+]
+DROP_INDEXES = [
+    'DROP INDEX IF EXISTS recipes_ingredient_name_trgm',
+    'DROP INDEX IF EXISTS recipes_ingredient_name_prefix',
+]
+
+
+def run_postgresql(statements):
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor != 'postgresql':
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0005_ingredient_unique_ingredient'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run_postgresql(CREATE_INDEXES),
+            run_postgresql(DROP_INDEXES),
+        ),
+    ]
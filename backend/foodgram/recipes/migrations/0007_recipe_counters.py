@@ -0,0 +1,57 @@
+# Generated by Django 4.2.3 on 2026-10-18 17:36
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def count_subquery(model, fk):
+    return Coalesce(
+        Subquery(
+            model.objects.filter(
+                **{fk: OuterRef('pk')}
+            ).order_by().values(fk).annotate(
+                total=Count('pk')
+            ).values('total')
+        ),
+        Value(0)
+    )
+
+
+def fill_counters(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    Favorite = apps.get_model('recipes', 'Favorite')
+    ShoppingList = apps.get_model('recipes', 'ShoppingList')
+    User = apps.get_model('users', 'User')
+    Follow = apps.get_model('users', 'Follow')
+    db_alias = schema_editor.connection.alias
+    Recipe.objects.using(db_alias).update(
+        favorites_count=count_subquery(Favorite, 'recipe'),
+        in_carts_count=count_subquery(ShoppingList, 'recipe'),
+    )
+    User.objects.using(db_alias).update(
+        recipes_count=count_subquery(Recipe, 'author'),
+        followers_count=count_subquery(Follow, 'author'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0006_ingredient_search_indexes'),
+        ('users', '0002_user_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Добавлений в избранное'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='in_carts_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Добавлений в список покупок'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
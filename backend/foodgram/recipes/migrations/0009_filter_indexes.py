@@ -0,0 +1,29 @@
+# Generated by Django 4.2.3 on 2026-10-18 17:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0008_recipe_pub_date_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='favorite',
+            index=models.Index(fields=['recipe', 'user'], name='favorite_recipe_user_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['author', '-pub_date'], name='recipe_author_pub_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipeingredient',
+            index=models.Index(fields=['ingredient', 'recipe'], name='recipeingredient_ingr_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='shoppinglist',
+            index=models.Index(fields=['recipe', 'user'], name='shoppinglist_recipe_user_idx'),
+        ),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 4.2.3 on 2026-10-18 17:50
+
+import django.contrib.postgres.search
+from django.conf import settings
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations
+from django.db.models import OuterRef, Subquery, TextField, Value
+from django.db.models.functions import Coalesce
+
+# GIN-индекс и заполнение вектора нужны только PostgreSQL,
+# на SQLite поиск идёт через icontains (см. recipes.search).
+CREATE_INDEX = (
+    'CREATE INDEX IF NOT EXISTS recipes_recipe_search_vector '
+    'ON recipes_recipe USING gin (search_vector)'
+)
+DROP_INDEX = 'DROP INDEX IF EXISTS recipes_recipe_search_vector'
+
+
+def fill_search_vector(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    Recipe = apps.get_model('recipes', 'Recipe')
+    RecipeIngredient = apps.get_model('recipes', 'RecipeIngredient')
+    config = settings.SEARCH_CONFIG
+    names = Coalesce(
+        Subquery(
+            RecipeIngredient.objects.filter(
+                recipe=OuterRef('pk')
+            ).order_by().values('recipe').annotate(
+                names=StringAgg('ingredient__name', ' ')
+            ).values('names')
+        ),
+        Value(''),
+        output_field=TextField()
+    )
+    Recipe.objects.using(schema_editor.connection.alias).update(
+        search_vector=(
+            SearchVector('name', weight='A', config=config)
+            + SearchVector(names, weight='B', config=config)
+            + SearchVector('text', weight='C', config=config)
+        )
+    )
+    schema_editor.execute(CREATE_INDEX)
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(DROP_INDEX)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0009_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True, verbose_name='Поисковый вектор'),
+        ),
+        migrations.RunPython(fill_search_vector, drop_index),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.3 on 2026-10-18 17:52
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_ingredients_count(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    RecipeIngredient = apps.get_model('recipes', 'RecipeIngredient')
+    Recipe.objects.using(
+        schema_editor.connection.alias
+    ).update(ingredients_count=Coalesce(
+        Subquery(
+            RecipeIngredient.objects.filter(
+                recipe=OuterRef('pk')
+            ).order_by().values('recipe').annotate(
+                total=Count('pk')
+            ).values('total')
+        ),
+        Value(0)
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0010_recipe_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='ingredients_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество ингредиентов'),
+        ),
+        migrations.RunPython(fill_ingredients_count, migrations.RunPython.noop),
+    ]
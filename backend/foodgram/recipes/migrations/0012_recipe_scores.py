@@ -0,0 +1,75 @@
+# Generated by Django 4.2.3 on 2026-10-18 18:06
+
+import datetime
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# Существующим добавлениям ставится дата recipes.scores.SCORE_EPOCH:
+# с датой миграции всё прошлое избранное считалось бы свежей
+# активностью в trending
+HISTORICAL_CREATED = datetime.datetime(2020, 1, 1,
+                                       tzinfo=datetime.timezone.utc)
+
+
+def create_scores(apps, schema_editor):
+    # Нулевые рейтинги, значения считает команда update_recipe_scores
+    Recipe = apps.get_model('recipes', 'Recipe')
+    RecipeScore = apps.get_model('recipes', 'RecipeScore')
+    db_alias = schema_editor.connection.alias
+    RecipeScore.objects.using(db_alias).bulk_create(
+        RecipeScore(recipe_id=pk)
+        for pk in Recipe.objects.using(db_alias).values_list(
+            'pk', flat=True
+        ).iterator()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0011_recipe_ingredients_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecipeScore',
+            fields=[
+                ('recipe', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='score', serialize=False, to='recipes.recipe', verbose_name='Рецепт')),
+                ('popular', models.FloatField(default=0, verbose_name='Популярность')),
+                ('trending', models.FloatField(default=0, verbose_name='Популярность за неделю')),
+                ('favorites_count', models.PositiveIntegerField(default=0)),
+                ('in_carts_count', models.PositiveIntegerField(default=0)),
+                ('computed_at', models.DateTimeField(null=True, verbose_name='Дата расчёта')),
+            ],
+            options={
+                'verbose_name': 'Рейтинг рецепта',
+                'verbose_name_plural': 'Рейтинги рецептов',
+            },
+        ),
+        migrations.AddField(
+            model_name='favorite',
+            name='created',
+            field=models.DateTimeField(auto_now_add=True, db_index=True, default=HISTORICAL_CREATED, verbose_name='Дата добавления'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='shoppinglist',
+            name='created',
+            field=models.DateTimeField(auto_now_add=True, db_index=True, default=HISTORICAL_CREATED, verbose_name='Дата добавления'),
+            preserve_default=False,
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['cooking_time', 'id'], name='recipe_cooking_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipescore',
+            index=models.Index(fields=['-popular', '-recipe'], name='recipescore_popular_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipescore',
+            index=models.Index(fields=['-trending', '-recipe'], name='recipescore_trending_idx'),
+        ),
+        migrations.RunPython(create_scores, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 4.2.3 on 2026-10-18 18:08
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Sum
+
+
+def fill_cart_totals(apps, schema_editor):
+    RecipeIngredient = apps.get_model('recipes', 'RecipeIngredient')
+    ShoppingCartTotal = apps.get_model('recipes', 'ShoppingCartTotal')
+    db_alias = schema_editor.connection.alias
+    totals = RecipeIngredient.objects.using(db_alias).filter(
+        recipe__shopping_lists__isnull=False
+    ).values_list(
+        'recipe__shopping_lists__user_id', 'ingredient_id'
+    ).annotate(total=Sum('amount')).order_by()
+    ShoppingCartTotal.objects.using(db_alias).bulk_create(
+        ShoppingCartTotal(user_id=user_id, ingredient_id=ingredient_id,
+                          amount=amount)
+        for user_id, ingredient_id, amount in totals.iterator()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipes', '0012_recipe_scores'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShoppingCartTotal',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.PositiveIntegerField(verbose_name='Количество')),
+                ('ingredient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cart_totals', to='recipes.ingredient', verbose_name='Ингредиент')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cart_totals', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Сумма списка покупок',
+                'verbose_name_plural': 'Суммы списков покупок',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='shoppingcarttotal',
+            constraint=models.UniqueConstraint(fields=('user', 'ingredient'), name='unique_cart_total'),
+        ),
+        migrations.RunPython(fill_cart_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.3 on 2026-10-18 18:42
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0014_recipe_updated_at'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='recipe',
+            name='ingredients_count',
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.3 on 2026-10-18 18:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0015_remove_recipe_ingredients_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='rendered_image',
+            field=models.CharField(blank=True, editable=False, max_length=100, verbose_name='Изображение с миниатюрами'),
+        ),
+    ]
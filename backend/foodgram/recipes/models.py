@@ -1,5 +1,9 @@
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
-from users.models import User
+from django.db.models import (Count, Exists, F, OuterRef, Prefetch, Subquery,
+                              Value, Window)
+from django.db.models.functions import RowNumber
+from users.models import CountersMixin, User, Follow
 from django.core.validators import MinValueValidator
 from django.core.exceptions import ValidationError
 
@@ -22,6 +26,12 @@ class Ingredient(models.Model):
     class Meta:
         verbose_name = 'Ингредиент'
         verbose_name_plural = 'Ингредиенты'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['name', 'measurement_unit'],
+                name='unique_ingredient'
+            )
+        ]
 
     def __str__(self):
         return self.name
@@ -51,7 +61,85 @@ class Tag(models.Model):
         return self.name
 
 
-class Recipe(models.Model):
+class RecipeQuerySet(models.QuerySet):
+    def with_related(self):
+        """Автор одним JOIN, теги и ингредиенты - двумя prefetch-запросами."""
+        return self.select_related('author').prefetch_related(
+            'tags',
+            Prefetch(
+                'recipeingredients',
+                queryset=RecipeIngredient.objects.select_related('ingredient')
+            )
+        )
+
+    def with_user_flags(self, user):
+        """Флаги избранного, списка покупок и подписки на автора
+        считаются подзапросами EXISTS в том же SELECT."""
+        if not user.is_authenticated:
+            false = Value(False, output_field=models.BooleanField())
+            return self.annotate(
+                is_favorited=false,
+                is_in_shopping_cart=false,
+                is_author_subscribed=false
+            )
+        return self.annotate(
+            is_favorited=Exists(Favorite.objects.filter(
+                user=user, recipe=OuterRef('pk')
+            )),
+            is_in_shopping_cart=Exists(ShoppingList.objects.filter(
+                user=user, recipe=OuterRef('pk')
+            )),
+            is_author_subscribed=Exists(Follow.objects.filter(
+                user=user, author=OuterRef('author')
+            ))
+        )
+
+    def cookable_from(self, ingredient_ids, max_missing=0):
+        """Рецепты, которым не хватает не больше max_missing ингредиентов
+        из переданных, - сначала полностью доступные.
+
+        Совпадения считаются по индексу (ingredient, recipe) таблицы
+        RecipeIngredient, всего ингредиентов - подзапросом по индексу
+        (recipe, ingredient) только для рецептов с совпадениями.
+        """
+        matched = Count('recipeingredients', distinct=True)
+        total = Subquery(
+            RecipeIngredient.objects.filter(
+                recipe=OuterRef('pk')
+            ).order_by().values('recipe').annotate(
+                total=Count('pk')
+            ).values('total')
+        )
+        return self.filter(
+            recipeingredients__ingredient_id__in=ingredient_ids
+        ).annotate(
+            matched_ingredients=matched,
+            missing_ingredients=total - matched
+        ).filter(
+            missing_ingredients__lte=max_missing
+        ).order_by(
+            'missing_ingredients', '-matched_ingredients', '-pub_date', '-id'
+        )
+
+    def first_per_author(self, limit):
+        """Не больше limit свежих рецептов каждого автора одним запросом:
+        ROW_NUMBER() OVER (PARTITION BY author_id ORDER BY pub_date DESC)."""
+        return self.annotate(
+            author_row=Window(
+                RowNumber(),
+                partition_by=F('author'),
+                order_by=(F('pub_date').desc(), F('id').desc())
+            )
+        ).filter(author_row__lte=limit)
+
+
+class RecipeManager(models.Manager.from_queryset(RecipeQuerySet)):
+    def get_queryset(self):
+        # Поисковый вектор нужен только в WHERE, в выборки его не тянем
+        return super().get_queryset().defer('search_vector')
+
+
+class Recipe(CountersMixin, models.Model):
     author = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
@@ -66,6 +154,14 @@ class Recipe(models.Model):
         upload_to='recipes/',
         verbose_name='Изображение'
     )
+    # Изображение, для которого уже созданы миниатюры (recipes.images);
+    # пока оно не совпадает с image, ссылки миниатюр ведут на оригинал
+    rendered_image = models.CharField(
+        'Изображение с миниатюрами',
+        max_length=100,
+        blank=True,
+        editable=False
+    )
     text = models.TextField(
         verbose_name='Описание рецепта'
     )
@@ -86,11 +182,47 @@ class Recipe(models.Model):
         auto_now_add=True,
         verbose_name='Дата публикации'
     )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        verbose_name='Дата изменения'
+    )
+    favorites_count = models.PositiveIntegerField(
+        'Добавлений в избранное',
+        default=0,
+        editable=False
+    )
+    in_carts_count = models.PositiveIntegerField(
+        'Добавлений в список покупок',
+        default=0,
+        editable=False
+    )
+    search_vector = SearchVectorField(
+        'Поисковый вектор',
+        null=True,
+        editable=False
+    )
+
+    objects = RecipeManager()
+    counter_fields = ('favorites_count', 'in_carts_count')
 
     class Meta:
         ordering = ['-pub_date']
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
+        indexes = [
+            # Сортировка лент и keyset-пагинация по (pub_date, id)
+            models.Index(
+                fields=['-pub_date', '-id'], name='recipe_pub_date_id_idx'
+            ),
+            # Рецепты автора в порядке ленты
+            models.Index(
+                fields=['author', '-pub_date'], name='recipe_author_pub_idx'
+            ),
+            # ?ordering=cooking_time
+            models.Index(
+                fields=['cooking_time', 'id'], name='recipe_cooking_time_idx'
+            ),
+        ]
 
     def __str__(self):
         return self.name
@@ -122,6 +254,13 @@ class RecipeIngredient(models.Model):
     class Meta:
         verbose_name = 'Ингредиент рецепта'
         verbose_name_plural = 'Ингредиенты рецепта'
+        indexes = [
+            # Поиск рецептов по ингредиенту
+            models.Index(
+                fields=['ingredient', 'recipe'],
+                name='recipeingredient_ingr_idx'
+            ),
+        ]
 
 
 class Favorite(models.Model):
@@ -137,6 +276,11 @@ class Favorite(models.Model):
         related_name='favorites',
         verbose_name='Избранный рецепт'
     )
+    created = models.DateTimeField(
+        'Дата добавления',
+        auto_now_add=True,
+        db_index=True
+    )
 
     class Meta:
         verbose_name = 'Избранный рецепт'
@@ -149,6 +293,12 @@ class Favorite(models.Model):
                 name='unique_favorite'
             )
         ]
+        indexes = [
+            # Обратный к unique_favorite: кто добавил рецепт в избранное
+            models.Index(
+                fields=['recipe', 'user'], name='favorite_recipe_user_idx'
+            ),
+        ]
 
     def __str__(self):
         return (
@@ -170,6 +320,11 @@ class ShoppingList(models.Model):
         related_name='shopping_lists',
         verbose_name='Рецепт, добавленный в список покупок'
     )
+    created = models.DateTimeField(
+        'Дата добавления',
+        auto_now_add=True,
+        db_index=True
+    )
 
     class Meta:
         verbose_name = 'Список покупок'
@@ -180,9 +335,77 @@ class ShoppingList(models.Model):
                 name='unique_shopping_lists'
             )
         ]
+        indexes = [
+            models.Index(
+                fields=['recipe', 'user'], name='shoppinglist_recipe_user_idx'
+            ),
+        ]
 
     def __str__(self):
         return (
             f'Рецепт "{self.recipe}" в списке покупок у '
             f'пользователя {self.user}'
         )
+
+
+class RecipeScore(models.Model):
+    """Рейтинги популярности рецепта (см. recipes.scores)."""
+    recipe = models.OneToOneField(
+        Recipe,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='score',
+        verbose_name='Рецепт'
+    )
+    popular = models.FloatField('Популярность', default=0)
+    trending = models.FloatField('Популярность за неделю', default=0)
+    # Счётчики рецепта на момент расчёта: расхождение с ними значит,
+    # что рецепт убрали из избранного или списка покупок
+    favorites_count = models.PositiveIntegerField(default=0)
+    in_carts_count = models.PositiveIntegerField(default=0)
+    computed_at = models.DateTimeField('Дата расчёта', null=True)
+
+    class Meta:
+        verbose_name = 'Рейтинг рецепта'
+        verbose_name_plural = 'Рейтинги рецептов'
+        indexes = [
+            # Страницы ?ordering=popular|trending читаются по индексу
+            models.Index(
+                fields=['-popular', '-recipe'], name='recipescore_popular_idx'
+            ),
+            models.Index(
+                fields=['-trending', '-recipe'],
+                name='recipescore_trending_idx'
+            ),
+        ]
+
+
+class ShoppingCartTotal(models.Model):
+    """Сумма ингредиента по всем рецептам списка покупок пользователя.
+
+    Поддерживается сигналами (см. recipes.carts), проверяется
+    командой check_cart_totals.
+    """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='cart_totals',
+        verbose_name='Пользователь'
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name='cart_totals',
+        verbose_name='Ингредиент'
+    )
+    amount = models.PositiveIntegerField('Количество')
+
+    class Meta:
+        verbose_name = 'Сумма списка покупок'
+        verbose_name_plural = 'Суммы списков покупок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='unique_cart_total'
+            )
+        ]
@@ -0,0 +1,138 @@
+"""Рейтинги популярности рецептов для ?ordering=popular|trending.
+
+Каждое добавление в избранное или список покупок вносит в рейтинг
+свой вес, который убывает вдвое за период полураспада: месяц для
+popular и два дня для trending («популярное за неделю»).
+
+Затухание отсчитывается от фиксированной эпохи, хранится
+log2(сумма вес * 2 ** ((t - SCORE_EPOCH) / период)). Со временем все
+рейтинги уменьшаются на одно и то же слагаемое, порядок не меняется,
+поэтому пересчитывать нужно только рецепты, у которых с прошлого
+расчёта что-то добавили или убрали. Рейтинг 0 - добавлений нет.
+
+Добавления считаются в БД по часам (рецепт, час, число), так что
+в Python попадает не больше строк, чем часов с активностью. Время
+добавления округляется до середины часа: для trending это меняет вес
+не больше чем на 2 ** (1 / 96), около 0,7%.
+"""
+import math
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+from django.db import transaction
+from django.db.models import Count, F, Max, Q
+from django.db.models.functions import TruncHour
+from django.utils import timezone as django_timezone
+from recipes.models import Favorite, Recipe, RecipeScore, ShoppingList
+
+SCORE_EPOCH = datetime(2020, 1, 1, tzinfo=timezone.utc)
+# Период полураспада веса добавления, в днях
+POPULAR_HALF_LIFE_DAYS = 30
+TRENDING_HALF_LIFE_DAYS = 2
+# Модель-источник -> вес одного добавления
+ACTIVITY_WEIGHTS = {
+    Favorite: 2,
+    ShoppingList: 1,
+}
+SCORE_BATCH_SIZE = 500
+# Запас на транзакции, которые ещё не завершились во время прошлого расчёта
+SCORE_OVERLAP = timedelta(minutes=5)
+# Добавления внутри часа считаются сделанными в его середине
+HOUR_MIDDLE = timedelta(minutes=30)
+
+
+def decayed_score(activity, half_life_days):
+    """log2 суммы весов активности [(вес, дата), ...] с затуханием.
+
+    Вес может быть суммой нескольких добавлений с одной датой.
+    """
+    if not activity:
+        return 0
+    exponents = [
+        math.log2(weight)
+        + (created - SCORE_EPOCH).total_seconds() / 86400 / half_life_days
+        for weight, created in activity
+    ]
+    # log-sum-exp: без переполнения для сколь угодно поздних дат
+    top = max(exponents)
+    return top + math.log2(sum(2 ** (value - top) for value in exponents))
+
+
+def touched_recipe_ids(since):
+    """Рецепты без рейтинга, с добавлениями после since и с удалениями
+    (счётчики рецепта разошлись с сохранёнными в рейтинге)."""
+    recipe_ids = set(
+        Recipe.objects.filter(score__isnull=True).values_list('pk', flat=True)
+    )
+    for model in ACTIVITY_WEIGHTS:
+        recipe_ids.update(
+            model.objects.filter(created__gte=since).values_list(
+                'recipe_id', flat=True
+            ).distinct()
+        )
+    recipe_ids.update(RecipeScore.objects.filter(
+        ~Q(favorites_count=F('recipe__favorites_count'))
+        | ~Q(in_carts_count=F('recipe__in_carts_count'))
+    ).values_list('recipe_id', flat=True))
+    return recipe_ids
+
+
+def hourly_activity(recipe_ids):
+    """{рецепт: [(вес, середина часа), ...]} по часовым суммам из БД."""
+    activity = defaultdict(list)
+    for model, weight in ACTIVITY_WEIGHTS.items():
+        rows = model.objects.filter(
+            recipe_id__in=recipe_ids
+        ).values_list(
+            'recipe_id', TruncHour('created')
+        ).annotate(count=Count('pk')).order_by()
+        for recipe_id, hour, count in rows.iterator():
+            activity[recipe_id].append((weight * count, hour + HOUR_MIDDLE))
+    return activity
+
+
+def compute_scores(recipe_ids, now):
+    activity = hourly_activity(recipe_ids)
+    counts = Recipe.objects.filter(pk__in=recipe_ids).values_list(
+        'pk', 'favorites_count', 'in_carts_count'
+    )
+    return [
+        RecipeScore(
+            recipe_id=recipe_id,
+            popular=decayed_score(activity[recipe_id],
+                                  POPULAR_HALF_LIFE_DAYS),
+            trending=decayed_score(activity[recipe_id],
+                                   TRENDING_HALF_LIFE_DAYS),
+            favorites_count=favorites_count,
+            in_carts_count=in_carts_count,
+            computed_at=now
+        )
+        for recipe_id, favorites_count, in_carts_count in counts
+    ]
+
+
+def update_recipe_scores(full=False):
+    """Пересчитывает рейтинги и возвращает число обновлённых рецептов.
+
+    По умолчанию - только рецепты, затронутые с прошлого расчёта,
+    с full=True - все.
+    """
+    now = django_timezone.now()
+    since = RecipeScore.objects.aggregate(since=Max('computed_at'))['since']
+    if full or since is None:
+        recipe_ids = list(Recipe.objects.values_list('pk', flat=True))
+    else:
+        recipe_ids = sorted(touched_recipe_ids(since - SCORE_OVERLAP))
+    for start in range(0, len(recipe_ids), SCORE_BATCH_SIZE):
+        scores = compute_scores(
+            recipe_ids[start:start + SCORE_BATCH_SIZE], now
+        )
+        with transaction.atomic():
+            RecipeScore.objects.bulk_create(
+                scores,
+                update_conflicts=True,
+                unique_fields=['recipe'],
+                update_fields=['popular', 'trending', 'favorites_count',
+                               'in_carts_count', 'computed_at']
+            )
+    return len(recipe_ids)
@@ -0,0 +1,103 @@
+"""Полнотекстовый поиск рецептов.
+
+На PostgreSQL поиск идёт по хранимому Recipe.search_vector
+(название - вес A, ингредиенты - B, описание - C) с GIN-индексом
+из миграции 0010_recipe_search_vector. Вектор пересчитывается
+сигналами при сохранении рецепта или ингредиента и по сигналу
+ingredients_changed после массовых операций с RecipeIngredient
+(см. recipes.signals). На SQLite - поиск подстроки без учёта
+регистра: встроенные LOWER и LIKE SQLite меняют регистр только
+у латиницы, поэтому строки приводятся функцией Casefold.
+"""
+from django.conf import settings
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            SearchVector)
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.db.models import (F, Func, OuterRef, Q, QuerySet, Subquery,
+                              TextField, Value)
+from django.db.models.functions import Coalesce
+from django.dispatch import receiver
+from recipes.models import Recipe, RecipeIngredient
+
+
+class Casefold(Func):
+    """str.casefold() на SQLite, LOWER на остальных СУБД."""
+    function = 'LOWER'
+    output_field = TextField()
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return super().as_sql(compiler, connection, function='PY_CASEFOLD',
+                              **extra_context)
+
+
+def casefold(value):
+    return value.casefold() if isinstance(value, str) else value
+
+
+@receiver(connection_created)
+def register_casefold(sender, connection, **kwargs):
+    if connection.vendor == 'sqlite':
+        connection.connection.create_function(
+            'PY_CASEFOLD', 1, casefold, deterministic=True
+        )
+
+
+def search_enabled():
+    return connection.vendor == 'postgresql'
+
+
+def ingredient_names():
+    return Coalesce(
+        Subquery(
+            RecipeIngredient.objects.filter(
+                recipe=OuterRef('pk')
+            ).order_by().values('recipe').annotate(
+                names=StringAgg('ingredient__name', ' ')
+            ).values('names')
+        ),
+        Value(''),
+        output_field=TextField()
+    )
+
+
+def search_vector():
+    config = settings.SEARCH_CONFIG
+    return (
+        SearchVector('name', weight='A', config=config)
+        + SearchVector(ingredient_names(), weight='B', config=config)
+        + SearchVector('text', weight='C', config=config)
+    )
+
+
+def update_search_vector(recipes):
+    """Пересчитывает вектор одним UPDATE.
+
+    recipes - queryset рецептов или список их id.
+    """
+    if not search_enabled():
+        return 0
+    if not isinstance(recipes, QuerySet):
+        recipes = Recipe.objects.filter(pk__in=recipes)
+    return recipes.update(search_vector=search_vector())
+
+
+def search_recipes(queryset, value):
+    """Рецепты по запросу, самые релевантные первыми."""
+    if not search_enabled():
+        value = value.casefold()
+        return queryset.alias(
+            search_name=Casefold('name'),
+            search_text=Casefold('text'),
+            search_ingredient=Casefold('recipeingredients__ingredient__name')
+        ).filter(
+            Q(search_name__contains=value)
+            | Q(search_text__contains=value)
+            | Q(search_ingredient__contains=value)
+        ).distinct()
+    query = SearchQuery(value, config=settings.SEARCH_CONFIG,
+                        search_type='websearch')
+    return queryset.filter(search_vector=query).annotate(
+        search_rank=SearchRank(F('search_vector'), query)
+    ).order_by('-search_rank', '-pub_date', '-id')
@@ -0,0 +1,223 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete)
+from django.dispatch import Signal, receiver
+from recipes.cache import (CATALOGUE, bump_version_on_commit,
+                           membership_version, recipe_version, user_version)
+from recipes.carts import apply_cart_deltas, refresh_cart_totals
+from recipes.counters import change_counter, change_counters
+from recipes.images import schedule_renditions
+from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                            RecipeScore, ShoppingList, Tag)
+from recipes.search import update_search_vector
+from users.models import Follow, User
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def invalidate_catalogue(**kwargs):
+    bump_version_on_commit(CATALOGUE)
+
+
+# Денормализованные счётчики: модель-источник -> (модель, FK, поле)
+COUNTERS = {
+    Favorite: (Recipe, 'recipe_id', 'favorites_count'),
+    ShoppingList: (Recipe, 'recipe_id', 'in_carts_count'),
+    Recipe: (User, 'author_id', 'recipes_count'),
+    Follow: (User, 'author_id', 'followers_count'),
+}
+
+# Состав рецептов изменился массовой операцией (bulk_create, bulk_update,
+# удаление через queryset), которая не отправляет сигналы моделей.
+# Аргументы: recipe_ids - id затронутых рецептов, amount_deltas -
+# необязательная разница количеств {(рецепт, ингредиент): изменение},
+# см. recipes.carts.amount_deltas.
+ingredients_changed = Signal()
+
+# Связи пользователя (избранное, список покупок, подписки) созданы или
+# удалены сырым SQL (api.utils.add_relations) без сигналов моделей.
+# Аргументы: user_id, target_ids - id рецептов или авторов, created.
+relations_changed = Signal()
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_save, sender=ShoppingList)
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=Follow)
+def increment_counter(sender, instance, created, **kwargs):
+    if created:
+        model, fk, field = COUNTERS[sender]
+        change_counter(model, getattr(instance, fk), field, 1)
+
+
+@receiver(post_delete, sender=Favorite)
+@receiver(post_delete, sender=ShoppingList)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=Follow)
+def decrement_counter(sender, instance, **kwargs):
+    model, fk, field = COUNTERS[sender]
+    change_counter(model, getattr(instance, fk), field, -1)
+
+
+@receiver(relations_changed)
+def change_relation_counters(sender, target_ids, created, **kwargs):
+    # Каждый объект встречается в target_ids один раз: связь уникальна
+    model, _, field = COUNTERS[sender]
+    change_counters(model, target_ids, field, 1 if created else -1)
+
+
+@receiver(post_save, sender=Recipe)
+def create_recipe_score(sender, instance, created, **kwargs):
+    # Нулевой рейтинг, чтобы новый рецепт попал в ?ordering=popular
+    # до следующего запуска update_recipe_scores
+    if created:
+        RecipeScore.objects.get_or_create(recipe=instance)
+
+
+@receiver(post_save, sender=Recipe)
+def create_image_renditions(sender, instance, **kwargs):
+    if instance.image:
+        transaction.on_commit(
+            partial(schedule_renditions, instance.image.name)
+        )
+
+
+# Поля, из которых строится поисковый вектор рецепта
+SEARCH_FIELDS = {'name', 'text'}
+
+
+@receiver(post_save, sender=Recipe)
+def update_recipe_search_vector(sender, instance, update_fields, **kwargs):
+    if update_fields is None or SEARCH_FIELDS & set(update_fields):
+        update_search_vector([instance.pk])
+
+
+@receiver(post_save, sender=Ingredient)
+def update_ingredient_search_vector(sender, instance, created, **kwargs):
+    if not created:
+        update_search_vector(
+            Recipe.objects.filter(recipeingredients__ingredient=instance)
+        )
+
+
+@receiver(ingredients_changed)
+def refresh_recipe_ingredients(recipe_ids, **kwargs):
+    update_search_vector(recipe_ids)
+    invalidate_recipes(recipe_ids)
+
+
+@receiver(pre_delete, sender=Ingredient)
+def remember_ingredient_recipes(sender, instance, **kwargs):
+    # После каскадного удаления связей рецепты уже не найти
+    instance.affected_recipe_ids = list(
+        RecipeIngredient.objects.filter(
+            ingredient=instance
+        ).values_list('recipe_id', flat=True)
+    )
+
+
+@receiver(post_delete, sender=Ingredient)
+def refresh_ingredient_recipes(sender, instance, **kwargs):
+    recipe_ids = getattr(instance, 'affected_recipe_ids', None)
+    if recipe_ids:
+        ingredients_changed.send(sender=Ingredient, recipe_ids=recipe_ids)
+
+
+# Суммы списков покупок (recipes.carts)
+@receiver(post_save, sender=ShoppingList)
+@receiver(post_delete, sender=ShoppingList)
+def refresh_cart_recipe(sender, instance, **kwargs):
+    refresh_cart_totals([instance.user_id], [instance.recipe_id])
+
+
+@receiver(relations_changed, sender=ShoppingList)
+def refresh_cart_recipes(sender, user_id, target_ids, **kwargs):
+    refresh_cart_totals([user_id], target_ids)
+
+
+@receiver(ingredients_changed)
+def refresh_carts_with_recipes(sender, recipe_ids, amount_deltas=None,
+                               **kwargs):
+    if sender is Ingredient:
+        # Суммы удалённого ингредиента удалены каскадом вместе с ним
+        return
+    if amount_deltas is not None:
+        apply_cart_deltas(amount_deltas)
+        return
+    # Прежний состав рецептов неизвестен: списки пересчитываются целиком
+    refresh_cart_totals(
+        ShoppingList.objects.filter(
+            recipe_id__in=recipe_ids
+        ).values_list('user_id', flat=True).distinct()
+    )
+
+
+@receiver(pre_delete, sender=Recipe)
+def remember_cart_users(sender, instance, **kwargs):
+    # Состав рецепта может удалиться каскадом раньше списков покупок
+    instance.cart_user_ids = list(
+        instance.shopping_lists.values_list('user_id', flat=True)
+    )
+
+
+@receiver(post_delete, sender=Recipe)
+def refresh_recipe_carts(sender, instance, **kwargs):
+    refresh_cart_totals(getattr(instance, 'cart_user_ids', ()))
+
+
+# Карточки рецептов в кэше (api.cache.RecipeDetailCacheMixin)
+# хранятся под версиями рецепта и его автора
+def invalidate_recipes(recipe_ids):
+    for recipe_id in recipe_ids:
+        bump_version_on_commit(recipe_version(recipe_id))
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def invalidate_recipe(sender, instance, **kwargs):
+    invalidate_recipes([instance.pk])
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def invalidate_recipe_tags(sender, instance, action, reverse, pk_set,
+                           **kwargs):
+    if not reverse:
+        if action.startswith('post_'):
+            invalidate_recipes([instance.pk])
+    elif action == 'pre_clear':
+        invalidate_recipes(sender.objects.filter(
+            tag=instance
+        ).values_list('recipe_id', flat=True))
+    elif action in ('post_add', 'post_remove'):
+        invalidate_recipes(pk_set)
+
+
+# Поля пользователя, которые попадают в карточку рецепта
+AUTHOR_FIELDS = {'email', 'username', 'first_name', 'last_name'}
+
+
+@receiver(post_save, sender=User)
+def invalidate_author(sender, instance, update_fields, **kwargs):
+    if update_fields is None or AUTHOR_FIELDS & set(update_fields):
+        bump_version_on_commit(user_version(instance.pk))
+
+
+# Наборы избранного, списка покупок и подписок пользователя
+# (api.memberships) кэшируются под версией пользователя
+@receiver(post_save, sender=Favorite)
+@receiver(post_save, sender=ShoppingList)
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Favorite)
+@receiver(post_delete, sender=ShoppingList)
+@receiver(post_delete, sender=Follow)
+def invalidate_memberships(sender, instance, **kwargs):
+    bump_version_on_commit(membership_version(instance.user_id))
+
+
+@receiver(relations_changed)
+def invalidate_changed_memberships(sender, user_id, **kwargs):
+    bump_version_on_commit(membership_version(user_id))
@@ -0,0 +1,26 @@
+import re
+from pathlib import PurePosixPath
+
+from django.core.files.storage import FileSystemStorage
+
+# Имя файла - хэш содержимого (см. recipes.images.normalize_image)
+HASHED_NAME = re.compile(r'^[0-9a-f]{32}(_\w+)?\.\w+$')
+
+
+class DeduplicatingStorage(FileSystemStorage):
+    """Файлы с именем-хэшем содержимого не дублируются: повторная
+    загрузка той же картинки возвращает уже сохранённый файл."""
+
+    @staticmethod
+    def is_hashed(name):
+        return bool(HASHED_NAME.match(PurePosixPath(name).name))
+
+    def get_available_name(self, name, max_length=None):
+        if self.is_hashed(name):
+            return name
+        return super().get_available_name(name, max_length)
+
+    def _save(self, name, content):
+        if self.is_hashed(name) and self.exists(name):
+            return name
+        return super()._save(name, content)
@@ -0,0 +1,201 @@
+import csv
+import json
+import math
+import os
+import runpy
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+from PIL import Image, ImageCms
+from foodgram import settings as project_settings
+from recipes.cache import get_version, recipe_version
+from recipes.images import ALLOWED_FORMATS, normalize_image
+from recipes.management.commands.import_ingredients import (
+    DEFAULT_PATH, CsvStream, iter_json_array)
+from recipes.models import Favorite, Ingredient, Recipe, RecipeScore
+from recipes.scores import (ACTIVITY_WEIGHTS, POPULAR_HALF_LIFE_DAYS,
+                            TRENDING_HALF_LIFE_DAYS, decayed_score,
+                            hourly_activity, update_recipe_scores)
+from users.models import User
+
+
+class NormalizeImageTest(SimpleTestCase):
+    def test_metadata_removed(self):
+        icc_profile = ImageCms.ImageCmsProfile(
+            ImageCms.createProfile('sRGB')
+        ).tobytes()
+        exif = Image.Exif()
+        exif[0x0110] = 'Camera'
+        for image_format in ALLOWED_FORMATS:
+            with self.subTest(image_format=image_format):
+                source = BytesIO()
+                Image.new('RGB', (8, 8), 'red').save(
+                    source, format=image_format, icc_profile=icc_profile,
+                    exif=exif.tobytes()
+                )
+                source.seek(0)
+                with Image.open(normalize_image(source)) as image:
+                    self.assertNotIn('icc_profile', image.info)
+                    self.assertFalse(image.getexif())
+
+
+class CacheVersionTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        author = User.objects.create_user(
+            email='author@example.com', username='author',
+            first_name='Имя', last_name='Фамилия', password='password123'
+        )
+        self.recipe = Recipe.objects.create(
+            author=author, name='Рецепт', text='Описание', cooking_time=10
+        )
+
+    def test_recipe_version_bumped_on_commit(self):
+        name = recipe_version(self.recipe.pk)
+        version = get_version(name)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.recipe.save()
+            self.assertEqual(get_version(name), version)
+        self.assertNotEqual(get_version(name), version)
+
+
+class CacheSettingsTest(SimpleTestCase):
+    LOCMEM = 'django.core.cache.backends.locmem.LocMemCache'
+    REDIS = 'django.core.cache.backends.redis.RedisCache'
+
+    def load_settings(self, **env):
+        with mock.patch.dict(os.environ, env):
+            return runpy.run_path(project_settings.__file__)
+
+    def test_local_cache_with_workers(self):
+        with self.assertRaises(ImproperlyConfigured):
+            self.load_settings(CACHE_BACKEND=self.LOCMEM,
+                               WEB_CONCURRENCY='4')
+
+    def test_local_cache_short_timeouts(self):
+        values = self.load_settings(CACHE_BACKEND=self.LOCMEM,
+                                    WEB_CONCURRENCY='1')
+        for name in ('CACHE_VERSION_TIMEOUT', 'CATALOGUE_CACHE_TIMEOUT',
+                     'RECIPE_CACHE_TIMEOUT', 'MEMBERSHIPS_CACHE_TIMEOUT'):
+            self.assertEqual(values[name], values['LOCAL_CACHE_TIMEOUT'])
+
+    def test_shared_cache(self):
+        values = self.load_settings(CACHE_BACKEND=self.REDIS,
+                                    WEB_CONCURRENCY='4')
+        self.assertIsNone(values['CACHE_VERSION_TIMEOUT'])
+        self.assertEqual(values['RECIPE_CACHE_TIMEOUT'], 3600)
+
+
+class ImportIngredientsTest(TestCase):
+    JSON_PATH = DEFAULT_PATH.with_suffix('.json')
+
+    def test_json_read_in_chunks(self):
+        with open(self.JSON_PATH, encoding='utf-8') as json_file:
+            expected = json.load(json_file)
+        for chunk_size in (7, 1024):
+            with self.subTest(chunk_size=chunk_size):
+                with open(self.JSON_PATH, encoding='utf-8') as json_file:
+                    self.assertEqual(
+                        list(iter_json_array(json_file, chunk_size)),
+                        expected
+                    )
+
+    def test_csv_stream(self):
+        rows = [('соль, крупная', 'г'), ('вода', 'мл')] * 100
+        stream = CsvStream(rows)
+        chunks = iter(lambda: stream.read(64), '')
+        self.assertEqual(
+            list(csv.reader(StringIO(''.join(chunks)))),
+            [list(row) for row in rows]
+        )
+        self.assertEqual(stream.total, len(rows))
+
+    def test_reports_inserted_rows(self):
+        output = StringIO()
+        call_command('import_ingredients', path=str(self.JSON_PATH),
+                     stdout=output)
+        count = Ingredient.objects.count()
+        self.assertIn(f'добавлено {count},', output.getvalue())
+        output = StringIO()
+        call_command('import_ingredients', path=str(self.JSON_PATH),
+                     stdout=output)
+        self.assertEqual(Ingredient.objects.count(), count)
+        self.assertIn('добавлено 0,', output.getvalue())
+
+
+class RecipeScoresTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            User.objects.create_user(
+                email=f'user{number}@example.com', username=f'user{number}',
+                first_name='Имя', last_name='Фамилия', password='password123'
+            )
+            for number in range(4)
+        ]
+        cls.old, cls.fresh = (
+            Recipe.objects.create(author=cls.users[0], name=name,
+                                  text='Описание', cooking_time=10)
+            for name in ('Старый', 'Новый')
+        )
+        now = timezone.now()
+        for user in cls.users[1:]:
+            Favorite.objects.create(user=user, recipe=cls.old)
+        Favorite.objects.create(user=cls.users[0], recipe=cls.fresh)
+        Favorite.objects.filter(recipe=cls.old).update(
+            created=now - timedelta(days=20)
+        )
+        Favorite.objects.filter(recipe=cls.fresh).update(
+            created=now - timedelta(hours=1)
+        )
+
+    def score(self, recipe):
+        return RecipeScore.objects.get(recipe=recipe)
+
+    def test_half_life(self):
+        now = timezone.now()
+        half_life = timedelta(days=POPULAR_HALF_LIFE_DAYS)
+        self.assertAlmostEqual(
+            decayed_score([(1, now)], POPULAR_HALF_LIFE_DAYS)
+            - decayed_score([(1, now - half_life)], POPULAR_HALF_LIFE_DAYS),
+            1
+        )
+        self.assertAlmostEqual(
+            decayed_score([(1, now), (1, now)], TRENDING_HALF_LIFE_DAYS),
+            decayed_score([(2, now)], TRENDING_HALF_LIFE_DAYS)
+        )
+        self.assertEqual(decayed_score([], TRENDING_HALF_LIFE_DAYS), 0)
+        far = now.replace(year=2300)
+        self.assertTrue(math.isfinite(
+            decayed_score([(1, far), (1, now)], TRENDING_HALF_LIFE_DAYS)
+        ))
+
+    def test_trending_decays_faster(self):
+        update_recipe_scores(full=True)
+        old, fresh = self.score(self.old), self.score(self.fresh)
+        # Три добавления двадцатидневной давности против одного свежего
+        self.assertGreater(old.popular, fresh.popular)
+        self.assertLess(old.trending, fresh.trending)
+
+    def test_activity_aggregated_in_database(self):
+        with self.assertNumQueries(len(ACTIVITY_WEIGHTS)):
+            activity = hourly_activity([self.old.pk, self.fresh.pk])
+        (weight, _), = activity[self.old.pk]
+        self.assertEqual(weight, 3 * ACTIVITY_WEIGHTS[Favorite])
+
+    def test_only_touched_recipes_recomputed(self):
+        update_recipe_scores(full=True)
+        popular = self.score(self.old).popular
+        Favorite.objects.create(user=self.users[0], recipe=self.old)
+        self.assertEqual(update_recipe_scores(), 1)
+        self.assertGreater(self.score(self.old).popular, popular)
+        Favorite.objects.filter(user=self.users[0], recipe=self.old).delete()
+        self.assertEqual(update_recipe_scores(), 1)
+        self.assertAlmostEqual(self.score(self.old).popular, popular)
+        self.assertEqual(update_recipe_scores(), 0)
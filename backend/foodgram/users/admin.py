@@ -6,7 +6,8 @@ from .models import User, Follow
 @admin.register(User)
 class UserAdmin(admin.ModelAdmin):
     # что будет отображаться в админке
-    list_display = ('pk', 'email', 'username', 'first_name', 'last_name')
+    list_display = ('pk', 'email', 'username', 'first_name', 'last_name',
+                    'recipes_count', 'followers_count')
     # по каким полям можно искать
     search_fields = ('pk', 'username', 'email', 'first_name', 'last_name')
     # по каким полям можно фильтровать объекты
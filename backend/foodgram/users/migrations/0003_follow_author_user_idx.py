@@ -0,0 +1,17 @@
+# Generated by Django 4.2.3 on 2026-10-18 17:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_user_counters'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='follow',
+            index=models.Index(fields=['author', 'user'], name='follow_author_user_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.3 on 2026-10-18 18:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_follow_author_user_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, verbose_name='Дата изменения'),
+        ),
+    ]
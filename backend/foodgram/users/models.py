@@ -2,7 +2,27 @@ from django.contrib.auth.models import AbstractUser
 from django.db import models
 
 
-class User(AbstractUser):
+class CountersMixin:
+    """Счётчики меняются только через F()-выражения (см. recipes.signals).
+
+    Обычный save() не должен перезаписывать их значениями,
+    прочитанными из БД раньше, поэтому они исключаются из update_fields.
+    """
+
+    counter_fields = ()
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            skip = set(self.counter_fields) | self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.attname not in skip
+                and field.name not in skip
+            ]
+        super().save(*args, **kwargs)
+
+
+class User(CountersMixin, AbstractUser):
     """Модель пользователя
     Чтобы использовать свою модель, надо внести изменения в файл
     settings.py"""
@@ -18,6 +38,22 @@ class User(AbstractUser):
         max_length=254,
         unique=True,
     )
+    recipes_count = models.PositiveIntegerField(
+        'Количество рецептов',
+        default=0,
+        editable=False
+    )
+    followers_count = models.PositiveIntegerField(
+        'Количество подписчиков',
+        default=0,
+        editable=False
+    )
+    updated_at = models.DateTimeField(
+        'Дата изменения',
+        auto_now=True
+    )
+
+    counter_fields = ('recipes_count', 'followers_count')
 
     class Meta:
         verbose_name = 'Пользователь'
@@ -51,6 +87,12 @@ class Follow(models.Model):
                 name='unique_follow'
             )
         ]
+        indexes = [
+            # Обратный к unique_follow: подписчики автора
+            models.Index(
+                fields=['author', 'user'], name='follow_author_user_idx'
+            ),
+        ]
 
     def __str__(self):
         return f'{self.user} подписан на {self.author}'